@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2015-2024 Guillaume Kulakowski <guillaume@kulakowski.fr>
+#
+# For the full copyright and license information, please view the LICENSE
+# file that was distributed with this source code.
+#
+
+import random
+import threading
+from cement import Controller, ex, fs
+from paramiko import SSHException
+from peewee import OperationalError
+from ..core.sync.broker import Broker, is_running
+
+
+class Daemon(Controller):
+    """
+    Controller with long-running concern.
+    """
+    class Meta:
+        help = 'long-running operations'
+        label = 'daemon'
+        stacked_on = 'base'
+        stacked_type = 'embedded'
+
+    @ex(help='run the synchronizations on intervals, in a single long-running process',
+        arguments=[(['-p', '--ping'],
+                   {'help': 'ping a service (ie: Healthchecks) during each synchronization',
+                    'action': 'store_true',
+                    'dest': 'ping'})])
+    def daemon(self):
+        """
+        Run blackhole and seedbox synchronizations on intervals, with the same
+        application, database and SSH transport.
+        """
+        # Options of the synchronizations
+        self.app.pargs.dry_run = False
+        self.app.pargs.only_store = False
+        self.app.pargs.watch = False
+        self.app.pargs.follow = False
+
+        # Hold pid files for the life of the daemon, synchronizations are then locked in process
+        self.app.lock.hold([self.app.config.get('pid', 'blackhole_path'), self.app.config.get('pid', 'download_path')])
+
+        stop = threading.Event()
+        self.__fatal = None
+        threads = []
+        for name in ('blackhole', 'seedbox'):
+            interval = self.app.config.get('daemon', '%s_interval' % name)
+            if interval is False:
+                continue
+
+            # Each synchronization runs with its own controller
+            sync = self.app.handler.get('controller', 'sync', setup=True)
+            thread = threading.Thread(target=self.__schedule,
+                                      args=(name, getattr(sync, name), float(interval), stop),
+                                      name='seedboxsync-%s' % name,
+                                      daemon=True)
+            thread.start()
+            threads.append(thread)
+
+        self.app.log.info('Daemon started with %s synchronization(s)' % len(threads))
+        try:
+            while not stop.wait(60):
+                pass
+
+            # A synchronization failed on an unexpected error (ie: an exit)
+            if self.__fatal is not None:
+                raise self.__fatal
+        finally:
+            # Running synchronizations are interrupted, downloads are resumed on the next run
+            stop.set()
+            self.app.lock.release()
+
+    @ex(help='share the SSH connection with the other commands, over a local socket')
+    def broker(self):
+        """
+        Hold the SSH connection and hand out its channels until interrupted.
+        """
+        path = self.app.config.get('seedbox', 'broker')
+        if path is False:
+            self.app.log.error('No broker socket configured')
+            self.app.exit_code = 1
+            return
+
+        path = fs.abspath(path)
+        if is_running(path):
+            self.app.log.info('Broker already running on "%s"' % path)
+            return
+
+        broker = Broker(self.app.log, self.app.sync, path)
+        try:
+            broker.serve_forever()
+        finally:
+            broker.close()
+
+    def __schedule(self, name: str, job, interval: float, stop: threading.Event):
+        """
+        Run a synchronization until the daemon stops, each run starting
+        ``interval`` seconds (plus a random jitter) after the end of the previous one.
+
+        :param str name: the synchronization name
+        :param callable job: the synchronization
+        :param float interval: the interval in seconds
+        :param Event stop: set when the daemon stops
+        """
+        jitter = float(self.app.config.get('daemon', 'jitter'))
+
+        # Spread the first runs too
+        while not stop.wait(random.uniform(0, jitter)):
+            self.app.log.debug('Run %s synchronization' % name)
+            try:
+                job()
+            except (SSHException, OSError, OperationalError) as exc:
+                self.app.log.error('SeedboxSyncError > %s synchronization: "%s"' % (name, exc))
+            except BaseException as exc:
+                # Stop the daemon, the error is raised again by the main thread
+                self.__fatal = exc
+                stop.set()
+                return
+            finally:
+                self.app._db.close()
+
+            if stop.wait(interval):
+                break
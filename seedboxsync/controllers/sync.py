@@ -8,13 +8,36 @@
 
 import datetime
 import glob
+import json
 import os
+import posixpath
 import re
+import select
+import shlex
+import tarfile
+import threading
+import time
+from contextlib import nullcontext
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import partial
+from stat import S_ISDIR
 from paramiko import SSHException
+from peewee import OperationalError, chunked
 from cement import Controller, ex, fs
 from ..core.dao.torrent import Torrent
 from ..core.dao.download import Download
+from ..core.db import INSERT_CHUNK, BatchedTransaction
 from ..core.exc import SeedboxSyncConfigurationError
+from ..core.inotify import IN_CLOSE_WRITE, IN_MOVED_TO, IN_Q_OVERFLOW, Inotify
+from ..core.sync.manifest import Manifest
+from ..core.sync.abstract_client import RemoteEntry
+from ..core.sync.checksum import checksum_command, hash_file, new_digest, parse_checksum
+from ..core.sync.concurrency import AdaptiveConcurrency
+from ..core.sync.pieces import get_layout
+from ..core.sync.pool import TransferPool
+from ..core.sync.scheduler import Scheduler
+from ..core.sync.segmented import get_segmented
+from ..core.sync.tar import extract_stream, tar_command
 
 
 class Sync(Controller):
@@ -32,7 +55,11 @@ class Sync(Controller):
                    (['-p', '--ping'],
                    {'help': 'ping a service (ie: Healthchecks) during excecution',
                     'action': 'store_true',
-                    'dest': 'ping'})])
+                    'dest': 'ping'}),
+                   (['-w', '--watch'],
+                   {'help': 'keep running and upload torrents as soon as they land in the watch folder (Linux only)',
+                    'action': 'store_true',
+                    'dest': 'watch'})])
     def blackhole(self):
         """
         Do the blackhole synchronization.
@@ -48,55 +75,42 @@ class Sync(Controller):
         lock_file = self.app.config.get('pid', 'blackhole_path')
         self.app.lock.lock_or_exit(lock_file)
 
-        # Get all torrents
-        torrents = glob.glob(fs.join(fs.abspath(self.app.config.get('local', 'watch_path')), '*.torrent'))
-        if len(torrents) > 0:
-            # Upload torrents one by one
-            for torrent_file in torrents:
-                torrent_name = os.path.basename(torrent_file)
-                if not self.app.pargs.dry_run:
-                    tmp_path = self.app.config.get('seedbox', 'tmp_path')
-                    watch_path = self.app.config.get('seedbox', 'watch_path')
-
-                    self.app.log.info('Upload torrent: "%s"' % torrent_name)
-                    self.app.log.debug('Upload "%s" in "%s" directory' % (torrent_file, tmp_path))
-
+        try:
+            # Get all torrents
+            watch_path = fs.abspath(self.app.config.get('local', 'watch_path'))
+            torrents = glob.glob(fs.join(watch_path, '*.torrent'))
+            if len(torrents) == 0:
+                self.app.log.info('No torrent in "%s"' % self.app.config.get('local', 'watch_path'))
+
+            if len(torrents) > 0 or self.app.pargs.watch:
+                # Infohashes of the torrents already sent, to skip duplicates
+                self.__sent_hashes = Torrent.get_info_hashes()
+                self.__sent_lock = threading.Lock()
+
+                # Upload torrents concurrently, and parse them while other uploads are in flight
+                workers = int(self.app.config.get('seedbox', 'max_parallel_uploads'))
+                with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='seedboxsync-parser') as parser:
+                    pool = None
+                    if not self.app.pargs.dry_run:
+                        pool = TransferPool(self.app,
+                                            workers=workers,
+                                            new_transport=self.app.config.get('seedbox', 'parallel_mode') == 'transport',
+                                            keep_cwd=False)
                     try:
-                        self.app.sync.put(torrent_file, os.path.join(tmp_path, torrent_name))
-
-                        # Chmod
-                        chmod = self.app.config.get('seedbox', 'chmod')
-                        if chmod is not False:
-                            self.app.log.debug('Change mod in %s' % chmod)
-                            self.app.sync.chmod(os.path.join(tmp_path, torrent_name), int(chmod, 8))
-
-                        # Move from tmp
-                        self.app.log.debug('Move from "%s" to "%s"' % (tmp_path, watch_path))
-                        self.app.sync.rename(os.path.join(tmp_path, torrent_name), os.path.join(watch_path, torrent_name))
-
-                        # Store in DB
-                        torrent_info = self.app.bcoding.get_torrent_infos(torrent_file)
-                        torrent = Torrent.create(name=torrent_name)
-                        if torrent_info is not None:
-                            torrent.announce = torrent_info['announce']
-                            torrent.save()
-
-                            # Remove local torent
-                            self.app.log.debug('Remove local torrent "%s"' % torrent_file)
-                            os.remove(torrent_file)
-                        else:
-                            self.app.log.warning('Rename local "%s" to .torrent.fail' % torrent_file)
-                            os.rename(torrent_file, torrent_file + '.fail')
-                    except SSHException as exc:
-                        self.app.log.warning('SSH client exception > %s' % str(exc))
-
-                else:
-                    self.app.log.info('Not upload torrent: "%s"' % torrent_name)
-        else:
-            self.app.log.info('No torrent in "%s"' % self.app.config.get('local', 'watch_path'))
-
-        # Remove lock file.
-        self.app.lock.unlock(lock_file)
+                        self.__put_torrents(torrents, pool, parser)
+                        if self.app.pargs.watch:
+                            self.__watch_blackhole(watch_path, pool, parser)
+                    except BaseException:
+                        # Interrupted (ie: by a signal), only wait for the running uploads
+                        if pool is not None:
+                            pool.cancel()
+                        raise
+                    finally:
+                        if pool is not None:
+                            pool.join()
+        finally:
+            # Remove lock file, also when stopped by an error or a signal
+            self.app.lock.unlock(lock_file)
 
         # Call ping_start_hook
         if self.app.pargs.ping:
@@ -115,7 +129,11 @@ class Sync(Controller):
                    (['-p', '--ping'],
                    {'help': 'ping a service (ie: Healthchecks) during excecution',
                     'action': 'store_true',
-                    'dest': 'ping'})])
+                    'dest': 'ping'}),
+                   (['-f', '--follow'],
+                   {'help': 'keep running and download files as soon as they are finished on the seedbox',
+                    'action': 'store_true',
+                    'dest': 'follow'})])
     def seedbox(self):
         """
         Do the synchronization.
@@ -133,42 +151,604 @@ class Sync(Controller):
         lock_file = self.app.config.get('pid', 'download_path')
         self.app.lock.lock_or_exit(lock_file)
 
-        finished_path = self.app.config.get('seedbox', 'finished_path')
-        part_suffix = self.app.config.get('seedbox', 'part_suffix')
-        self.app.log.debug('Get file list in "%s"' % finished_path)
-
-        # Get all files
         try:
-            self.app.sync.chdir(finished_path)
-            for walker in self.app.sync.walk(''):
-                for filename in walker[2]:
-                    filepath = os.path.join(walker[0], filename)
-                    if os.path.splitext(filename)[1] == part_suffix:
-                        self.app.log.debug('Skip part file "%s"' % filename)
-                    elif Download.is_already_download(filepath):
-                        self.app.log.debug('Skip already downloaded "%s"' % filename)
-                    elif self.__exclude_by_pattern(filepath):
-                        self.app.log.debug('Skip excluded by pattern "%s"' % filename)
-                    else:
-                        if not self.app.pargs.dry_run:
-                            self.__get_file(filepath)
-                        else:
-                            self.app.log.info('Not download "%s"' % filepath)
-        except (IOError, FileNotFoundError) as exc:
-            self.app.log.error('SeedboxSyncError > "%s"' % exc)
-
-        # Remove lock file.
-        self.app.lock.unlock(lock_file)
+            finished_path = self.app.config.get('seedbox', 'finished_path')
+            self.app.log.debug('Get file list in "%s"' % finished_path)
+
+            # Get all files
+            pool = None
+            self.__queued = set()
+            self.__deferred = []
+            self.__scheduler = Scheduler(self.app.config.get('seedbox', 'download_order'),
+                                         self.app.config.get('seedbox', 'download_priorities'),
+                                         self.app.config.get('seedbox', 'huge_threshold'))
+            self.__concurrency = None
+            self.__verifier = None
+            self.__verify_error = None
+            self.__checksum = self.app.config.get('seedbox', 'checksum')
+            if self.__checksum:
+                # Check the algorithm before any download
+                new_digest(self.__checksum)
+            self.__moved_files = self.app.config.get('seedbox', 'moved_files')
+            if self.__moved_files not in (False, 'rename', 'hardlink'):
+                raise SeedboxSyncConfigurationError('Bad configuration for moved_files ! Use "rename", "hardlink" or false')
+            downloaded = Download.get_downloaded_paths()
+            self.app.log.debug('%s file(s) already downloaded' % len(downloaded))
+            try:
+                # From the home directory, the daemon runs this task again
+                self.app.sync.chdir()
+                self.app.sync.chdir(finished_path)
+
+                # Start the download workers
+                if not self.app.pargs.dry_run and not self.app.pargs.only_store:
+                    workers = int(self.app.config.get('seedbox', 'max_parallel_downloads'))
+                    if self.app.config.get('seedbox', 'adaptive_concurrency'):
+                        self.__concurrency = AdaptiveConcurrency(self.app.log,
+                                                                 minimum=int(self.app.config.get('seedbox', 'min_parallel_downloads')),
+                                                                 maximum=workers,
+                                                                 interval=float(self.app.config.get('seedbox', 'adaptive_interval')))
+                    pool = TransferPool(self.app,
+                                        workers=workers,
+                                        new_transport=self.app.config.get('seedbox', 'parallel_mode') == 'transport',
+                                        concurrency=self.__concurrency)
+
+                    # Checksums are compared with the seedbox ones while the next files are downloaded
+                    if self.__checksum and self.app.config.get('seedbox', 'checksum_command'):
+                        self.__remote_root = self.app.sync.normalize('.')
+                        self.__verifier = ThreadPoolExecutor(max_workers=1, thread_name_prefix='seedboxsync-verifier')
+
+                # Walk with a single find command, or with the manifest to skip unchanged directories
+                manifest = None
+                walk = self.app.sync.walk
+                if self.app.config.get('seedbox', 'listing') == 'find':
+                    walk = self.app.sync.find
+                elif self.app.config.get('seedbox', 'manifest'):
+                    manifest = Manifest(self.app, finished_path)
+                    walk = partial(manifest.walk, self.app.sync)
+
+                # Rows stored without download are inserted and committed by batches,
+                # downloads keep the database free for the workers
+                batch_size = int(self.app.config.get('local.db', 'batch_size'))
+                to_store = []
+                with BatchedTransaction(self.app._db, batch_size) if self.app.pargs.only_store else nullcontext() as batch:
+                    for walker in walk('', workers=int(self.app.config.get('seedbox', 'walk_workers'))):
+                        to_download = []
+                        for filepath, entry in self.__select_files(walker[0], walker[2], downloaded):
+                            if self.app.pargs.dry_run:
+                                self.app.log.info('Not download "%s"' % filepath)
+                            elif self.app.pargs.only_store:
+                                self.app.log.info('Mark as downloaded "%s"' % filepath)
+                                to_store.append((filepath, entry.size, entry.mtime))
+                                if len(to_store) >= batch_size:
+                                    batch.tick(self.__store_files(to_store))
+                                    to_store = []
+                            else:
+                                to_download.append((filepath, entry))
+
+                        self.__queue_files(pool, walker[0], to_download)
+
+                    if len(to_store) > 0:
+                        self.__store_files(to_store)
+
+                if manifest is not None:
+                    manifest.save()
+
+                if pool is not None:
+                    self.__queue_deferred(pool)
+
+                # Then download files as soon as they are finished
+                if self.app.pargs.follow and pool is not None:
+                    self.__follow_seedbox(pool, partial(walk, '', workers=int(self.app.config.get('seedbox', 'walk_workers'))), manifest)
+            except (IOError, FileNotFoundError) as exc:
+                self.app.log.error('SeedboxSyncError > "%s"' % exc)
+            except BaseException:
+                # Interrupted (ie: by a signal), only wait for the running downloads
+                if pool is not None:
+                    pool.cancel()
+                raise
+            finally:
+                # Wait for queued downloads, then for their checksums
+                if pool is not None:
+                    pool.join()
+                if self.__verifier is not None:
+                    self.__verifier.shutdown()
+                    if self.__verify_error is not None:
+                        raise self.__verify_error
+        finally:
+            # Remove lock file, also when stopped by an error or a signal
+            self.app.lock.unlock(lock_file)
 
         # Call ping_start_hook
         if self.app.pargs.ping:
             for res in self.app.hook.run('ping_success_hook', self.app, 'sync_seedbox'):
                 pass
 
-    def __get_file(self, filepath):
+    def __follow_seedbox(self, pool: TransferPool, walk, manifest: Manifest = None):
+        """
+        Download files as soon as they are written or moved in the finished
+        path, from the events of a command run on the seedbox (inotifywait),
+        until interrupted. The whole tree is walked again periodically, for
+        the lost events.
+
+        :param TransferPool pool: the download pool
+        :param callable walk: walk the whole tree
+        :param Manifest manifest: the manifest used by walk, if any
+        """
+        root = self.app.sync.normalize('')
+        command = '%s %s' % (self.app.config.get('seedbox', 'follow_command'), shlex.quote(root))
+        reconcile = int(self.app.config.get('seedbox', 'follow_reconcile'))
+        self.app.log.debug('Follow with: %s' % command)
+
+        channel = None
+        pending = b''
+        next_reconcile = time.monotonic() + reconcile
+        try:
+            while True:
+                if channel is None:
+                    try:
+                        channel = self.app.sync.execute(command)
+                        self.app.log.info('Follow "%s"' % root)
+                    except SSHException as exc:
+                        self.app.log.error('Follow command fail: %s' % str(exc))
+
+                # Wait for events until the next reconcile
+                timeout = max(0, next_reconcile - time.monotonic())
+                if channel is None:
+                    time.sleep(timeout)
+                elif len(select.select([channel], [], [], timeout)[0]) > 0:
+                    data = channel.recv(32768)
+                    if len(data) > 0:
+                        events = (pending + data).split(b'\n')
+                        pending = events.pop()
+                        for event in events:
+                            self.__follow_event(pool, os.path.relpath(event.decode('utf-8', 'replace'), root))
+                    else:
+                        error = channel.recv_stderr(32768).decode('utf-8', 'replace').strip()
+                        self.app.log.error('Follow command returned %s: %s' % (channel.recv_exit_status(), error))
+                        channel.close()
+                        channel = None
+                        pending = b''
+                        time.sleep(min(timeout, 60))
+
+                if time.monotonic() >= next_reconcile:
+                    self.app.log.info('Reconcile "%s"' % root)
+                    downloaded = Download.get_downloaded_paths()
+                    for walker in walk():
+                        self.__queue_files(pool, walker[0], list(self.__select_files(walker[0], walker[2], downloaded)))
+                    if manifest is not None:
+                        manifest.save()
+                    next_reconcile = time.monotonic() + reconcile
+        finally:
+            if channel is not None:
+                channel.close()
+
+    def __follow_event(self, pool: TransferPool, filepath: str):
+        """
+        Queue the download of a file, or of a directory tree, from a follow event.
+
+        :param TransferPool pool: the download pool
+        :param str filepath: the path relative to the finished path
+        """
+        if filepath.startswith('..'):
+            return
+
+        try:
+            attributes = self.app.sync.stat(filepath)
+        except FileNotFoundError:
+            self.app.log.debug('Skip removed "%s"' % filepath)
+            return
+
+        # A whole directory may be moved in the finished path
+        if S_ISDIR(attributes.st_mode):
+            walkers = self.app.sync.walk(filepath)
+        else:
+            entry = RemoteEntry(os.path.basename(filepath), attributes.st_size, attributes.st_mtime, attributes.st_mode)
+            walkers = [(os.path.dirname(filepath), [], [entry])]
+
+        for walker in walkers:
+            paths = [os.path.join(walker[0], entry.name) for entry in walker[2]]
+            files = self.__select_files(walker[0], walker[2], {path for path in paths if Download.is_already_download(path)})
+            self.__queue_files(pool, walker[0], list(files))
+
+    def __watch_blackhole(self, watch_path: str, pool: TransferPool, parser: ThreadPoolExecutor):
+        """
+        Upload torrents as soon as they are written or moved in the watch
+        folder, until interrupted. A burst of torrents is uploaded as one batch.
+
+        :param str watch_path: the local watch folder
+        :param TransferPool pool: the upload pool (None on dry-run)
+        :param ThreadPoolExecutor parser: the torrent parsers
+        """
+        debounce = float(self.app.config.get('local', 'watch_debounce'))
+        inotify = Inotify()
+        try:
+            inotify.add_watch(watch_path, IN_CLOSE_WRITE | IN_MOVED_TO)
+            self.app.log.info('Watch "%s"' % watch_path)
+
+            batch = set()
+            deadline = None
+            while True:
+                timeout = None if deadline is None else max(0, deadline - time.monotonic())
+                for wd, mask, cookie, name in inotify.read(timeout):
+                    if mask & IN_Q_OVERFLOW:
+                        self.app.log.warning('Too many events, scan "%s"' % watch_path)
+                        batch.update(glob.glob(fs.join(watch_path, '*.torrent')))
+                    elif name.endswith('.torrent'):
+                        batch.add(os.path.join(watch_path, name))
+
+                # Wait a bit after the first torrent, for the next ones of a burst
+                if deadline is None and len(batch) > 0:
+                    deadline = time.monotonic() + debounce
+                elif deadline is not None and time.monotonic() >= deadline:
+                    self.__put_torrents(sorted(path for path in batch if os.path.isfile(path)), pool, parser)
+                    batch = set()
+                    deadline = None
+        finally:
+            inotify.close()
+
+    def __put_torrents(self, torrents: list, pool: TransferPool, parser: ThreadPoolExecutor):
+        """
+        Queue torrents uploads.
+
+        :param list torrents: the local torrent files
+        :param TransferPool pool: the upload pool (None on dry-run)
+        :param ThreadPoolExecutor parser: the torrent parsers
+        """
+        for torrent_file in torrents:
+            if pool is None:
+                self.app.log.info('Not upload torrent: "%s"' % os.path.basename(torrent_file))
+            else:
+                torrent_info = parser.submit(self.app.bcoding.get_torrent_infos, torrent_file)
+                pool.submit(self.__put_torrent, torrent_file, torrent_info)
+
+    def __select_files(self, directory: str, files: list, downloaded: set):
+        """
+        Filter the files of a directory to sync, yielding ``(filepath, entry)``.
+        Part files, files already downloaded or queued and excluded files are
+        skipped.
+
+        :param str directory: the directory of the files
+        :param list files: the files, as ``RemoteEntry``
+        :param set downloaded: the paths already downloaded
+        """
+        part_suffix = self.app.config.get('seedbox', 'part_suffix')
+        for entry in files:
+            filename = entry.name
+            filepath = os.path.join(directory, filename)
+            if os.path.splitext(filename)[1] == part_suffix:
+                self.app.log.debug('Skip part file "%s"' % filename)
+            elif filepath in downloaded or filepath in self.__queued:
+                self.app.log.debug('Skip already downloaded "%s"' % filename)
+            elif self.__exclude_by_pattern(filepath):
+                self.app.log.debug('Skip excluded by pattern "%s"' % filename)
+            else:
+                yield filepath, entry
+
+    def __queue_files(self, pool: TransferPool, directory: str, files: list):
+        """
+        Queue the downloads of files of a directory, in the order of the
+        scheduler. Small files are fetched together by tar. During the first
+        walk, huge files are held back until its end.
+
+        :param TransferPool pool: the download pool
+        :param str directory: the directory of the files
+        :param list files: the (filepath, RemoteEntry) to download
+        """
+        tar_threshold = self.app.config.get('seedbox', 'tar_threshold')
+        small_files = []
+        for filepath, entry in files:
+            priority = self.__scheduler.priority(filepath, entry.size, entry.mtime)
+            moved = self.__find_moved(entry)
+            if len(moved) > 0:
+                self.__submit(pool, [filepath], priority, self.__get_moved, filepath, entry, moved)
+            elif self.__deferred is not None and self.__scheduler.is_huge(entry.size):
+                self.app.log.debug('Defer huge file "%s"' % filepath)
+                self.__deferred.append((directory, filepath, entry))
+            elif tar_threshold is not False and entry.size is not None and entry.size < int(tar_threshold):
+                small_files.append((filepath, entry.size, entry.mtime, priority))
+            else:
+                self.__submit(pool, [filepath], priority, self.__get_file, filepath, entry.size, entry.mtime)
+
+        # Small files of a directory fetched together
+        for files in chunked(small_files, int(self.app.config.get('seedbox', 'tar_max_files'))):
+            priority = min(file[3] for file in files)
+            if len(files) > 1:
+                self.__submit(pool, [file[0] for file in files], priority, self.__get_files, directory, [file[:3] for file in files])
+            else:
+                self.__submit(pool, [files[0][0]], priority, self.__get_file, *files[0][:3])
+
+    def __queue_deferred(self, pool: TransferPool):
+        """
+        Queue the huge files held back during the first walk.
+
+        :param TransferPool pool: the download pool
+        """
+        deferred = self.__deferred
+        self.__deferred = None
+        for directory, filepath, entry in deferred:
+            self.__queue_files(pool, directory, [(filepath, entry)])
+
+    def __submit(self, pool: TransferPool, paths: list, priority: tuple, func, *args):
+        """
+        Queue a download job, its paths are known as queued until its end.
+
+        :param TransferPool pool: the download pool
+        :param list paths: the paths downloaded by the job
+        :param tuple priority: the priority of the job
+        :param callable func: the job
+        """
+        self.__queued.update(paths)
+
+        def job(client, *args):
+            try:
+                func(client, *args)
+            finally:
+                self.__queued.difference_update(paths)
+
+        pool.submit(job, *args, priority=priority)
+
+    def __put_torrent(self, client, torrent_file: str, torrent_info: Future):
+        """
+        Upload a torrent and store it, unless its infohash was already sent.
+
+        :param AbstractClient client: the transport client to use
+        :param str torrent_file: the local torrent file
+        :param Future torrent_info: the torrent information, parsed during other uploads
+        """
+        torrent_name = os.path.basename(torrent_file)
+        tmp_path = self.app.config.get('seedbox', 'tmp_path')
+        watch_path = self.app.config.get('seedbox', 'watch_path')
+
+        # Skip a torrent already sent, or sent by another worker
+        torrent_info = torrent_info.result()
+        info_hash = None if torrent_info is None else torrent_info['info_hash']
+        if info_hash is not None:
+            with self.__sent_lock:
+                duplicate = info_hash in self.__sent_hashes
+                self.__sent_hashes.add(info_hash)
+            if duplicate:
+                self.app.log.info('Torrent already sent: "%s", remove it' % torrent_name)
+                os.remove(torrent_file)
+                return
+
+        self.app.log.info('Upload torrent: "%s"' % torrent_name)
+        self.app.log.debug('Upload "%s" in "%s" directory' % (torrent_file, tmp_path))
+
+        # Upload, chmod and move from tmp
+        chmod = self.app.config.get('seedbox', 'chmod')
+        if chmod is not False:
+            self.app.log.debug('Change mod in %s' % chmod)
+        self.app.log.debug('Move from "%s" to "%s"' % (tmp_path, watch_path))
+        try:
+            client.upload(torrent_file,
+                          os.path.join(tmp_path, torrent_name),
+                          os.path.join(watch_path, torrent_name),
+                          None if chmod is False else int(chmod, 8))
+        except (IOError, SSHException) as exc:
+            self.app.log.warning('Upload fail: %s' % str(exc))
+            with self.__sent_lock:
+                self.__sent_hashes.discard(info_hash)
+            return
+
+        # Store in DB
+        if torrent_info is not None:
+            # Keep the pieces, to verify the downloads
+            try:
+                piece_length, pieces, files = get_layout(torrent_info['info'])
+            except (KeyError, TypeError, ValueError) as exc:
+                self.app.log.warning('No pieces for torrent "%s": %s' % (torrent_name, str(exc)))
+                piece_length, pieces, files = None, None, None
+
+            Torrent.create(name=torrent_name,
+                           announce=torrent_info['announce'],
+                           piece_length=piece_length,
+                           pieces=pieces,
+                           files=None if files is None else json.dumps(files),
+                           info_hash=info_hash)
+
+            # Remove local torent
+            self.app.log.debug('Remove local torrent "%s"' % torrent_file)
+            os.remove(torrent_file)
+        else:
+            self.app.log.warning('Rename local "%s" to .torrent.fail' % torrent_file)
+            os.rename(torrent_file, torrent_file + '.fail')
+
+    def __get_file(self, client, filepath: str, seedbox_size: int = None, seedbox_mtime: int = None):
         """
         Download a single file.
 
+        :param AbstractClient client: the transport client to use
+        :param str filepath: the filepath
+        :param int seedbox_size: the size from the listing, stat the file if unknown
+        :param int seedbox_mtime: the mtime from the listing
+        """
+        local_filepath, local_filepath_part = self.__get_local_paths(filepath)
+
+        try:
+            if seedbox_size is None:
+                attributes = client.stat(filepath)
+                seedbox_size, seedbox_mtime = attributes.st_size, attributes.st_mtime
+            download = self.__start_download(filepath, seedbox_size, seedbox_mtime, local_filepath_part)
+
+            # Get file with ".part" suffix
+            self.app.log.info('Download "%s"' % filepath)
+            callback = None if self.__concurrency is None else self.__concurrency.record
+            digest = new_digest(self.__checksum) if self.__checksum else None
+            segmented_threshold = self.app.config.get('seedbox', 'segmented_threshold')
+            if segmented_threshold is not False and seedbox_size >= int(segmented_threshold):
+                get_segmented(self.app.log, client, filepath, local_filepath_part, seedbox_size,
+                              segments=int(self.app.config.get('seedbox', 'segments')),
+                              new_transport=self.app.config.get('seedbox', 'parallel_mode') == 'transport',
+                              concurrency=self.__concurrency, callback=callback)
+                # Ranges are not written in order, hash the file while still in cache
+                if digest is not None:
+                    hash_file(local_filepath_part, digest)
+            elif self.app.config.get('seedbox', 'resume') and 0 < self.__local_size(local_filepath_part) < seedbox_size:
+                client.resume(filepath, local_filepath_part, overlap=int(self.app.config.get('seedbox', 'resume_overlap')),
+                              callback=callback, digest=digest)
+            else:
+                client.get(filepath, local_filepath_part, callback=callback, digest=digest)
+
+            return self.__end_download(download, local_filepath, local_filepath_part, digest)
+        except SSHException as exc:
+            self.app.log.error('Download fail: %s' % str(exc))
+
+    def __get_files(self, client, directory: str, files: list):
+        """
+        Download small files of a directory together, in a single tar stream
+        extracted while it is received. Each file keeps its own row and size
+        check. Fallback to single downloads if tar can't be run, and for the
+        files missing from the stream.
+
+        :param AbstractClient client: the transport client to use
+        :param str directory: the directory of the files
+        :param list files: the (filepath, seedbox_size, seedbox_mtime) to download
+        """
+        destinations = {}
+        downloads = {}
+        with self.app._db.atomic('IMMEDIATE'):
+            for filepath, seedbox_size, seedbox_mtime in files:
+                name = os.path.basename(filepath)
+                destinations[name] = self.__get_local_paths(filepath)
+                downloads[name] = self.__start_download(filepath, seedbox_size, seedbox_mtime, destinations[name][1])
+
+        try:
+            channel = client.execute(tar_command(client.normalize(directory), list(destinations)))
+        except SSHException as exc:
+            self.app.log.warning('Exec not allowed (%s), fallback to single downloads' % str(exc))
+            for filepath, seedbox_size, seedbox_mtime in files:
+                self.__get_file(client, filepath, seedbox_size, seedbox_mtime)
+            return
+        self.app.log.info('Download %s files of "%s" by tar' % (len(files), directory))
+
+        try:
+            parts = {name: paths[1] for name, paths in destinations.items()}
+            digests = {name: new_digest(self.__checksum) for name in destinations} if self.__checksum else {}
+            for name, size in extract_stream(channel.makefile('rb'), parts, callback=client.throttle('download'), digests=digests):
+                self.app.log.info('Download "%s"' % os.path.join(directory, name))
+                if self.__concurrency is not None:
+                    self.__concurrency.record(size)
+                self.__end_download(downloads.pop(name), *destinations[name], digest=digests.get(name))
+            status = channel.recv_exit_status()
+        except (tarfile.TarError, SSHException) as exc:
+            self.app.log.error('Tar download fail: %s' % str(exc))
+            status = -1
+        finally:
+            channel.close()
+
+        if status != 0:
+            self.app.log.warning('Tar returned %s for "%s"' % (status, directory))
+
+        # Files missing from the stream (ie: unreadable, or links with an old tar) are downloaded alone
+        for filepath, seedbox_size, seedbox_mtime in files:
+            if os.path.basename(filepath) in downloads:
+                if len(downloads) < len(files):
+                    self.app.log.warning('"%s" not in tar stream, download it alone' % filepath)
+                self.__get_file(client, filepath, seedbox_size, seedbox_mtime)
+
+    def __find_moved(self, entry: RemoteEntry):
+        """
+        Get the finished downloads of the same identity as a remote file: same
+        size and seedbox mtime, with a local file of this size. Empty if
+        moved files are not searched.
+
+        :param RemoteEntry entry: the remote file
+        """
+        if self.__moved_files is False or entry.size is None or entry.mtime is None or entry.size == 0:
+            return []
+
+        download_path = self.app.config.get('local', 'download_path')
+        return [download for download in Download.get_by_identity(entry.size, int(entry.mtime))
+                if self.__local_size(fs.join(download_path, download.path)) == entry.size]
+
+    def __get_moved(self, client, filepath: str, entry: RemoteEntry, moved: list):
+        """
+        Get a file moved or renamed on the seedbox from an already downloaded
+        file: the local file is renamed, or hardlinked, and its download row is
+        updated, or copied. Fallback to a download if no local file matches.
+
+        Downloads of the same name are tried first. Each one is only reused if
+        samples of both files match: the size and mtime are shared by other
+        files (ie: split archive volumes).
+
+        :param AbstractClient client: the transport client to use
+        :param str filepath: the filepath
+        :param RemoteEntry entry: the remote file
+        :param list moved: the downloads of the same identity, from ``__find_moved``
+        """
+        download_path = self.app.config.get('local', 'download_path')
+        local_filepath = self.__get_local_paths(filepath)[0]
+        same_name = [download for download in moved if os.path.basename(download.path) == os.path.basename(filepath)]
+        if len(same_name) > 0:
+            moved = same_name
+
+        for download in moved:
+            old_local_filepath = fs.join(download_path, download.path)
+            if not os.path.isfile(old_local_filepath):
+                continue
+
+            try:
+                sample = int(self.app.config.get('seedbox', 'moved_sample'))
+                if not self.__same_samples(client, filepath, old_local_filepath, entry.size, sample):
+                    self.app.log.debug('Samples mismatch: "%s" is not "%s"' % (filepath, download.path))
+                    continue
+
+                # Rename only if the old file is gone, the other one would be downloaded again
+                if self.__moved_files == 'rename' and not self.__remote_exists(client, download.path):
+                    self.app.log.info('Moved "%s", rename from "%s"' % (filepath, download.path))
+                    os.rename(old_local_filepath, local_filepath)
+                    Download.update(path=filepath).where(Download.id == download.id).execute()
+                else:
+                    self.app.log.info('Moved "%s", hardlink from "%s"' % (filepath, download.path))
+                    os.link(old_local_filepath, local_filepath)
+                    Download.create(path=filepath,
+                                    seedbox_size=download.seedbox_size,
+                                    seedbox_mtime=download.seedbox_mtime,
+                                    local_size=download.local_size,
+                                    finished=datetime.datetime.now(),
+                                    checksum=download.checksum)
+                return True
+            except (IOError, SSHException) as exc:
+                self.app.log.warning('Moved file not reused "%s": %s' % (filepath, str(exc)))
+
+        return self.__get_file(client, filepath, entry.size, entry.mtime)
+
+    def __same_samples(self, client, filepath: str, local_filepath: str, size: int, sample: int):
+        """
+        Compare chunks at the start, the middle and the end of a remote file
+        with the ones of a local file of the same size.
+
+        :param AbstractClient client: the transport client to use
+        :param str filepath: the remote filepath
+        :param str local_filepath: the local filepath
+        :param int size: the size of both files
+        :param int sample: the size of each chunk
+        """
+        sample = min(sample, size)
+        chunks = sorted({(offset, sample) for offset in (0, (size - sample) // 2, size - sample)})
+        with open(local_filepath, 'rb') as local:
+            local_chunks = [os.pread(local.fileno(), length, offset) for offset, length in chunks]
+
+        return client.readv(filepath, chunks) == local_chunks
+
+    def __remote_exists(self, client, filepath: str):
+        """
+        Get if a file exists on the seedbox.
+
+        :param AbstractClient client: the transport client to use
+        :param str filepath: the filepath
+        """
+        try:
+            client.stat(filepath)
+            return True
+        except FileNotFoundError:
+            return False
+
+    def __get_local_paths(self, filepath: str):
+        """
+        Get the local path and the local ".part" path of a file, and make its
+        folder tree.
+
         :param str filepath: the filepath
         """
         # Local path (without seedbox folder prefix)
@@ -177,44 +757,154 @@ class Sync(Controller):
         local_filepath_part = local_filepath + part_suffix
         local_path = os.path.dirname(fs.abspath(local_filepath))
 
-        # Make folder tree
-        if not self.app.pargs.only_store:
-            fs.ensure_dir_exists(local_path)
+        # Make folder tree, workers may create the same one at the same time
+        os.makedirs(local_path, exist_ok=True)
         self.app.log.debug('Download: "%s" in "%s"' % (filepath, local_path))
 
-        try:
-            # Start timestamp in database
-            seedbox_size = self.app.sync.stat(filepath).st_size
-            if seedbox_size == 0:
-                self.app.log.warning('Empty file: "%s" (%s)' % (filepath, str(seedbox_size)))
+        return local_filepath, local_filepath_part
 
-            download = Download.create(path=filepath,
-                                       seedbox_size=seedbox_size)
-            download.save()
+    def __start_download(self, filepath: str, seedbox_size: int, seedbox_mtime: int = None, local_filepath_part: str = None):
+        """
+        Store the start of a download in database. The ".part" file left by an
+        interrupted download of another version of the file (other size or
+        mtime) is removed, not to be resumed.
 
-            # Get file with ".part" suffix
-            if not self.app.pargs.only_store:
-                self.app.log.info('Download "%s"' % filepath)
-                self.app.sync.get(filepath, local_filepath_part)
-                local_size = os.stat(local_filepath_part).st_size
-
-                # Test size of the downloaded file
-                if (local_size == 0) or (local_size != seedbox_size):
-                    self.app.log.error('Download fail: "%s" (%s/%s)' % (filepath, str(local_size), str(seedbox_size)))
-                    return False
-
-                # All is good ! Remove ".part" suffix
-                os.rename(local_filepath_part, local_filepath)
+        :param str filepath: the filepath
+        :param int seedbox_size: the size of the file on the seedbox
+        :param int seedbox_mtime: the mtime of the file on the seedbox
+        :param str local_filepath_part: the local ".part" file
+        """
+        if seedbox_size == 0:
+            self.app.log.warning('Empty file: "%s" (%s)' % (filepath, str(seedbox_size)))
+
+        # Reuse the row left by an interrupted download, write lock taken
+        # first as other workers may write in the meantime
+        with self.app._db.atomic('IMMEDIATE'):
+            download = Download.get_in_progress(filepath)
+            if download is None:
+                download = Download.create(path=filepath,
+                                           seedbox_size=seedbox_size,
+                                           seedbox_mtime=seedbox_mtime)
             else:
-                self.app.log.info('Mark as downloaded "%s"' % filepath)
-                local_size = seedbox_size
+                self.app.log.debug('Reuse in progress download #%s of "%s"' % (download.id, filepath))
+                same_mtime = None in (download.seedbox_mtime, seedbox_mtime) or download.seedbox_mtime == int(seedbox_mtime)
+                if (download.seedbox_size != seedbox_size or not same_mtime) and local_filepath_part is not None and os.path.exists(local_filepath_part):
+                    self.app.log.warning('File changed on the seedbox, restart "%s"' % filepath)
+                    os.remove(local_filepath_part)
+                download.seedbox_size = seedbox_size
+                download.seedbox_mtime = seedbox_mtime
+                download.save()
+
+        return download
+
+    def __end_download(self, download: Download, local_filepath: str, local_filepath_part: str, digest=None):
+        """
+        Check the size of a downloaded ".part" file, rename it and store the
+        end of the download in database, with its checksum.
 
-            # Store in database
-            download.local_size = local_size
-            download.finished = datetime.datetime.now()
-            download.save()
-        except SSHException as exc:
-            self.app.log.error('Download fail: %s' % str(exc))
+        :param Download download: the download row
+        :param str local_filepath: the final local file
+        :param str local_filepath_part: the downloaded file
+        :param digest: the digest of the downloaded file (None = no checksum)
+        """
+        local_size = os.stat(local_filepath_part).st_size
+
+        # Test size of the downloaded file
+        if (local_size == 0) or (local_size != download.seedbox_size):
+            self.app.log.error('Download fail: "%s" (%s/%s)' % (download.path, str(local_size), str(download.seedbox_size)))
+            return False
+
+        # All is good ! Remove ".part" suffix
+        os.rename(local_filepath_part, local_filepath)
+
+        # Store in database
+        download.local_size = local_size
+        download.finished = datetime.datetime.now()
+        if digest is not None:
+            download.checksum = '%s:%s' % (self.__checksum, digest.hexdigest())
+        download.save()
+
+        if digest is not None and self.__verifier is not None:
+            self.__verifier.submit(self.__verify, download).add_done_callback(self.__verified)
+
+        return True
+
+    def __verify(self, download: Download):
+        """
+        Compare the checksum of a download with the one computed on the
+        seedbox. On mismatch, the download is marked as unfinished, to be
+        downloaded again by the next sync.
+
+        :param Download download: the download row
+        """
+        command = checksum_command(self.app.config.get('seedbox', 'checksum_command'), posixpath.join(self.__remote_root, download.path))
+        try:
+            channel = self.app.sync.execute(command)
+            try:
+                output = channel.makefile('rb').read()
+                status = channel.recv_exit_status()
+            finally:
+                channel.close()
+
+            if status != 0:
+                self.app.log.warning('Checksum not verified, command returned %s for "%s"' % (status, download.path))
+                return
+
+            checksum = download.checksum.split(':', 1)[1]
+            remote_checksum = parse_checksum(output)
+            if remote_checksum == checksum:
+                self.app.log.debug('Checksum verified for "%s"' % download.path)
+            else:
+                self.app.log.error('Checksum mismatch: "%s" (%s/%s), download again' % (download.path, checksum, remote_checksum))
+                Download.update(finished=0, checksum=None).where(Download.id == download.id).execute()
+        except (SSHException, OSError, OperationalError) as exc:
+            self.app.log.warning('Checksum not verified for "%s": %s' % (download.path, str(exc)))
+        finally:
+            self.app._db.close()
+
+    def __verified(self, future: Future):
+        """
+        Keep the first unexpected error of a checksum verification (ie: an
+        exit), raised again by the main thread once the verifications are done.
+
+        :param Future future: the verification
+        """
+        if future.exception() is not None and self.__verify_error is None:
+            self.__verify_error = future.exception()
+
+    def __store_files(self, files: list):
+        """
+        Store files as downloaded, without download, in a single insert.
+
+        :param list files: the (filepath, seedbox_size, seedbox_mtime) to store, size is stat if unknown
+        """
+        now = datetime.datetime.now()
+        rows = []
+        for filepath, seedbox_size, seedbox_mtime in files:
+            if seedbox_size is None:
+                attributes = self.app.sync.stat(filepath)
+                seedbox_size, seedbox_mtime = attributes.st_size, attributes.st_mtime
+            rows.append({'path': filepath,
+                         'seedbox_size': seedbox_size,
+                         'seedbox_mtime': seedbox_mtime,
+                         'local_size': seedbox_size,
+                         'started': now,
+                         'finished': now})
+
+        for chunk in chunked(rows, INSERT_CHUNK):
+            Download.insert_many(chunk).execute()
+        return len(rows)
+
+    def __local_size(self, local_filepath: str):
+        """
+        Get the size of a local file, 0 if not exists.
+
+        :param str local_filepath: the local filepath
+        """
+        try:
+            return os.stat(local_filepath).st_size
+        except FileNotFoundError:
+            return 0
 
     def __exclude_by_pattern(self, filepath: str):
         """
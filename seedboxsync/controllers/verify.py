@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2015-2024 Guillaume Kulakowski <guillaume@kulakowski.fr>
+#
+# For the full copyright and license information, please view the LICENSE
+# file that was distributed with this source code.
+#
+
+import os
+from cement import Controller, ex, fs
+from paramiko import SSHException
+from ..core.dao.download import Download
+from ..core.dao.torrent import Torrent
+from ..core.sync.pieces import file_starts, hash_pieces, piece_segments
+
+
+class Verify(Controller):
+    """
+    Controller with verify concern.
+    """
+    class Meta:
+        help = 'verify operations'
+        label = 'verify'
+        stacked_on = 'base'
+        stacked_type = 'embedded'
+
+    @ex(help='verify downloaded files against the piece hashes of their torrents',
+        arguments=[(['-s', '--search'],
+                    {'help': 'term to search in torrent names',
+                     'action': 'store',
+                     'dest': 'term'}),
+                   (['-r', '--repair'],
+                    {'help': 'download again the corrupted pieces from the seedbox',
+                     'action': 'store_true',
+                     'dest': 'repair'}),
+                   (['-w', '--workers'],
+                    {'help': 'number of pieces hashed at the same time',
+                     'action': 'store',
+                     'dest': 'workers',
+                     'default': os.cpu_count() or 1})])
+    def verify(self):
+        """
+        Check the downloaded files of uploaded torrents, piece by piece.
+        """
+        where = Torrent.pieces.is_null(False)
+        if self.app.pargs.term:
+            where = where & Torrent.name.contains(self.app.pargs.term)
+
+        downloaded = Download.get_downloaded_paths()
+        by_name = {}
+        for path in downloaded:
+            by_name.setdefault(os.path.basename(path), []).append(path)
+
+        # Repairs write in downloaded files, as a seedbox sync
+        lock_file = self.app.config.get('pid', 'download_path')
+        if self.app.pargs.repair:
+            self.app.lock.lock_or_exit(lock_file)
+            self.app.sync.chdir(self.app.config.get('seedbox', 'finished_path'))
+
+        download_path = fs.abspath(self.app.config.get('local', 'download_path'))
+        workers = int(self.app.pargs.workers)
+        results = []
+        corrupted = 0
+        try:
+            for torrent in Torrent.select().where(where).order_by(Torrent.sent):
+                files = torrent.get_files()
+                lengths = [length for path, length in files]
+
+                # Local files, skipped if not downloaded or not of the torrent size
+                remote_paths = self.__find_files(files, downloaded, by_name)
+                paths = []
+                for (path, length), remote_path in zip(files, remote_paths):
+                    local_path = None if remote_path is None else fs.join(download_path, remote_path)
+                    if local_path is not None and self.__local_size(local_path) != length:
+                        self.app.log.warning('Size mismatch: "%s" not verified' % local_path)
+                        local_path = None
+                    paths.append(local_path)
+
+                self.app.log.debug('Verify "%s"' % torrent.name)
+                statuses = hash_pieces(paths, lengths, torrent.piece_length, torrent.pieces, workers)
+                bad = [index for index, status in statuses.items() if status is False]
+                if len(bad) > 0 and self.app.pargs.repair:
+                    still = set(self.__repair(torrent, paths, remote_paths, lengths, bad, workers))
+                    statuses.update({index: index not in still for index in bad})
+                    bad = sorted(still)
+                elif len(bad) > 0:
+                    self.app.log.error('%s corrupted piece(s) in "%s"' % (len(bad), torrent.name))
+                corrupted += len(bad)
+
+                results.append({'name': torrent.name,
+                                'pieces': len(statuses),
+                                'valid': sum(1 for status in statuses.values() if status is True),
+                                'corrupted': len(bad),
+                                'missing': sum(1 for status in statuses.values() if status is None)})
+        finally:
+            if self.app.pargs.repair:
+                self.app.lock.unlock(lock_file)
+
+        self.app.render(results, headers={'name': 'Name', 'pieces': 'Pieces', 'valid': 'Valid', 'corrupted': 'Corrupted', 'missing': 'Missing'})
+        if corrupted > 0:
+            self.app.exit_code = 1
+
+    def __find_files(self, files: list, downloaded: set, by_name: dict):
+        """
+        Get the downloaded path of each file of a torrent, None if not
+        downloaded. Torrent files are found under a same directory of the
+        seedbox.
+
+        :param list files: the files of the torrent, as ``(path, length)``
+        :param set downloaded: the downloaded paths
+        :param dict by_name: the downloaded paths by file name
+        """
+        for first, length in files:
+            candidates = sorted(candidate for candidate in by_name.get(os.path.basename(first), [])
+                                if candidate == first or candidate.endswith('/' + first))
+            if len(candidates) > 0:
+                prefix = candidates[0][:-len(first)]
+                return [prefix + path if prefix + path in downloaded else None for path, length in files]
+
+        return [None] * len(files)
+
+    def __repair(self, torrent: Torrent, paths: list, remote_paths: list, lengths: list, bad: list, workers: int):
+        """
+        Download again corrupted pieces, by byte ranges written in place, and
+        check them again. Return the pieces still corrupted.
+
+        :param Torrent torrent: the torrent
+        :param list paths: the local path of each file
+        :param list remote_paths: the downloaded path of each file
+        :param list lengths: the length of each file
+        :param list bad: the corrupted pieces
+        :param int workers: the number of pieces hashed at the same time
+        """
+        starts = file_starts(lengths)
+        repaired = set()
+        for index in bad:
+            for i, offset, length in piece_segments(starts, torrent.piece_length, index):
+                self.app.log.info('Download again piece %s of "%s" (%s bytes at %s)' % (index, remote_paths[i], length, offset))
+                try:
+                    self.app.sync.get_range(remote_paths[i], paths[i], offset, length)
+                    repaired.add(remote_paths[i])
+                except (IOError, SSHException) as exc:
+                    self.app.log.error('Download fail: %s' % str(exc))
+
+        # The stored checksums may be the ones of the corrupted files
+        if len(repaired) > 0:
+            Download.update(checksum=None).where(Download.path.in_(list(repaired)), Download.finished != 0).execute()
+
+        statuses = hash_pieces(paths, lengths, torrent.piece_length, torrent.pieces, workers, indexes=bad)
+        still = [index for index in bad if statuses[index] is not True]
+        self.app.log.info('%s piece(s) repaired in "%s"' % (len(bad) - len(still), torrent.name))
+        if len(still) > 0:
+            self.app.log.error('%s corrupted piece(s) in "%s"' % (len(still), torrent.name))
+
+        return still
+
+    def __local_size(self, local_filepath: str):
+        """
+        Get the size of a local file, None if not exists.
+
+        :param str local_filepath: the local filepath
+        """
+        try:
+            return os.stat(local_filepath).st_size
+        except FileNotFoundError:
+            return None
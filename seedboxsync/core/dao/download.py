@@ -16,11 +16,17 @@ class Download(SeedboxSyncModel):
     A Data Access Object for Torrent.
     """
     id = AutoField()
-    path = TextField()
+    path = TextField(index=True)
     seedbox_size = IntegerField()
     local_size = IntegerField(default=0)
-    started = DateTimeField(default=datetime.datetime.now)
-    finished = DateTimeField(default=0)
+    started = DateTimeField(default=datetime.datetime.now, index=True)
+    finished = DateTimeField(default=0, index=True)
+    checksum = TextField(null=True)
+    seedbox_mtime = IntegerField(null=True)
+
+    class Meta:
+        # Identity of a file, to find it again after a move on the seedbox
+        indexes = ((('seedbox_size', 'seedbox_mtime'), False),)
 
     def is_already_download(filepath):
         """
@@ -33,3 +39,32 @@ class Download(SeedboxSyncModel):
             return False
         else:
             return True
+
+    def get_downloaded_paths():
+        """
+        Get the set of the paths already downloaded, loaded in one query to
+        check each file in memory.
+        """
+        query = Download.select(Download.path).where(Download.finished > 0).tuples()
+        return {path for path, in query.iterator()}
+
+    def get_by_identity(seedbox_size, seedbox_mtime):
+        """
+        Get the finished downloads of files with the same size and seedbox
+        mtime, the last one first.
+
+        :param int seedbox_size: the size of the file on the seedbox
+        :param int seedbox_mtime: the mtime of the file on the seedbox
+        """
+        query = Download.select().where(Download.seedbox_size == seedbox_size,
+                                        Download.seedbox_mtime == seedbox_mtime,
+                                        Download.finished > 0)
+        return list(query.order_by(Download.id.desc()))
+
+    def get_in_progress(filepath):
+        """
+        Get the last unfinished download of a file, left by an interrupted run.
+
+        :param str filepath: the filepath
+        """
+        return Download.select().where(Download.path == filepath, Download.finished == 0).order_by(Download.id.desc()).first()
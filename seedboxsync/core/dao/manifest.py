@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2015-2024 Guillaume Kulakowski <guillaume@kulakowski.fr>
+#
+# For the full copyright and license information, please view the LICENSE
+# file that was distributed with this source code.
+#
+
+from peewee import AutoField, IntegerField, TextField
+from .model import SeedboxSyncModel
+
+
+class RemoteDirectory(SeedboxSyncModel):
+    """
+    A Data Access Object for a directory of the seedbox manifest.
+    """
+    id = AutoField()
+    path = TextField(unique=True)
+    parent = TextField(null=True, index=True)
+    mtime = IntegerField()
+
+
+class RemoteFile(SeedboxSyncModel):
+    """
+    A Data Access Object for a file of the seedbox manifest.
+    """
+    id = AutoField()
+    directory = TextField(index=True)
+    name = TextField()
+    size = IntegerField(null=True)
+    mtime = IntegerField(null=True)
@@ -7,7 +7,8 @@
 #
 
 import datetime
-from peewee import AutoField, DateTimeField, TextField
+import json
+from peewee import AutoField, BlobField, DateTimeField, IntegerField, TextField
 from .model import SeedboxSyncModel
 
 
@@ -18,4 +19,22 @@ class Torrent(SeedboxSyncModel):
     id = AutoField()
     name = TextField()
     announce = TextField()
-    sent = DateTimeField(default=datetime.datetime.now)
+    sent = DateTimeField(default=datetime.datetime.now, index=True)
+    piece_length = IntegerField(null=True)
+    pieces = BlobField(null=True)
+    files = TextField(null=True)
+    info_hash = TextField(null=True, index=True)
+
+    def get_files(self):
+        """
+        Get the files of the torrent, as a list of ``(path, length)``.
+        """
+        return [tuple(file) for file in json.loads(self.files or '[]')]
+
+    def get_info_hashes():
+        """
+        Get the set of the infohashes of the torrents already sent, loaded in
+        one query to check each torrent in memory.
+        """
+        query = Torrent.select(Torrent.info_hash).where(Torrent.info_hash.is_null(False)).tuples()
+        return {info_hash for info_hash, in query.iterator()}
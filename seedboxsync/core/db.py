@@ -7,13 +7,72 @@
 #
 
 import os
-from peewee import SqliteDatabase
+from peewee import Database, SqliteDatabase
 from cement import App
 from cement.utils import fs
 from .dao.model import global_database_object
 from .dao.seedboxsync import SeedboxSync
 from .dao.download import Download
 from .dao.torrent import Torrent
+from .dao.manifest import RemoteDirectory, RemoteFile
+from .migrations import DB_VERSION, migrate_db, set_db_version
+
+# Number of rows by multi-row insert, SQLite before 3.32 binds at most 999
+# parameters by statement
+INSERT_CHUNK = 100
+
+
+class BatchedTransaction(object):
+    """
+    Group database writes in a transaction, committed every ``batch_size``
+    writes instead of once by row.
+    """
+
+    def __init__(self, db: Database, batch_size: int):
+        """
+        Constructor
+
+        :param Database db: the database
+        :param int batch_size: the number of writes by transaction
+        """
+        self.__db = db
+        self.__batch_size = max(1, batch_size)
+        self.__count = 0
+        self.__transaction = None
+
+    def __enter__(self):
+        self.__transaction = self.__db.transaction()
+        self.__transaction.__enter__()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return self.__transaction.__exit__(exc_type, exc_value, traceback)
+
+    def tick(self, count: int = 1):
+        """
+        Count writes, and commit when the batch is full.
+
+        :param int count: the number of writes done
+        """
+        self.__count += count
+        if self.__count >= self.__batch_size:
+            self.__transaction.commit()
+            self.__count = 0
+
+
+def get_pragmas(app: App):
+    """
+    Get SQLite pragmas from the "local.db" configuration section.
+
+    :param App app: the Cement App object
+    """
+    pragmas = {}
+    for pragma in ['journal_mode', 'synchronous', 'mmap_size', 'cache_size']:
+        value = app.config.get('local.db', pragma)
+        if value is not None and value is not False:
+            pragmas[pragma] = value
+
+    return pragmas
 
 
 def extend_db(app: App):
@@ -26,18 +85,21 @@ def extend_db(app: App):
 
     app.log.debug('Extending seedboxsync application with Peewee (%s)' % db_file)
 
+    pragmas = get_pragmas(app)
+    app.log.debug('SQLite pragmas: %s' % pragmas)
+
     if not os.path.exists(db_file):
         app.log.info('DataBase "%s" not exists, need to be create' % db_file)
         fs.ensure_dir_exists(os.path.dirname(db_file))
-        db = SqliteDatabase(db_file)
+        db = SqliteDatabase(db_file, pragmas=pragmas)
         global_database_object.initialize(db)
         db.connect()
-        db.create_tables([Download, Torrent, SeedboxSync])
-        db_version = SeedboxSync.create(key='db_version', value='1')
-        db_version.save()
+        db.create_tables([Download, Torrent, SeedboxSync, RemoteDirectory, RemoteFile])
+        set_db_version(DB_VERSION)
     else:
-        db = SqliteDatabase(db_file)
+        db = SqliteDatabase(db_file, pragmas=pragmas)
         global_database_object.initialize(db)
+        migrate_db(app, db)
 
     @db.func('sizeof')
     def sizeof(num, suffix='B'):
@@ -9,7 +9,7 @@
 from cement.utils.misc import init_defaults
 
 # setup the nested dicts
-CONFIG = init_defaults('seedboxsync', 'seedbox', 'local', 'pid', 'healthchecks', 'healthchecks.sync_seedbox')
+CONFIG = init_defaults('seedboxsync', 'seedbox', 'local', 'local.db', 'pid', 'daemon', 'healthchecks', 'healthchecks.sync_seedbox')
 
 
 #
@@ -26,6 +26,10 @@ CONFIG['seedbox']['timeout'] = False
 # For the moment, only sftp
 CONFIG['seedbox']['protocol'] = 'sftp'
 
+# Socket of the local broker started by "seedboxsync broker", channels are
+# taken from its connection when it is running (false = disable)
+CONFIG['seedbox']['broker'] = '~/.config/seedboxsync/broker.sock'
+
 # Chmod torrent after upload (false = disable)
 # Use octal notation like https://docs.python.org/3.4/library/os.html#os.chmod
 CONFIG['seedbox']['chmod'] = False
@@ -47,6 +51,103 @@ CONFIG['seedbox']['part_suffix'] = '.part'
 # Example: .*missing$|^\..*\.swap$
 CONFIG['seedbox']['exclude_syncing'] = ''
 
+# Number of files downloaded at the same time
+CONFIG['seedbox']['max_parallel_downloads'] = 1
+
+# Number of torrents uploaded at the same time
+CONFIG['seedbox']['max_parallel_uploads'] = 1
+
+# Adapt the number of download streams (files and byte ranges) between
+# min_parallel_downloads and max_parallel_downloads to the measured throughput
+CONFIG['seedbox']['adaptive_concurrency'] = False
+
+# With adaptive_concurrency, minimum number of download streams
+CONFIG['seedbox']['min_parallel_downloads'] = 1
+
+# With adaptive_concurrency, duration (in seconds) of each throughput measure
+CONFIG['seedbox']['adaptive_interval'] = 10
+
+# Bandwidth caps (in bytes per second) by time windows, the first window
+# including the current time is used, transfers are not limited outside windows
+# Example: [{'start': '08:00', 'end': '23:00', 'download': 5242880, 'upload': 1048576, 'total': False}]
+CONFIG['seedbox']['bandwidth'] = []
+
+# Order of the downloads: "walk" (as listed), "smallest" (smallest files first)
+# or "oldest" (oldest files on the seedbox first)
+CONFIG['seedbox']['download_order'] = 'walk'
+
+# Regular expressions matched on the file paths, files matching the first
+# ones are downloaded first
+# Example: ['^series/', '^movies/']
+CONFIG['seedbox']['download_priorities'] = []
+
+# Download files bigger than this size (in bytes) after the others found by
+# the same walk (false = disable)
+CONFIG['seedbox']['huge_threshold'] = False
+
+# Each transfer worker uses its own sFTP "channel" on the shared connection,
+# or its own "transport" (a new SSH connection)
+CONFIG['seedbox']['parallel_mode'] = 'channel'
+
+# Download files bigger than this size (in bytes) by several byte ranges at
+# the same time (false = disable)
+CONFIG['seedbox']['segmented_threshold'] = False
+
+# Number of byte ranges of a segmented download
+CONFIG['seedbox']['segments'] = 4
+
+# Checksum algorithm of the downloaded files, computed while they are written
+# and stored in database: sha1, sha256, md5... or xxh64, xxh3_64, xxh128 with
+# the xxhash package (false = disable)
+CONFIG['seedbox']['checksum'] = False
+
+# Command run on the seedbox printing the checksum of a file, compared with
+# the local one (the file path is appended), ie: sha256sum (false = disable)
+CONFIG['seedbox']['checksum_command'] = False
+
+# Get the files moved or renamed on the seedbox from the downloaded files of
+# the same size and mtime, instead of downloading them again: "rename" the
+# local file (hardlinked if the old file is still on the seedbox), or
+# "hardlink" it (false = disable)
+CONFIG['seedbox']['moved_files'] = False
+
+# Size (in bytes) of the chunks compared at the start, the middle and the end
+# of a moved file, before reusing the local file
+CONFIG['seedbox']['moved_sample'] = 65536
+
+# Resume interrupted downloads from the existing part file
+CONFIG['seedbox']['resume'] = True
+
+# Number of bytes at the end of the part file compared with the seedbox file
+# before resuming (0 = no check)
+CONFIG['seedbox']['resume_overlap'] = 0
+
+# Number of seedbox directories listed at the same time
+CONFIG['seedbox']['walk_workers'] = 1
+
+# List the seedbox tree by "sftp" requests, or with a single "find" command
+# (fallback to sftp if commands are not allowed)
+CONFIG['seedbox']['listing'] = 'sftp'
+
+# Keep a manifest of the seedbox tree in database, and only list again the
+# directories with a new mtime
+CONFIG['seedbox']['manifest'] = False
+
+# Download files smaller than this size (in bytes) of a same directory
+# together, in a single "tar" stream (false = disable)
+CONFIG['seedbox']['tar_threshold'] = False
+
+# Maximum number of files in a tar stream
+CONFIG['seedbox']['tar_max_files'] = 100
+
+# With "sync seedbox --follow", command run on the seedbox printing the path
+# of each finished file, one by line (the finished path is appended)
+CONFIG['seedbox']['follow_command'] = 'inotifywait -m -r -q -e close_write -e moved_to --format %w%f'
+
+# With "sync seedbox --follow", interval (in seconds) between two walks of
+# the whole tree, for the lost events
+CONFIG['seedbox']['follow_reconcile'] = 3600
+
 
 #
 # Informations about local environment (NAS ?)
@@ -55,6 +156,10 @@ CONFIG['seedbox']['exclude_syncing'] = ''
 # Your local "watch" folder
 CONFIG['local']['watch_path'] = '~/watch'
 
+# With "sync blackhole --watch", time (in seconds) waited after a new torrent
+# for the next ones of a burst, uploaded as one batch
+CONFIG['local']['watch_debounce'] = 0.1
+
 # Path where download files
 CONFIG['local']['download_path'] = '~/Download/'
 
@@ -62,6 +167,26 @@ CONFIG['local']['download_path'] = '~/Download/'
 CONFIG['local']['db_file'] = '~/.config/seedboxsync/seedboxsync.db'
 
 
+#
+# SQLite tuning, see https://www.sqlite.org/pragma.html (false = SQLite default)
+#
+
+# Journal mode, "wal" allows searches during a sync (use "delete" on a network filesystem)
+CONFIG['local.db']['journal_mode'] = 'wal'
+
+# Synchronous level, "normal" is safe with "wal"
+CONFIG['local.db']['synchronous'] = 'normal'
+
+# Memory-mapped I/O size in bytes
+CONFIG['local.db']['mmap_size'] = False
+
+# Page cache size (in pages, or in KiB if negative)
+CONFIG['local.db']['cache_size'] = False
+
+# Number of rows written by transaction when storing without download
+CONFIG['local.db']['batch_size'] = 1000
+
+
 #
 # PID and lock management to prevent several launch
 #
@@ -73,6 +198,20 @@ CONFIG['pid']['blackhole_path'] = '~/.config/seedboxsync/lock/blackhole.pid'
 CONFIG['pid']['download_path'] = '~/.config/seedboxsync/lock/download.pid'
 
 
+#
+# Synchronizations run by "seedboxsync daemon"
+#
+
+# Interval (in seconds) between two blackhole synchronizations (false = disable)
+CONFIG['daemon']['blackhole_interval'] = 120
+
+# Interval (in seconds) between two seedbox synchronizations (false = disable)
+CONFIG['daemon']['seedbox_interval'] = 900
+
+# Random delay (in seconds) added to each interval
+CONFIG['daemon']['jitter'] = 30
+
+
 #
 # Healthchecks ping service
 #
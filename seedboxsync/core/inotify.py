@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2015-2024 Guillaume Kulakowski <guillaume@kulakowski.fr>
+#
+# For the full copyright and license information, please view the LICENSE
+# file that was distributed with this source code.
+#
+
+"""
+Linux inotify, through ctypes.
+"""
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+from .exc import SeedboxSyncError
+
+# Events, see inotify(7)
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_Q_OVERFLOW = 0x00004000
+
+# inotify_init1 flags
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+# struct inotify_event header: wd, mask, cookie, len
+EVENT = struct.Struct('iIII')
+
+
+class Inotify(object):
+    """
+    Watch directories with Linux inotify.
+    """
+
+    def __init__(self):
+        """
+        Init an inotify instance.
+        """
+        try:
+            self.__libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+            self.__libc.inotify_init1
+        except (OSError, AttributeError):
+            raise SeedboxSyncError('inotify is not available on this system')
+
+        self.__fd = self.__libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.__fd < 0:
+            raise SeedboxSyncError('inotify error: %s' % os.strerror(ctypes.get_errno()))
+
+    def add_watch(self, path: str, mask: int):
+        """
+        Watch events of a directory.
+
+        :param str path: the directory to watch
+        :param int mask: the events to watch
+        """
+        wd = self.__libc.inotify_add_watch(self.__fd, os.fsencode(path), mask)
+        if wd < 0:
+            raise SeedboxSyncError('inotify error on "%s": %s' % (path, os.strerror(ctypes.get_errno())))
+
+        return wd
+
+    def read(self, timeout: float = None):
+        """
+        Wait for events, and return them as a list of ``(wd, mask, cookie, name)``.
+        Return an empty list on timeout.
+
+        :param float timeout: the maximum time to wait in seconds (None = forever)
+        """
+        readable, _, _ = select.select([self.__fd], [], [], timeout)
+        if not readable:
+            return []
+
+        try:
+            data = os.read(self.__fd, 65536)
+        except BlockingIOError:
+            return []
+
+        events = []
+        offset = 0
+        while offset < len(data):
+            wd, mask, cookie, length = EVENT.unpack_from(data, offset)
+            offset += EVENT.size
+            name = os.fsdecode(data[offset:offset + length].rstrip(b'\0'))
+            offset += length
+            events.append((wd, mask, cookie, name))
+
+        return events
+
+    def close(self):
+        """
+        Close the inotify instance.
+        """
+        os.close(self.__fd)
@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2015-2024 Guillaume Kulakowski <guillaume@kulakowski.fr>
+#
+# For the full copyright and license information, please view the LICENSE
+# file that was distributed with this source code.
+#
+
+"""
+Database schema migrations, driven by the "db_version" key.
+"""
+from cement import App
+from peewee import Database
+from playhouse.migrate import SqliteMigrator, migrate
+from .dao.download import Download
+from .dao.seedboxsync import SeedboxSync
+from .dao.torrent import Torrent
+from .dao.manifest import RemoteDirectory, RemoteFile
+
+
+def migration_2(migrator: SqliteMigrator):
+    """
+    Add indexes used by sync and search queries.
+
+    :param SqliteMigrator migrator: the schema migrator
+    """
+    migrate(
+        migrator.add_index('download', ('path',)),
+        migrator.add_index('download', ('finished',)),
+        migrator.add_index('download', ('started',)),
+        migrator.add_index('torrent', ('sent',))
+    )
+
+
+def migration_3(migrator: SqliteMigrator):
+    """
+    Add the seedbox manifest tables.
+
+    :param SqliteMigrator migrator: the schema migrator
+    """
+    migrator.database.create_tables([RemoteDirectory, RemoteFile])
+
+
+def migration_4(migrator: SqliteMigrator):
+    """
+    Add the checksum of the downloaded files.
+
+    :param SqliteMigrator migrator: the schema migrator
+    """
+    migrate(
+        migrator.add_column('download', 'checksum', Download.checksum)
+    )
+
+
+def migration_5(migrator: SqliteMigrator):
+    """
+    Add the piece hashes and the files of the uploaded torrents.
+
+    :param SqliteMigrator migrator: the schema migrator
+    """
+    migrate(
+        migrator.add_column('torrent', 'piece_length', Torrent.piece_length),
+        migrator.add_column('torrent', 'pieces', Torrent.pieces),
+        migrator.add_column('torrent', 'files', Torrent.files)
+    )
+
+
+def migration_6(migrator: SqliteMigrator):
+    """
+    Add the infohash of the torrents, indexed to skip the torrents already sent.
+
+    :param SqliteMigrator migrator: the schema migrator
+    """
+    migrate(
+        migrator.add_column('torrent', 'info_hash', Torrent.info_hash)
+    )
+
+
+def migration_7(migrator: SqliteMigrator):
+    """
+    Add the seedbox mtime of the downloaded files, indexed with their size to
+    find them again after a move on the seedbox.
+
+    :param SqliteMigrator migrator: the schema migrator
+    """
+    migrate(
+        migrator.add_column('download', 'seedbox_mtime', Download.seedbox_mtime),
+        migrator.add_index('download', ('seedbox_size', 'seedbox_mtime'))
+    )
+
+
+# Migrations by target version, new databases are created with the last one
+MIGRATIONS = {
+    2: migration_2,
+    3: migration_3,
+    4: migration_4,
+    5: migration_5,
+    6: migration_6,
+    7: migration_7
+}
+
+DB_VERSION = max(MIGRATIONS)
+
+
+def get_db_version():
+    """
+    Get the schema version stored in database.
+    """
+    db_version = SeedboxSync.get_or_none(SeedboxSync.key == 'db_version')
+    if db_version is None:
+        return 1
+
+    return int(db_version.value)
+
+
+def set_db_version(version: int):
+    """
+    Store the schema version in database.
+
+    :param int version: the schema version
+    """
+    SeedboxSync.insert(key='db_version', value=str(version)).on_conflict_replace().execute()
+
+
+def migrate_db(app: App, db: Database):
+    """
+    Upgrade the database schema in place, one version after the other.
+
+    :param App app: the Cement App object
+    :param Database db: the database to upgrade
+    """
+    current = get_db_version()
+    migrator = SqliteMigrator(db)
+
+    for version in sorted(MIGRATIONS):
+        if version <= current:
+            continue
+
+        app.log.info('Upgrade database from version %s to %s' % (current, version))
+        with db.atomic():
+            MIGRATIONS[version](migrator)
+            set_db_version(version)
+        current = version
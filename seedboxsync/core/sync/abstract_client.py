@@ -11,14 +11,20 @@ Transport client abstract class based on paramiko syntaxe.
 """
 
 from abc import ABCMeta, abstractmethod
+from collections import namedtuple
 from cement.core.log import LogInterface
+from .bandwidth import BandwidthLimiter
+
+# An entry of a remote directory, as yielded by walk
+RemoteEntry = namedtuple('RemoteEntry', ['name', 'size', 'mtime', 'mode'])
 
 
 class AbstractClient():
     __metaclass__ = ABCMeta
 
     @abstractmethod
-    def __init__(self, log: LogInterface, host: str, login: str, password: str, port: str, timeout: str = False):
+    def __init__(self, log: LogInterface, host: str, login: str, password: str, port: str, timeout: str = False, broker: str = False,
+                 limiter: BandwidthLimiter = None):
         """Init client.
 
         :param str log: the log interface
@@ -27,6 +33,28 @@ class AbstractClient():
         :param str password: the password to connect on the the server
         :param str port: the port of the server
         :param str timeout: the timeout for socket connection
+        :param str broker: the socket of a local broker to get channels from, if running (false = disable)
+        :param BandwidthLimiter limiter: the bandwidth limiter shared by the transfers (None = unlimited)
+        """
+        pass
+
+    @abstractmethod
+    def clone(self, new_transport: bool = False):
+        """
+        Get a new client with its own channel, on the same transport or on a
+        new one.
+
+        :param bool new_transport: open a new transport instead of a new channel
+        """
+        pass
+
+    @abstractmethod
+    def throttle(self, direction: str):
+        """
+        Get a callback limiting the bandwidth of a new stream, called with the
+        number of bytes of each chunk transferred. None if unlimited.
+
+        :param str direction: "download" or "upload"
         """
         pass
 
@@ -43,13 +71,66 @@ class AbstractClient():
         pass
 
     @abstractmethod
-    def get(self, remotep_path: str, local_path: str):
+    def upload(self, local_path: str, tmp_path: str, remote_path: str, mode: int = None):
+        """
+        Copy a local file (``local_path``) to the server as ``tmp_path``, set
+        its mode, then move it to ``remote_path``.
+
+        :param str local_path: the local file to copy
+        :param str tmp_path: the temporary path on the server
+        :param str remote_path: the final path on the server
+        :param int mode: the new permissions (None = server default)
+        """
+        pass
+
+    @abstractmethod
+    def get(self, remotep_path: str, local_path: str, callback=None, digest=None):
         """
         Copy a remote file (``remote_path``) from the server to the local
         host as ``local_path``.
 
         :param str remote_path: the remote file to copy
         :param str local_path: the destination path on the local host
+        :param callable callback: called with the number of bytes of each chunk copied
+        :param digest: the digest updated with the copied bytes, in order (None = no checksum)
+        """
+        pass
+
+    @abstractmethod
+    def get_range(self, remote_path: str, local_path: str, offset: int, length: int, callback=None):
+        """
+        Copy ``length`` bytes from ``offset`` of a remote file (``remote_path``)
+        at the same position in the local file ``local_path``.
+
+        :param str remote_path: the remote file to copy
+        :param str local_path: the destination path on the local host, must exist
+        :param int offset: the first byte to copy
+        :param int length: the number of bytes to copy
+        :param callable callback: called with the number of bytes of each chunk copied
+        """
+        pass
+
+    @abstractmethod
+    def readv(self, remote_path: str, chunks: list):
+        """
+        Read several chunks of a remote file (``remote_path``).
+
+        :param str remote_path: the remote file to read
+        :param list chunks: the chunks to read, as ``(offset, length)``
+        """
+        pass
+
+    @abstractmethod
+    def resume(self, remote_path: str, local_path: str, overlap: int = 0, callback=None, digest=None):
+        """
+        Resume the copy of a remote file (``remote_path``) in an existing
+        partial local file (``local_path``), from the local size.
+
+        :param str remote_path: the remote file to copy
+        :param str local_path: the partial file on the local host
+        :param int overlap: the number of bytes to check before resuming (0 = no check)
+        :param callable callback: called with the number of bytes of each chunk copied
+        :param digest: the digest updated with the copied bytes, in order (None = no checksum)
         """
         pass
 
@@ -101,6 +182,58 @@ class AbstractClient():
         """
         pass
 
+    @abstractmethod
+    def listdir(self, path: str):
+        """
+        List a remote directory, returning ``(folders, files)`` as lists of
+        ``RemoteEntry``.
+
+        :param str path: the remote path to list
+        """
+        pass
+
+    @abstractmethod
+    def walk(self, remote_path: str, workers: int = 1, lister=None):
+        """
+        Walk a remote tree like os.walk, yielding ``(path, folders, files)``
+        where ``folders`` and ``files`` are lists of ``RemoteEntry``.
+
+        :param str remote_path: the remote path to list
+        :param int workers: the number of directories listed at the same time
+        :param callable lister: list a directory instead of ``listdir``, called as
+            ``lister(client, path, mtime)`` with the mtime known from the parent listing (or None)
+        """
+        pass
+
+    @abstractmethod
+    def find(self, remote_path: str, workers: int = 1):
+        """
+        Walk a remote tree like ``walk``, with a single remote command.
+        Fallback to ``walk`` if the command can't be run.
+
+        :param str remote_path: the remote path to list
+        :param int workers: the number of directories listed at the same time on fallback
+        """
+        pass
+
+    @abstractmethod
+    def normalize(self, path: str):
+        """
+        Get the absolute remote path of a path relative to the current directory.
+
+        :param str path: the remote path
+        """
+        pass
+
+    @abstractmethod
+    def execute(self, command: str):
+        """
+        Run a command on the server, and return a channel to read its output.
+
+        :param str command: the command to run
+        """
+        pass
+
     @abstractmethod
     def close(self):
         """
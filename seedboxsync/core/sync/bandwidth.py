@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2015-2024 Guillaume Kulakowski <guillaume@kulakowski.fr>
+#
+# For the full copyright and license information, please view the LICENSE
+# file that was distributed with this source code.
+#
+
+"""
+Bandwidth limiting: token buckets shared by all transfer streams, with caps
+by time windows.
+"""
+import threading
+import time
+from ..exc import SeedboxSyncConfigurationError
+
+# Directions of a transfer, "total" caps both
+DIRECTIONS = ('download', 'upload')
+
+# Maximum number of bytes taken in advance from the buckets by a stream, at
+# most a tenth of a second of transfer
+LEASE = 262144
+
+
+def parse_time(value):
+    """
+    Get the minutes since midnight of a "HH:MM" time. YAML may already read
+    an unquoted time as minutes.
+
+    :param value: the time
+    """
+    if isinstance(value, int):
+        minutes = value
+    elif str(value) == '24:00':
+        minutes = 24 * 60
+    else:
+        try:
+            parsed = time.strptime(str(value), '%H:%M')
+        except ValueError:
+            raise SeedboxSyncConfigurationError('Bad configuration for bandwidth ! "%s" is not a HH:MM time' % value)
+        minutes = parsed.tm_hour * 60 + parsed.tm_min
+
+    if not 0 <= minutes <= 24 * 60:
+        raise SeedboxSyncConfigurationError('Bad configuration for bandwidth ! "%s" is not a HH:MM time' % value)
+
+    return minutes
+
+
+class TokenBucket(object):
+    """
+    Token bucket, filled with ``rate`` bytes per second up to one second of
+    transfer. Tokens are taken even if missing: the taker then waits for the
+    refill, out of the lock.
+    """
+
+    def __init__(self):
+        """
+        Init an empty bucket.
+        """
+        self.__lock = threading.Lock()
+        self.__rate = None
+        self.__tokens = 0
+        self.__time = time.monotonic()
+
+    def take(self, nbytes: int, rate: int):
+        """
+        Take tokens, and return the time (in seconds) to wait for them.
+
+        :param int nbytes: the number of tokens
+        :param int rate: the current rate in bytes per second
+        """
+        with self.__lock:
+            now = time.monotonic()
+            if rate != self.__rate:
+                # New time window: start again from a full bucket
+                self.__rate = rate
+                self.__tokens = rate
+            else:
+                self.__tokens = min(rate, self.__tokens + (now - self.__time) * rate)
+            self.__time = now
+            self.__tokens -= nbytes
+
+            return -self.__tokens / rate if self.__tokens < 0 else 0
+
+
+class BandwidthLimiter(object):
+    """
+    Cap the bandwidth of all transfer streams, by direction and in total,
+    during time windows. Outside the windows, transfers are not limited.
+    """
+
+    def __init__(self, windows: list):
+        """
+        Init the limiter.
+
+        :param list windows: the time windows, dicts with "start" and "end" times (HH:MM, all day by default)
+            and "download", "upload" and "total" caps in bytes per second (false = no cap)
+        """
+        self.__windows = []
+        for window in windows:
+            if not isinstance(window, dict):
+                raise SeedboxSyncConfigurationError('Bad configuration for bandwidth ! Each window must be a mapping')
+
+            caps = {}
+            for name in DIRECTIONS + ('total',):
+                cap = window.get(name, False)
+                if cap is not False and cap is not None:
+                    if int(cap) <= 0:
+                        raise SeedboxSyncConfigurationError('Bad configuration for bandwidth ! "%s" must be positive' % name)
+                    caps[name] = int(cap)
+
+            self.__windows.append((parse_time(window.get('start', '00:00')), parse_time(window.get('end', '24:00')), caps))
+
+        self.__buckets = {name: TokenBucket() for name in DIRECTIONS + ('total',)}
+
+    def caps(self, now: time.struct_time = None):
+        """
+        Get the caps of the first time window including ``now``, an empty dict
+        outside the windows.
+
+        :param struct_time now: the local time (None = now)
+        """
+        if now is None:
+            now = time.localtime()
+        minutes = now.tm_hour * 60 + now.tm_min
+
+        for start, end, caps in self.__windows:
+            if start <= end and start <= minutes < end:
+                return caps
+            if start > end and (minutes >= start or minutes < end):
+                return caps
+
+        return {}
+
+    def take(self, direction: str, nbytes: int):
+        """
+        Take ``nbytes`` and a lease in advance from the buckets of a direction
+        and of the total. Return the number of bytes taken and the time (in
+        seconds) to wait for them.
+
+        :param str direction: "download" or "upload"
+        :param int nbytes: the number of bytes
+        """
+        caps = self.caps()
+        rates = [caps[name] for name in (direction, 'total') if name in caps]
+        if len(rates) == 0:
+            return nbytes + LEASE, 0
+
+        nbytes += min(LEASE, min(rates) // 10)
+        wait = 0
+        for name in (direction, 'total'):
+            if name in caps:
+                wait = max(wait, self.__buckets[name].take(nbytes, caps[name]))
+
+        return nbytes, wait
+
+    def throttle(self, direction: str):
+        """
+        Get a callback for a new stream, called with the number of bytes of
+        each chunk transferred. Bytes are taken from the shared buckets by
+        leases, not for each chunk.
+
+        :param str direction: "download" or "upload"
+        """
+        credit = [0]
+
+        def callback(nbytes: int):
+            credit[0] -= nbytes
+            if credit[0] < 0:
+                taken, wait = self.take(direction, -credit[0])
+                credit[0] += taken
+                if wait > 0:
+                    time.sleep(wait)
+
+        return callback
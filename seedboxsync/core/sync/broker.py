@@ -0,0 +1,389 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2015-2024 Guillaume Kulakowski <guillaume@kulakowski.fr>
+#
+# For the full copyright and license information, please view the LICENSE
+# file that was distributed with this source code.
+#
+
+"""
+Local broker sharing an authenticated SSH transport over a Unix socket, like
+OpenSSH ControlMaster.
+
+A client sends a request line, ``sftp`` or ``exec <command>``, and gets an
+``ok`` or ``error <message>`` line. An sFTP channel is then relayed as is.
+The output of an exec channel is relayed by frames: a type (``o`` for the
+standard output, ``e`` for the error output, ``x`` for the exit status), a
+length and the data.
+"""
+import os
+import select
+import socket
+import struct
+import threading
+from cement.core.log import LogInterface
+from paramiko import SSHException
+
+# Frame header: type and length
+FRAME = struct.Struct('!cI')
+
+# Size of the chunks relayed
+CHUNK_SIZE = 32768
+
+
+class BrokerSocket(socket.socket):
+    """
+    Socket connected to the broker, usable as the channel of a
+    ``paramiko.SFTPClient``.
+    """
+
+    def get_name(self):
+        """
+        Get the channel name, for paramiko logs.
+        """
+        return 'broker'
+
+
+def is_running(path: str):
+    """
+    Get if a broker is listening on a socket.
+
+    :param str path: the broker socket path
+    """
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+        return True
+    except OSError:
+        return False
+    finally:
+        sock.close()
+
+
+def read_line(sock: socket.socket):
+    """
+    Read a request or status line.
+
+    :param socket sock: the socket
+    """
+    line = b''
+    while not line.endswith(b'\n'):
+        data = sock.recv(1)
+        if len(data) == 0:
+            raise SSHException('Broker connection closed')
+        line += data
+
+    return line[:-1].decode('utf-8', 'replace')
+
+
+def connect_broker(path: str, request: str):
+    """
+    Get a channel from the broker, as a socket. Return None if the broker is
+    not running.
+
+    :param str path: the broker socket path
+    :param str request: the request line
+    """
+    sock = BrokerSocket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+    except OSError:
+        sock.close()
+        return None
+
+    try:
+        sock.sendall(request.encode('utf-8') + b'\n')
+        status = read_line(sock)
+    except (OSError, SSHException):
+        sock.close()
+        raise
+
+    if status != 'ok':
+        sock.close()
+        raise SSHException('Broker: %s' % status.replace('error ', '', 1))
+
+    return sock
+
+
+class BrokerChannel(object):
+    """
+    Client side of an exec channel relayed by the broker, with the reading
+    methods of ``paramiko.Channel``.
+    """
+
+    def __init__(self, sock: socket.socket):
+        """
+        Init the channel.
+
+        :param socket sock: the socket connected to the broker
+        """
+        self.__sock = sock
+        self.__stdout = bytearray()
+        self.__stderr = bytearray()
+        self.__status = None
+        self.__eof = False
+
+    def __recv_exactly(self, size: int):
+        """
+        Read exactly ``size`` bytes, None on end of stream.
+
+        :param int size: the number of bytes
+        """
+        data = b''
+        while len(data) < size:
+            chunk = self.__sock.recv(size - len(data))
+            if len(chunk) == 0:
+                return None
+            data += chunk
+
+        return data
+
+    def __read_frame(self):
+        """
+        Read the next frame.
+        """
+        header = self.__recv_exactly(FRAME.size)
+        data = None if header is None else self.__recv_exactly(FRAME.unpack(header)[1])
+        if data is None:
+            self.__eof = True
+            if self.__status is None:
+                self.__status = -1
+            return
+
+        kind = FRAME.unpack(header)[0]
+        if kind == b'o':
+            self.__stdout += data
+        elif kind == b'e':
+            self.__stderr += data
+        elif kind == b'x':
+            self.__status = struct.unpack('!i', data)[0]
+            self.__eof = True
+
+    def recv(self, nbytes: int):
+        """
+        Receive data from the standard output, an empty string at the end.
+
+        :param int nbytes: the maximum number of bytes
+        """
+        while len(self.__stdout) == 0 and not self.__eof:
+            self.__read_frame()
+
+        data = bytes(self.__stdout[:nbytes])
+        del self.__stdout[:nbytes]
+
+        return data
+
+    def recv_stderr(self, nbytes: int):
+        """
+        Receive data from the error output, an empty string at the end.
+
+        :param int nbytes: the maximum number of bytes
+        """
+        while len(self.__stderr) == 0 and not self.__eof:
+            self.__read_frame()
+
+        data = bytes(self.__stderr[:nbytes])
+        del self.__stderr[:nbytes]
+
+        return data
+
+    def recv_stderr_ready(self):
+        """
+        Get if data from the error output can be received without waiting.
+        """
+        return len(self.__stderr) > 0
+
+    def recv_exit_status(self):
+        """
+        Wait for the end of the command, and return its exit status.
+        """
+        while not self.__eof:
+            self.__read_frame()
+
+        return self.__status
+
+    def exit_status_ready(self):
+        """
+        Get if the command ended.
+        """
+        return self.__status is not None
+
+    def read(self, size: int = -1):
+        """
+        Read the standard output like a file.
+
+        :param int size: the maximum number of bytes (-1 = until the end)
+        """
+        if size >= 0:
+            return self.recv(size)
+
+        data = b''
+        while True:
+            chunk = self.recv(CHUNK_SIZE)
+            if len(chunk) == 0:
+                return data
+            data += chunk
+
+    def makefile(self, mode: str = 'rb'):
+        """
+        Get the standard output as a file.
+
+        :param str mode: the mode, only reading
+        """
+        return self
+
+    def fileno(self):
+        """
+        Get the socket file descriptor, to wait for data with select.
+        """
+        return self.__sock.fileno()
+
+    def settimeout(self, timeout: float):
+        """
+        Set the timeout of blocking operations.
+
+        :param float timeout: the timeout in seconds
+        """
+        self.__sock.settimeout(timeout)
+
+    def close(self):
+        """
+        Close the channel.
+        """
+        self.__sock.close()
+
+
+class Broker(object):
+    """
+    Hand out channels of a transport to local clients, over a Unix socket.
+    """
+
+    def __init__(self, log: LogInterface, client, path: str):
+        """
+        Init the broker.
+
+        :param LogInterface log: the log interface
+        :param SftpClient client: the client holding the transport
+        :param str path: the socket path
+        """
+        self.__log = log
+        self.__client = client
+        self.__path = path
+        self.__server = None
+
+    def serve_forever(self):
+        """
+        Listen on the socket, and relay each connection in its own thread.
+        """
+        if os.path.exists(self.__path):
+            os.remove(self.__path)
+        os.makedirs(os.path.dirname(self.__path), mode=0o700, exist_ok=True)
+
+        # Any command is run for whoever connects: the socket is created only
+        # readable and writable by the user, never more
+        self.__server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        umask = os.umask(0o177)
+        try:
+            self.__server.bind(self.__path)
+        finally:
+            os.umask(umask)
+        self.__server.listen(16)
+        self.__log.info('Broker listening on "%s"' % self.__path)
+
+        while True:
+            sock, address = self.__server.accept()
+            threading.Thread(target=self.__handle, args=(sock,), name='seedboxsync-broker', daemon=True).start()
+
+    def close(self):
+        """
+        Stop listening and remove the socket.
+        """
+        if self.__server is not None:
+            self.__server.close()
+            self.__server = None
+            os.remove(self.__path)
+
+    def __handle(self, sock: socket.socket):
+        """
+        Open the requested channel, then relay it.
+
+        :param socket sock: the client connection
+        """
+        channel = None
+        try:
+            request = read_line(sock)
+            self.__log.debug('Broker request: %s' % request)
+            try:
+                channel = self.__client.open_session()
+                if request == 'sftp':
+                    channel.invoke_subsystem('sftp')
+                elif request.startswith('exec '):
+                    channel.exec_command(request[5:])
+                else:
+                    raise SSHException('Unknown request "%s"' % request)
+            except SSHException as exc:
+                sock.sendall(('error %s\n' % str(exc)).encode('utf-8'))
+                return
+
+            sock.sendall(b'ok\n')
+            if request == 'sftp':
+                self.__relay(sock, channel)
+            else:
+                self.__relay_exec(sock, channel)
+        except (OSError, SSHException) as exc:
+            self.__log.debug('Broker connection closed: %s' % str(exc))
+        finally:
+            if channel is not None:
+                channel.close()
+            sock.close()
+
+    def __relay(self, sock: socket.socket, channel):
+        """
+        Relay an sFTP channel both ways, until one side closes.
+
+        :param socket sock: the client connection
+        :param paramiko.Channel channel: the channel
+        """
+        while True:
+            readable = select.select([sock, channel], [], [])[0]
+            if sock in readable:
+                data = sock.recv(CHUNK_SIZE)
+                if len(data) == 0:
+                    return
+                channel.sendall(data)
+            if channel in readable:
+                data = channel.recv(CHUNK_SIZE)
+                if len(data) == 0:
+                    return
+                sock.sendall(data)
+
+    def __relay_exec(self, sock: socket.socket, channel):
+        """
+        Relay the outputs and the exit status of an exec channel by frames,
+        until the command ends or the client closes.
+
+        :param socket sock: the client connection
+        :param paramiko.Channel channel: the channel
+        """
+        while True:
+            # The error output doesn't wake select up, poll it
+            readable = select.select([sock, channel], [], [], 0.1)[0]
+            if sock in readable and len(sock.recv(CHUNK_SIZE)) == 0:
+                return
+
+            while channel.recv_stderr_ready():
+                data = channel.recv_stderr(CHUNK_SIZE)
+                sock.sendall(FRAME.pack(b'e', len(data)) + data)
+
+            if channel in readable or channel.recv_ready() or channel.exit_status_ready():
+                data = channel.recv(CHUNK_SIZE)
+                if len(data) > 0:
+                    sock.sendall(FRAME.pack(b'o', len(data)) + data)
+                    continue
+
+                status = channel.recv_exit_status()
+                while channel.recv_stderr_ready():
+                    data = channel.recv_stderr(CHUNK_SIZE)
+                    sock.sendall(FRAME.pack(b'e', len(data)) + data)
+                sock.sendall(FRAME.pack(b'x', 4) + struct.pack('!i', status))
+                return
@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2015-2024 Guillaume Kulakowski <guillaume@kulakowski.fr>
+#
+# For the full copyright and license information, please view the LICENSE
+# file that was distributed with this source code.
+#
+
+"""
+Checksums of the downloaded files, computed while they are written.
+"""
+import hashlib
+import os
+import shlex
+from ..exc import SeedboxSyncConfigurationError
+
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
+# Size of the chunks read to hash a local file
+CHUNK_SIZE = 1048576
+
+
+def new_digest(algorithm: str):
+    """
+    Get a new digest, with ``update`` and ``hexdigest`` methods. xxHash
+    algorithms (ie: xxh64, xxh3_64, xxh128) need the xxhash package.
+
+    :param str algorithm: the hashlib or xxhash algorithm
+    """
+    if algorithm.startswith('xxh'):
+        if xxhash is None:
+            raise SeedboxSyncConfigurationError('Bad configuration for checksum ! "%s" needs the xxhash package' % algorithm)
+        try:
+            return getattr(xxhash, algorithm)()
+        except AttributeError:
+            raise SeedboxSyncConfigurationError('Bad configuration for checksum ! Unknown algorithm "%s"' % algorithm)
+
+    try:
+        return hashlib.new(algorithm)
+    except ValueError:
+        raise SeedboxSyncConfigurationError('Bad configuration for checksum ! Unknown algorithm "%s"' % algorithm)
+
+
+def hash_file(local_path: str, digest, end: int = None):
+    """
+    Update a digest with the content of a local file.
+
+    :param str local_path: the local file
+    :param digest: the digest to update
+    :param int end: the byte after the last one to hash (None = end of file)
+    """
+    fd = os.open(local_path, os.O_RDONLY)
+    try:
+        hash_fd(fd, digest, 0, os.fstat(fd).st_size if end is None else end)
+    finally:
+        os.close(fd)
+
+    return digest
+
+
+def hash_fd(fd: int, digest, position: int, end: int):
+    """
+    Update a digest with a part of a local file descriptor, with positional
+    reads.
+
+    :param int fd: the local file descriptor
+    :param digest: the digest to update
+    :param int position: the first byte to hash
+    :param int end: the byte after the last one to hash
+    """
+    while position < end:
+        data = os.pread(fd, min(CHUNK_SIZE, end - position), position)
+        if len(data) == 0:
+            break
+        digest.update(data)
+        position += len(data)
+
+
+def checksum_command(command: str, remote_path: str):
+    """
+    Get the command printing the checksum of a remote file.
+
+    :param str command: the checksum command (ie: sha256sum)
+    :param str remote_path: the absolute remote path
+    """
+    return '%s -- %s' % (command, shlex.quote(remote_path))
+
+
+def parse_checksum(output: bytes):
+    """
+    Get the checksum from the output of a checksum command: the first word
+    of the first line.
+
+    :param bytes output: the command output
+    """
+    words = output.decode('utf-8', 'replace').split()
+    if len(words) == 0:
+        return None
+
+    return words[0].lstrip('\\').lower()
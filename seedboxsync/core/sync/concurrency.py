@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2015-2024 Guillaume Kulakowski <guillaume@kulakowski.fr>
+#
+# For the full copyright and license information, please view the LICENSE
+# file that was distributed with this source code.
+#
+
+"""
+Adaptive number of concurrent transfer streams.
+"""
+import threading
+import time
+from cement.core.log import LogInterface
+
+# Factor applied to the number of streams when the throughput falls
+DECREASE = 0.5
+
+# Number of measures holding the number of streams after a useless increase
+HOLD = 3
+
+
+class AdaptiveConcurrency(object):
+    """
+    AIMD controller of the number of concurrent streams (transfers and
+    segments). The aggregate throughput is measured on intervals: while it
+    grows, a stream is added. When it falls, the number of streams is halved.
+    When an added stream brings nothing, it is removed and the number of
+    streams is held for a few intervals before probing again.
+    """
+
+    def __init__(self, log: LogInterface, minimum: int = 1, maximum: int = 1, interval: float = 10, tolerance: float = 0.05):
+        """
+        Init the controller, starting with the minimum number of streams.
+
+        :param LogInterface log: the log interface
+        :param int minimum: the minimum number of streams
+        :param int maximum: the maximum number of streams
+        :param float interval: the duration (in seconds) of a measure
+        :param float tolerance: the relative change of throughput seen as a gain or a loss
+        """
+        self.__log = log
+        self.__maximum = max(1, maximum)
+        self.__minimum = max(1, min(minimum, self.__maximum))
+        self.__interval = interval
+        self.__tolerance = tolerance
+        self.__limit = self.__minimum
+        self.__active = 0
+        self.__condition = threading.Condition()
+        self.__bytes = {}
+        self.__start = time.monotonic()
+        self.__previous = None
+        self.__increased = False
+        self.__hold = 0
+
+    @property
+    def limit(self):
+        """
+        The current number of streams allowed.
+        """
+        return self.__limit
+
+    def acquire(self):
+        """
+        Wait for a free stream, and take it.
+        """
+        with self.__condition:
+            while self.__active >= self.__limit:
+                self.__condition.wait()
+            self.__active += 1
+
+    def reserve(self, wanted: int):
+        """
+        Take up to ``wanted`` free streams without waiting, and return the
+        number taken.
+
+        :param int wanted: the number of streams wanted
+        """
+        with self.__condition:
+            taken = max(0, min(wanted, self.__limit - self.__active))
+            self.__active += taken
+
+            return taken
+
+    def release(self, count: int = 1):
+        """
+        Give streams back.
+
+        :param int count: the number of streams
+        """
+        with self.__condition:
+            self.__active -= count
+            self.__condition.notify_all()
+
+    def record(self, nbytes: int):
+        """
+        Count bytes transferred by the current stream (thread), and adjust the
+        number of streams at the end of a measure.
+
+        :param int nbytes: the number of bytes
+        """
+        with self.__condition:
+            stream = threading.get_ident()
+            self.__bytes[stream] = self.__bytes.get(stream, 0) + nbytes
+
+            elapsed = time.monotonic() - self.__start
+            if elapsed >= self.__interval:
+                self.__adjust(elapsed)
+                self.__bytes = {}
+                self.__start = time.monotonic()
+
+    def __adjust(self, elapsed: float):
+        """
+        Adjust the number of streams from the throughput of the last measure.
+
+        :param float elapsed: the duration of the measure
+        """
+        rate = sum(self.__bytes.values()) / elapsed
+        streams = len(self.__bytes)
+        measure = '%.2f MiB/s with %s stream(s), %.2f MiB/s per stream' % (rate / 1048576, streams, rate / streams / 1048576)
+
+        limit = self.__limit
+        if streams < limit:
+            # Not enough transfers to use all streams, nothing to learn
+            self.__log.debug('Concurrency %s kept (%s, not all used)' % (limit, measure))
+            self.__previous = None
+            self.__increased = False
+            return
+
+        if self.__previous is None or rate > self.__previous * (1 + self.__tolerance):
+            limit = min(self.__maximum, limit + 1)
+        elif rate < self.__previous * (1 - self.__tolerance):
+            limit = max(self.__minimum, int(limit * DECREASE))
+        elif self.__increased:
+            limit = max(self.__minimum, limit - 1)
+            self.__hold = HOLD
+        elif self.__hold > 0:
+            self.__hold -= 1
+        else:
+            limit = min(self.__maximum, limit + 1)
+
+        if limit != self.__limit:
+            self.__log.info('Concurrency %s -> %s (%s)' % (self.__limit, limit, measure))
+        else:
+            self.__log.debug('Concurrency %s kept (%s)' % (limit, measure))
+
+        self.__increased = limit > self.__limit
+        self.__previous = rate
+        self.__limit = limit
+        self.__condition.notify_all()
@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2015-2024 Guillaume Kulakowski <guillaume@kulakowski.fr>
+#
+# For the full copyright and license information, please view the LICENSE
+# file that was distributed with this source code.
+#
+
+"""
+Remote listing in a single command, with ``find -printf``.
+"""
+import os
+import shlex
+from stat import S_IFDIR, S_IFREG
+from .abstract_client import RemoteEntry
+
+# Type, size, mtime and path relative to the starting point, NUL separated
+FIND_COMMAND = "find %s -mindepth 1 -printf '%%y %%s %%T@ %%P\\0'"
+
+
+def find_command(remote_path: str):
+    """
+    Get the find command listing a remote path.
+
+    :param str remote_path: the absolute remote path to list
+    """
+    return FIND_COMMAND % shlex.quote(remote_path)
+
+
+def parse_find(chunks):
+    """
+    Parse the NUL-delimited output of ``find -printf``, as it is received,
+    yielding ``(relative_path, RemoteEntry)``.
+
+    :param iterable chunks: the raw output, by chunks of bytes
+    """
+    pending = b''
+    for chunk in chunks:
+        records = (pending + chunk).split(b'\0')
+        pending = records.pop()
+        for record in records:
+            if record:
+                yield parse_record(record)
+
+    if pending:
+        raise ValueError('Truncated find output: %r' % pending)
+
+
+def parse_record(record: bytes):
+    """
+    Parse a single ``find -printf`` record.
+
+    :param bytes record: the record, without NUL
+    """
+    kind, size, mtime, path = record.split(b' ', 3)
+    path = path.decode('utf-8', 'replace')
+    mode = S_IFDIR if kind == b'd' else S_IFREG
+
+    # The size of a symlink is not the one of its target, stat at download
+    size = None if kind == b'l' else int(size)
+
+    return path, RemoteEntry(os.path.basename(path), size, int(float(mtime)), mode)
+
+
+def group_by_directory(records, remote_path: str = ''):
+    """
+    Group consecutive parsed records of the same directory, yielding
+    ``(path, folders, files)`` like ``AbstractClient.walk``. A directory may
+    be yielded several times.
+
+    :param iterable records: the parsed records
+    :param str remote_path: the listed path, prefix of yielded paths
+    """
+    current = None
+    folders = []
+    files = []
+    for path, entry in records:
+        directory = os.path.dirname(path)
+        directory = os.path.join(remote_path, directory) if directory else remote_path
+        if directory != current:
+            if current is not None:
+                yield current, folders, files
+            current = directory
+            folders = []
+            files = []
+
+        if entry.mode == S_IFDIR:
+            folders.append(entry)
+        else:
+            files.append(entry)
+
+    if current is not None:
+        yield current, folders, files
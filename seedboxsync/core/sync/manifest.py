@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2015-2024 Guillaume Kulakowski <guillaume@kulakowski.fr>
+#
+# For the full copyright and license information, please view the LICENSE
+# file that was distributed with this source code.
+#
+
+"""
+Persistent manifest of the seedbox tree, to skip unchanged directories.
+"""
+import os
+import re
+import threading
+from stat import S_IFDIR
+from cement import App
+from peewee import chunked
+from .abstract_client import AbstractClient, RemoteEntry
+from ..dao.download import Download
+from ..dao.manifest import RemoteDirectory, RemoteFile
+from ..dao.seedboxsync import SeedboxSync
+from ..db import INSERT_CHUNK
+from ..exc import SeedboxSyncConfigurationError
+
+
+class Manifest(object):
+    """
+    Walk the seedbox tree with a persisted manifest of directories and files.
+
+    A directory is only listed again if its mtime changed since the last run,
+    or if it holds files not downloaded yet (part and excluded files aside):
+    writing a file doesn't change the mtime of its directory, their sizes may
+    be stale. Otherwise its content is
+    read from the manifest. Its sub-directories are still checked, each one by
+    a stat.
+    """
+
+    def __init__(self, app: App, root: str):
+        """
+        Load the manifest.
+
+        :param App app: the Cement App object
+        :param str root: the remote root of the manifest (the finished path)
+        """
+        self.app = app
+        self.__lock = threading.Lock()
+        self.__listed = {}
+        self.__skipped = 0
+        self.__downloaded = set()
+        self.__part_suffix = self.app.config.get('seedbox', 'part_suffix')
+        pattern = self.app.config.get('seedbox', 'exclude_syncing')
+        try:
+            self.__exclude = None if pattern == '' else re.compile(pattern)
+        except re.error:
+            raise SeedboxSyncConfigurationError('Bad configuration for exclude_syncing ! See the doc at https://docs.python.org/3/library/re.html')
+
+        # Another root, another tree
+        manifest_root = SeedboxSync.get_or_none(SeedboxSync.key == 'manifest_root')
+        if manifest_root is None or manifest_root.value != root:
+            self.app.log.debug('New manifest for "%s"' % root)
+            with self.app._db.atomic():
+                RemoteDirectory.delete().execute()
+                RemoteFile.delete().execute()
+                SeedboxSync.insert(key='manifest_root', value=root).on_conflict_replace().execute()
+
+        self.__mtimes = {}
+        self.__folders = {}
+        for path, parent, mtime in RemoteDirectory.select(RemoteDirectory.path, RemoteDirectory.parent, RemoteDirectory.mtime).tuples().iterator():
+            self.__mtimes[path] = mtime
+            if parent is not None:
+                self.__folders.setdefault(parent, []).append(RemoteEntry(os.path.basename(path), None, None, S_IFDIR))
+
+        self.__files = {}
+        for directory, name, size, mtime in RemoteFile.select(RemoteFile.directory, RemoteFile.name, RemoteFile.size, RemoteFile.mtime).tuples().iterator():
+            self.__files.setdefault(directory, []).append(RemoteEntry(name, size, mtime, None))
+
+        self.app.log.debug('Manifest loaded: %s directories' % len(self.__mtimes))
+
+    def walk(self, client: AbstractClient, remote_path: str, workers: int = 1):
+        """
+        Walk the seedbox tree like ``AbstractClient.walk``, with unchanged
+        directories read from the manifest.
+
+        :param AbstractClient client: the transport client
+        :param str remote_path: the remote path to list
+        :param int workers: the number of directories listed at the same time
+        """
+        self.__downloaded = Download.get_downloaded_paths()
+        for walker in client.walk(remote_path, workers=workers, lister=self.__list):
+            yield walker
+        self.__downloaded = set()
+
+        self.app.log.debug('Manifest: %s directories listed, %s unchanged' % (len(self.__listed), self.__skipped))
+
+    def save(self):
+        """
+        Persist the directories listed during the walk, and keep them for the
+        next walks of the same run.
+        """
+        with self.app._db.atomic():
+            for path, (mtime, folders, files) in self.__listed.items():
+                # Forget removed sub-directories
+                names = {folder.name for folder in folders}
+                for folder in self.__folders.get(path, []):
+                    if folder.name not in names:
+                        removed = os.path.join(path, folder.name)
+                        prefix = removed + '/'
+                        RemoteDirectory.delete().where((RemoteDirectory.path == removed) | RemoteDirectory.path.startswith(prefix)).execute()
+                        RemoteFile.delete().where((RemoteFile.directory == removed) | RemoteFile.directory.startswith(prefix)).execute()
+                        for cache in (self.__mtimes, self.__folders, self.__files):
+                            for key in [key for key in cache if key == removed or key.startswith(prefix)]:
+                                del cache[key]
+
+                parent = None if path == '' else os.path.dirname(path)
+                RemoteDirectory.insert(path=path, parent=parent, mtime=mtime).on_conflict_replace().execute()
+
+                RemoteFile.delete().where(RemoteFile.directory == path).execute()
+                rows = [{'directory': path, 'name': f.name, 'size': f.size, 'mtime': f.mtime} for f in files]
+                for batch in chunked(rows, INSERT_CHUNK):
+                    RemoteFile.insert_many(batch).execute()
+
+                self.__mtimes[path] = mtime
+                self.__folders[path] = [RemoteEntry(folder.name, None, None, S_IFDIR) for folder in folders]
+                self.__files[path] = [RemoteEntry(f.name, f.size, f.mtime, None) for f in files]
+
+        self.__listed = {}
+
+    def __list(self, client: AbstractClient, path: str, mtime: int):
+        """
+        List a directory, from the manifest if its mtime didn't change.
+
+        :param AbstractClient client: the transport client
+        :param str path: the remote path to list
+        :param int mtime: the mtime from the parent listing, None if unknown
+        """
+        if mtime is None:
+            mtime = client.stat(path).st_mtime
+
+        downloaded = all(os.path.join(path, file.name) in self.__downloaded
+                         for file in self.__files.get(path, []) if self.__is_synced(os.path.join(path, file.name)))
+        if path in self.__mtimes and self.__mtimes[path] == mtime and downloaded:
+            with self.__lock:
+                self.__skipped += 1
+            return self.__folders.get(path, []), self.__files.get(path, [])
+
+        folders, files = client.listdir(path)
+        with self.__lock:
+            self.__listed[path] = (mtime, folders, files)
+
+        return folders, files
+
+    def __is_synced(self, filepath: str):
+        """
+        Get if a file is to download, not a part file nor excluded.
+
+        :param str filepath: the path of the file
+        """
+        if os.path.splitext(filepath)[1] == self.__part_suffix:
+            return False
+
+        return self.__exclude is None or self.__exclude.search(filepath) is None
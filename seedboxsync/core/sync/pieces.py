@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2015-2024 Guillaume Kulakowski <guillaume@kulakowski.fr>
+#
+# For the full copyright and license information, please view the LICENSE
+# file that was distributed with this source code.
+#
+
+"""
+Check of downloaded files against the piece hashes of their torrent.
+"""
+import bisect
+import hashlib
+import itertools
+import mmap
+from concurrent.futures import ThreadPoolExecutor
+
+# Size of a piece hash (SHA-1)
+HASH_SIZE = 20
+
+
+def get_layout(info: dict):
+    """
+    Get the piece length, the piece hashes and the files (path and length,
+    in torrent order) of the info dict of a torrent.
+
+    :param dict info: the info dict of the torrent
+    """
+    if 'files' in info:
+        files = [('/'.join([info['name']] + list(file['path'])), int(file['length'])) for file in info['files']]
+    else:
+        files = [(info['name'], int(info['length']))]
+
+    return int(info['piece length']), bytes(info['pieces']), files
+
+
+def file_starts(lengths: list):
+    """
+    Get the offset of each file in the torrent data, followed by the total length.
+
+    :param list lengths: the length of each file, in torrent order
+    """
+    return [0] + list(itertools.accumulate(lengths))
+
+
+def piece_segments(starts: list, piece_length: int, index: int):
+    """
+    Get the parts of the files covered by a piece, as a list of
+    ``(file index, offset, length)``.
+
+    :param list starts: the offsets of the files, from ``file_starts``
+    :param int piece_length: the piece length
+    :param int index: the piece index
+    """
+    position = index * piece_length
+    end = min(position + piece_length, starts[-1])
+
+    segments = []
+    file_index = bisect.bisect_right(starts, position) - 1
+    while position < end:
+        file_end = starts[file_index + 1]
+        if file_end > position:
+            length = min(end, file_end) - position
+            segments.append((file_index, position - starts[file_index], length))
+            position += length
+        file_index += 1
+
+    return segments
+
+
+def hash_pieces(paths: list, lengths: list, piece_length: int, pieces: bytes, workers: int = 1, indexes: list = None):
+    """
+    Check pieces of local files against their hashes, with mapped files hashed
+    by several threads. Return the status by piece index: True if valid, False
+    if corrupted, None if one of its files is missing.
+
+    :param list paths: the local path of each file, in torrent order (None = missing)
+    :param list lengths: the length of each file, in torrent order
+    :param int piece_length: the piece length
+    :param bytes pieces: the piece hashes
+    :param int workers: the number of pieces hashed at the same time
+    :param list indexes: the pieces to check (None = all)
+    """
+    if indexes is None:
+        indexes = range(len(pieces) // HASH_SIZE)
+    starts = file_starts(lengths)
+
+    views = {}
+    maps = []
+    try:
+        for i, path in enumerate(paths):
+            if path is not None and lengths[i] > 0:
+                with open(path, 'rb') as local:
+                    mapped = mmap.mmap(local.fileno(), 0, access=mmap.ACCESS_READ)
+                if hasattr(mapped, 'madvise'):
+                    mapped.madvise(mmap.MADV_SEQUENTIAL)
+                maps.append(mapped)
+                views[i] = memoryview(mapped)
+
+        def check(index: int):
+            segments = piece_segments(starts, piece_length, index)
+            if any(i not in views for i, offset, length in segments):
+                return None
+
+            # hashlib releases the GIL on big buffers, pieces are hashed in parallel
+            digest = hashlib.sha1()
+            for i, offset, length in segments:
+                digest.update(views[i][offset:offset + length])
+
+            return digest.digest() == pieces[index * HASH_SIZE:(index + 1) * HASH_SIZE]
+
+        with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix='seedboxsync-hash') as executor:
+            return dict(zip(indexes, executor.map(check, indexes)))
+    finally:
+        for view in views.values():
+            view.release()
+        for mapped in maps:
+            mapped.close()
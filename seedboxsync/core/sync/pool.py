@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2015-2024 Guillaume Kulakowski <guillaume@kulakowski.fr>
+#
+# For the full copyright and license information, please view the LICENSE
+# file that was distributed with this source code.
+#
+
+"""
+Pool of workers running transfers concurrently.
+"""
+import itertools
+import queue
+import threading
+from cement import App
+from .concurrency import AdaptiveConcurrency
+
+
+class TransferPool(object):
+    """
+    Pool of worker threads. Each worker owns its own transport client, cloned
+    from the application one, so transfers run on separate channels.
+    """
+
+    def __init__(self, app: App, workers: int = 1, new_transport: bool = False, keep_cwd: bool = True,
+                 concurrency: AdaptiveConcurrency = None):
+        """
+        Init the pool and start workers.
+
+        :param App app: the Cement App object
+        :param int workers: the number of concurrent workers
+        :param bool new_transport: give each worker its own transport instead of a channel on the shared one
+        :param bool keep_cwd: start workers in the current directory of the application client, or in the home one
+        :param AdaptiveConcurrency concurrency: the controller of the number of workers running a job (None = all)
+        """
+        self.app = app
+        self.__new_transport = new_transport
+        self.__keep_cwd = keep_cwd
+        self.__concurrency = concurrency
+        self.__queue = queue.PriorityQueue()
+        self.__order = itertools.count()
+        self.__cancelled = 0
+        self.__threads = []
+
+        for i in range(max(1, workers)):
+            thread = threading.Thread(target=self.__work, name='seedboxsync-worker-%s' % i, daemon=True)
+            thread.start()
+            self.__threads.append(thread)
+
+        self.app.log.debug('Transfer pool started with %s worker(s)' % len(self.__threads))
+
+    def submit(self, func, *args, priority: tuple = ()):
+        """
+        Queue a job. The job is called as ``func(client, *args)``, with the
+        client of the worker. Jobs with the lowest priority run first, then
+        in queued order.
+
+        :param callable func: the job
+        :param tuple priority: the priority of the job
+        """
+        self.__queue.put((0, priority, next(self.__order), (func, args)))
+
+    def cancel(self):
+        """
+        Drop the jobs not started yet, ie: when a run is interrupted. Running
+        jobs are not stopped, ``join`` still waits for them.
+        """
+        # Jobs taken by workers waiting for a stream are dropped by them
+        self.__cancelled = next(self.__order)
+        dropped = 0
+        while True:
+            try:
+                self.__queue.get_nowait()
+                dropped += 1
+            except queue.Empty:
+                break
+
+        if dropped > 0:
+            self.app.log.warning('Cancel %s queued job(s)' % dropped)
+
+        return dropped
+
+    def join(self):
+        """
+        Wait for all queued jobs, then stop workers.
+        """
+        for thread in self.__threads:
+            self.__queue.put((1, (), next(self.__order), None))
+        for thread in self.__threads:
+            thread.join()
+        self.__threads = []
+
+    def __work(self):
+        """
+        Worker loop: run jobs until the stop sentinel.
+        """
+        try:
+            client = self.app.sync.clone(self.__new_transport)
+            if not self.__keep_cwd:
+                client.chdir()
+        except BaseException as exc:
+            self.app.log.error('Worker "%s" failed to connect: %s' % (threading.current_thread().name, str(exc)))
+            return
+
+        try:
+            while True:
+                order, job = self.__queue.get()[2:]
+                if job is None:
+                    break
+
+                # Only workers with a job take a stream, the free ones are left to the segments
+                if self.__concurrency is not None:
+                    self.__concurrency.acquire()
+                try:
+                    if order < self.__cancelled:
+                        continue
+
+                    func, args = job
+                    try:
+                        func(client, *args)
+                    except Exception as exc:
+                        self.app.log.error('SeedboxSyncError > "%s"' % exc)
+                finally:
+                    if self.__concurrency is not None:
+                        self.__concurrency.release()
+        finally:
+            client.close()
+            self.app._db.close()
@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2015-2024 Guillaume Kulakowski <guillaume@kulakowski.fr>
+#
+# For the full copyright and license information, please view the LICENSE
+# file that was distributed with this source code.
+#
+
+"""
+Order of the downloads queued in the transfer pool.
+"""
+import re
+from ..exc import SeedboxSyncConfigurationError
+
+# Download order policies: as listed, smallest files first, oldest files first
+POLICIES = ('walk', 'smallest', 'oldest')
+
+
+class Scheduler(object):
+    """
+    Give each download a priority: first the rank of the first matching
+    priority pattern, then the key of the policy. Lower is downloaded first.
+    """
+
+    def __init__(self, policy: str = 'walk', priorities: list = None, huge_threshold: int = False):
+        """
+        Init the scheduler.
+
+        :param str policy: the download order policy
+        :param list priorities: the regular expressions matched on file paths, by decreasing priority
+        :param int huge_threshold: the size (in bytes) of the files downloaded after the others (false = disable)
+        """
+        if policy not in POLICIES:
+            raise SeedboxSyncConfigurationError('Bad configuration for download_order ! Use one of: %s' % ', '.join(POLICIES))
+
+        try:
+            self.__priorities = [re.compile(pattern) for pattern in (priorities or [])]
+        except re.error:
+            raise SeedboxSyncConfigurationError('Bad configuration for download_priorities ! See the doc at https://docs.python.org/3/library/re.html')
+
+        self.__policy = policy
+        self.__huge_threshold = huge_threshold
+
+    def priority(self, filepath: str, size: int, mtime: int):
+        """
+        Get the priority of a download.
+
+        :param str filepath: the file path
+        :param int size: the file size, None if unknown
+        :param int mtime: the file mtime, None if unknown
+        """
+        rank = len(self.__priorities)
+        for i, pattern in enumerate(self.__priorities):
+            if pattern.search(filepath) is not None:
+                rank = i
+                break
+
+        if self.__policy == 'smallest':
+            key = size or 0
+        elif self.__policy == 'oldest':
+            key = mtime or 0
+        else:
+            key = 0
+
+        return (int(self.is_huge(size)), rank, key)
+
+    def is_huge(self, size: int):
+        """
+        Get if a file is downloaded after the others.
+
+        :param int size: the file size, None if unknown
+        """
+        return self.__huge_threshold is not False and size is not None and size >= int(self.__huge_threshold)
@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2015-2024 Guillaume Kulakowski <guillaume@kulakowski.fr>
+#
+# For the full copyright and license information, please view the LICENSE
+# file that was distributed with this source code.
+#
+
+"""
+Segmented download: a single file fetched by concurrent byte ranges.
+"""
+import os
+from concurrent.futures import ThreadPoolExecutor
+from cement.core.log import LogInterface
+from .abstract_client import AbstractClient
+from .concurrency import AdaptiveConcurrency
+
+
+def split_ranges(size: int, segments: int):
+    """
+    Split a file in contiguous byte ranges.
+
+    :param int size: the size of the file
+    :param int segments: the wanted number of ranges
+    """
+    segments = max(1, min(segments, size))
+    length = size // segments
+    ranges = []
+    for i in range(segments):
+        offset = i * length
+        if i == segments - 1:
+            ranges.append((offset, size - offset))
+        else:
+            ranges.append((offset, length))
+
+    return ranges
+
+
+def preallocate(local_path: str, size: int):
+    """
+    Create (or reset) the local file with its final size.
+
+    :param str local_path: the local file
+    :param int size: the size of the file
+    """
+    fd = os.open(local_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+    try:
+        if hasattr(os, 'posix_fallocate') and size > 0:
+            os.posix_fallocate(fd, 0, size)
+        else:
+            os.ftruncate(fd, size)
+    finally:
+        os.close(fd)
+
+
+def get_segmented(log: LogInterface, client: AbstractClient, remote_path: str, local_path: str, size: int,
+                  segments: int, new_transport: bool = False, concurrency: AdaptiveConcurrency = None, callback=None):
+    """
+    Download a remote file by concurrent byte ranges, each one on its own
+    channel (or transport), written with positional writes in the
+    preallocated local file.
+
+    With a concurrency controller, the download already holds a stream, and
+    takes the free ones for its other ranges.
+
+    :param LogInterface log: the log interface
+    :param AbstractClient client: the client to clone for each range
+    :param str remote_path: the remote file to copy
+    :param str local_path: the destination path on the local host
+    :param int size: the size of the remote file
+    :param int segments: the number of ranges
+    :param bool new_transport: open a new transport for each range instead of a new channel
+    :param AdaptiveConcurrency concurrency: the controller of the number of streams
+    :param callable callback: called with the number of bytes of each chunk copied
+    """
+    extra = segments - 1
+    if concurrency is not None:
+        extra = concurrency.reserve(extra)
+
+    try:
+        return _get_ranges(log, client, remote_path, local_path, size, 1 + extra, new_transport, callback)
+    finally:
+        if concurrency is not None:
+            concurrency.release(extra)
+
+
+def _get_ranges(log: LogInterface, client: AbstractClient, remote_path: str, local_path: str, size: int,
+                segments: int, new_transport: bool, callback):
+    """
+    Download a remote file by concurrent byte ranges.
+
+    :param LogInterface log: the log interface
+    :param AbstractClient client: the client to clone for each range
+    :param str remote_path: the remote file to copy
+    :param str local_path: the destination path on the local host
+    :param int size: the size of the remote file
+    :param int segments: the number of ranges
+    :param bool new_transport: open a new transport for each range instead of a new channel
+    :param callable callback: called with the number of bytes of each chunk copied
+    """
+    ranges = split_ranges(size, segments)
+    log.debug('Segmented download of "%s" in %s ranges' % (remote_path, len(ranges)))
+    preallocate(local_path, size)
+
+    def fetch(offset: int, length: int):
+        range_client = client.clone(new_transport)
+        try:
+            copied = range_client.get_range(remote_path, local_path, offset, length, callback)
+        finally:
+            range_client.close()
+
+        if copied != length:
+            raise IOError('Short read on "%s" at %s (%s/%s)' % (remote_path, offset, copied, length))
+
+        return copied
+
+    with ThreadPoolExecutor(max_workers=len(ranges)) as executor:
+        futures = [executor.submit(fetch, offset, length) for offset, length in ranges]
+
+        return sum(future.result() for future in futures)
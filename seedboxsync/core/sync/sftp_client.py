@@ -10,9 +10,16 @@
 Transport client using sFTP protocol.
 """
 import os
-from .abstract_client import AbstractClient
+import threading
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from .bandwidth import BandwidthLimiter
+from .broker import BrokerChannel, connect_broker
+from .checksum import hash_fd
+from .abstract_client import AbstractClient, RemoteEntry
+from .find import find_command, group_by_directory, parse_find
 from .sync import ConnectionError
-from stat import S_ISDIR
+from stat import S_ISDIR, S_ISLNK
 from cement.core.log import LogInterface
 import paramiko
 
@@ -22,7 +29,12 @@ class SftpClient(AbstractClient):
     Transport from NAS to seedbox using sFTP paramiko library.
     """
 
-    def __init__(self, log: LogInterface, host: str, login: str, password: str, port: str = "22", timeout: str = False):
+    # Size of the chunks read from the remote files
+    CHUNK_SIZE = 32768
+
+    def __init__(self, log: LogInterface, host: str, login: str, password: str, port: str = "22", timeout: str = False,
+                 broker: str = False, transport: paramiko.Transport = None, limiter: BandwidthLimiter = None,
+                 owner: 'SftpClient' = None):
         """
         Init transport and client.
 
@@ -32,6 +44,10 @@ class SftpClient(AbstractClient):
         :param str password: the password to connect on the the server
         :param str port: the port of the server
         :param str timeout: the timeout for socket connection
+        :param str broker: the socket of a local broker to get channels from, if running (false = disable)
+        :param paramiko.Transport transport: an already connected transport to share
+        :param BandwidthLimiter limiter: the bandwidth limiter shared by the transfers (None = unlimited)
+        :param SftpClient owner: the client owning the shared transport, which connects it again if lost
         """
         self.__log = log
         self.__host = host
@@ -39,13 +55,57 @@ class SftpClient(AbstractClient):
         self.__password = password
         self.__port = port
         self.__timeout = timeout
-        self.__transport = None
+        self.__broker = broker
+        self.__transport = transport
+        self.__shared_transport = transport is not None
+        self.__limiter = limiter
+        self.__owner = owner
         self.__client = None
+        self.__lock = threading.Lock()
 
     def __connect_before(self):
         """
         Init connection if not initialized.
         """
+        with self.__lock:
+            self.__connect()
+
+    def __connect(self):
+        """
+        Init transport and sFTP channel, from the broker if running. A lost
+        transport owned by the client, or a lost sFTP channel, is connected
+        again. A lost shared transport is taken again from its owner.
+        """
+        if self.__transport is not None and self.__owner is not None and not self.__transport.is_active():
+            self.__log.warning('Shared transport lost, get the new one')
+            self.__transport = self.__owner.get_transport()
+            self.__shared_transport = self.__transport is not None
+            self.__client = None
+        elif self.__transport is not None and not self.__shared_transport and not self.__transport.is_active():
+            self.__log.warning('Transport lost, connect again')
+            self.__transport = None
+            self.__client = None
+        elif self.__transport is not None and self.__client is not None and self.__client.get_channel().closed:
+            self.__log.warning('sFTP channel lost, open it again')
+            self.__client = None
+
+        if self.__client is None and self.__transport is None and self.__broker:
+            try:
+                sock = connect_broker(self.__broker, 'sftp')
+            except (OSError, paramiko.SSHException) as exc:
+                self.__log.warning('Broker error (%s), connect directly' % str(exc))
+                sock = None
+
+            if sock is not None:
+                self.__log.debug('Get paramiko.SFTPClient channel from broker "%s"' % self.__broker)
+                if self.__timeout:
+                    sock.settimeout(float(self.__timeout))
+                self.__client = paramiko.SFTPClient(sock)
+
+        # Channel from the broker
+        if self.__client is not None and self.__transport is None:
+            return
+
         if self.__transport is None:
             self.__log.debug('Init paramiko.Transport')
             self.__transport = paramiko.Transport((self.__host, int(self.__port)))
@@ -54,6 +114,7 @@ class SftpClient(AbstractClient):
             except paramiko.ssh_exception.AuthenticationException as exc:
                 raise ConnectionError('Connection fail: %s' % str(exc))
 
+        if self.__client is None:
             self.__client = paramiko.SFTPClient.from_transport(self.__transport)
 
             # Setup timeout
@@ -62,6 +123,78 @@ class SftpClient(AbstractClient):
                 channel.settimeout(self.__timeout)
                 self.__log.debug('Timeout is set to %s' % channel.gettimeout())
 
+    def clone(self, new_transport: bool = False):
+        """
+        Get a new client with its own sFTP channel, on the same transport or
+        on a new one. The current directory is kept.
+
+        :param bool new_transport: open a new transport instead of a new channel
+        """
+        self.__connect_before()
+        transport = None if new_transport else self.__transport
+        client = SftpClient(self.__log, self.__host, self.__login, self.__password, self.__port, self.__timeout,
+                            broker=False if new_transport else self.__broker, transport=transport, limiter=self.__limiter,
+                            owner=None if transport is None else self)
+
+        cwd = self.__client.getcwd()
+        if cwd is not None:
+            client.chdir(cwd)
+
+        return client
+
+    def get_transport(self):
+        """
+        Get the transport of the client, connected again if lost. None if the
+        sFTP channel comes from the broker.
+        """
+        self.__connect_before()
+        return self.__transport
+
+    def throttle(self, direction: str):
+        """
+        Get a callback limiting the bandwidth of a new stream, called with the
+        number of bytes of each chunk transferred. None if unlimited.
+
+        :param str direction: "download" or "upload"
+        """
+        if self.__limiter is None:
+            return None
+
+        return self.__limiter.throttle(direction)
+
+    def __progress(self, direction: str, callback=None):
+        """
+        Get the callback of a new stream, limiting its bandwidth before calling
+        ``callback``. None if there is nothing to call.
+
+        :param str direction: "download" or "upload"
+        :param callable callback: called with the number of bytes of each chunk copied
+        """
+        throttle = self.throttle(direction)
+        if throttle is None or callback is None:
+            return throttle or callback
+
+        def progress(nbytes: int):
+            throttle(nbytes)
+            callback(nbytes)
+
+        return progress
+
+    def __cumulative(self, callback):
+        """
+        Get a paramiko callback, called with the total of bytes copied, from a
+        callback called with the number of bytes of each chunk.
+
+        :param callable callback: called with the number of bytes of each chunk copied
+        """
+        copied = [0]
+
+        def progress(transferred: int, total: int):
+            callback(transferred - copied[0])
+            copied[0] = transferred
+
+        return progress
+
     def put(self, local_path: str, remote_path: str):
         """
         Copy a local file (``local_path``) to the SFTP server as ``remote_path``.
@@ -72,18 +205,171 @@ class SftpClient(AbstractClient):
             must result in an error.
         """
         self.__connect_before()
-        return self.__client.put(local_path, remote_path)
+        callback = self.__progress('upload')
+        if callback is None:
+            return self.__client.put(local_path, remote_path)
 
-    def get(self, remote_path: str, local_path: str):
+        return self.__client.put(local_path, remote_path, callback=self.__cumulative(callback))
+
+    def upload(self, local_path: str, tmp_path: str, remote_path: str, mode: int = None):
+        """
+        Copy a local file (``local_path``) to the SFTP server as ``tmp_path``,
+        set its mode, then move it to ``remote_path``. Writes are pipelined and
+        the mode is set on the open handle, so no round trip is waited between
+        blocks and no stat is needed to confirm the upload.
+
+        :param str local_path: the local file to copy
+        :param str tmp_path: the temporary path on the server
+        :param str remote_path: the final path on the server
+        :param int mode: the new permissions (None = server default)
+        """
+        self.__connect_before()
+        callback = self.__progress('upload')
+        with open(local_path, 'rb') as local, self.__client.open(tmp_path, 'wb') as remote:
+            remote.set_pipelined(True)
+            while True:
+                data = local.read(self.CHUNK_SIZE)
+                if len(data) == 0:
+                    break
+                remote.write(data)
+                if callback is not None:
+                    callback(len(data))
+
+            if mode is not None:
+                remote.chmod(mode)
+
+        return self.__client.posix_rename(tmp_path, remote_path)
+
+    def get(self, remote_path: str, local_path: str, callback=None, digest=None):
         """
         Copy a remote file (``remote_path``) from the SFTP server to the local
         host as ``local_path``.
 
         :param str remote_path: the remote file to copy
         :param str local_path: the destination path on the local host
+        :param callable callback: called with the number of bytes of each chunk copied
+        :param digest: the digest updated with the copied bytes, in order (None = no checksum)
+        """
+        self.__connect_before()
+        callback = self.__progress('download', callback)
+        if digest is not None:
+            # Own copy loop, to hash the chunks while they are written
+            fd = os.open(local_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+            try:
+                with self.__client.open(remote_path, 'rb') as remote:
+                    return self.__copy(remote, fd, 0, remote.stat().st_size, callback, digest)
+            finally:
+                os.close(fd)
+
+        if callback is None:
+            return self.__client.get(remote_path, local_path)
+
+        return self.__client.get(remote_path, local_path, callback=self.__cumulative(callback))
+
+    def get_range(self, remote_path: str, local_path: str, offset: int, length: int, callback=None):
+        """
+        Copy ``length`` bytes from ``offset`` of a remote file (``remote_path``)
+        at the same position in the local file ``local_path``, with positional
+        writes. Read requests are prefetched.
+
+        :param str remote_path: the remote file to copy
+        :param str local_path: the destination path on the local host, must exist
+        :param int offset: the first byte to copy
+        :param int length: the number of bytes to copy
+        :param callable callback: called with the number of bytes of each chunk copied
         """
         self.__connect_before()
-        return self.__client.get(remote_path, local_path)
+        callback = self.__progress('download', callback)
+        fd = os.open(local_path, os.O_WRONLY)
+        try:
+            with self.__client.open(remote_path, 'rb') as remote:
+                return self.__copy(remote, fd, offset, offset + length, callback) - offset
+        finally:
+            os.close(fd)
+
+    def readv(self, remote_path: str, chunks: list):
+        """
+        Read several chunks of a remote file (``remote_path``), requested at
+        the same time.
+
+        :param str remote_path: the remote file to read
+        :param list chunks: the chunks to read, as ``(offset, length)``
+        """
+        self.__connect_before()
+        with self.__client.open(remote_path, 'rb') as remote:
+            return list(remote.readv(chunks))
+
+    def resume(self, remote_path: str, local_path: str, overlap: int = 0, callback=None, digest=None):
+        """
+        Resume the copy of a remote file (``remote_path``) in an existing
+        partial local file (``local_path``): the remote file is read from the
+        local size and appended.
+
+        With ``overlap``, the last bytes of the local file are first compared
+        with the remote ones. If they differ, the local file is considered as
+        corrupted and the copy restarts from the beginning.
+
+        :param str remote_path: the remote file to copy
+        :param str local_path: the partial file on the local host
+        :param int overlap: the number of bytes to check before resuming (0 = no check)
+        :param callable callback: called with the number of bytes of each chunk copied
+        :param digest: the digest updated with the copied bytes, in order (None = no checksum)
+        """
+        self.__connect_before()
+        callback = self.__progress('download', callback)
+        fd = os.open(local_path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            offset = os.fstat(fd).st_size
+            with self.__client.open(remote_path, 'rb') as remote:
+                size = remote.stat().st_size
+                if offset > size:
+                    self.__log.warning('Local file bigger than remote, restart "%s"' % remote_path)
+                    offset = 0
+                elif overlap > 0 and offset > 0:
+                    check = min(overlap, offset)
+                    remote.seek(offset - check)
+                    if remote.read(check) != os.pread(fd, check, offset - check):
+                        self.__log.warning('Tail of local file mismatch, restart "%s"' % remote_path)
+                        offset = 0
+
+                os.ftruncate(fd, offset)
+                self.__log.debug('Resume "%s" from %s' % (remote_path, offset))
+                if digest is not None:
+                    hash_fd(fd, digest, 0, offset)
+                return self.__copy(remote, fd, offset, size, callback, digest) - offset
+        finally:
+            os.close(fd)
+
+    def __copy(self, remote: paramiko.SFTPFile, fd: int, position: int, end: int, callback=None, digest=None):
+        """
+        Copy an opened remote file from ``position`` to ``end`` in a local file
+        descriptor, with positional writes. Read requests are prefetched.
+
+        :param paramiko.SFTPFile remote: the opened remote file
+        :param int fd: the local file descriptor
+        :param int position: the first byte to copy
+        :param int end: the byte after the last one to copy
+        :param callable callback: called with the number of bytes of each chunk copied
+        :param digest: the digest updated with the copied bytes, in order (None = no checksum)
+        """
+        remote.seek(position)
+        remote.prefetch(end)
+        while position < end:
+            data = remote.read(min(self.CHUNK_SIZE, end - position))
+            if len(data) == 0:
+                break
+
+            if digest is not None:
+                digest.update(data)
+            view = memoryview(data)
+            while len(view) > 0:
+                written = os.pwrite(fd, view, position)
+                view = view[written:]
+                position += written
+            if callback is not None:
+                callback(len(data))
+
+        return position
 
     def stat(self, filepath: str):
         """
@@ -132,35 +418,185 @@ class SftpClient(AbstractClient):
         """
         return self.__client.posix_rename(old_path, new_path)
 
-    # Code from https://gist.github.com/johnfink8/2190472
-    def walk(self, remote_path: str):
+    def walk(self, remote_path: str, workers: int = 1, lister=None):
+        """
+        Kindof a stripped down version of os.walk, implemented for sftp.
+        The tree is walked breadth-first. With several workers, many
+        directories are listed at the same time, each worker on its own
+        channel, and results are yielded as they arrive.
+
+        Folders and files are yielded as ``RemoteEntry`` with the attributes
+        returned by the listing, so no more stat is needed.
+
+        :param str remote_path: the remote path to list
+        :param int workers: the number of directories listed at the same time
+        :param callable lister: list a directory instead of ``listdir``, called as
+            ``lister(client, path, mtime)`` with the mtime known from the parent listing (or None)
+        """
+        self.__connect_before()
+        if lister is None:
+            def lister(client: SftpClient, path: str, mtime: int):
+                return client.listdir(path)
+
+        if workers <= 1:
+            pending = deque([(remote_path, None)])
+            while pending:
+                path, mtime = pending.popleft()
+                folders, files = lister(self, path, mtime)
+                pending.extend((os.path.join(path, folder.name), folder.mtime) for folder in folders)
+                yield path, folders, files
+            return
+
+        local = threading.local()
+        clients = []
+
+        def listdir(path: str, mtime: int):
+            client = getattr(local, 'client', None)
+            if client is None:
+                client = local.client = self.clone()
+                clients.append(client)
+            return (path,) + tuple(lister(client, path, mtime))
+
+        executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='seedboxsync-walker')
+        try:
+            pending = {executor.submit(listdir, remote_path, None)}
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    path, folders, files = future.result()
+                    for folder in folders:
+                        pending.add(executor.submit(listdir, os.path.join(path, folder.name), folder.mtime))
+                    yield path, folders, files
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
+            for client in clients:
+                client.close()
+
+    def find(self, remote_path: str, workers: int = 1):
         """
-        Kindof a stripped down  version of os.walk, implemented for
-        sftp.  Tried running it flat without the yields, but it really
-        chokes on big directories.
+        Walk a remote tree like ``walk``, with a single ``find`` command run
+        over an exec channel. The output is parsed while it is received.
+        Fallback to ``walk`` if the command can't be run.
 
         :param str remote_path: the remote path to list
+        :param int workers: the number of directories listed at the same time on fallback
+        """
+        self.__connect_before()
+        command = find_command(self.normalize(remote_path))
+        self.__log.debug('List with: %s' % command)
+
+        try:
+            channel = self.execute(command)
+        except paramiko.SSHException as exc:
+            self.__log.warning('Exec not allowed (%s), fallback to sFTP listing' % str(exc))
+            yield from self.walk(remote_path, workers)
+            return
+
+        errors = []
+
+        def receive():
+            while True:
+                data = channel.recv(self.CHUNK_SIZE)
+                while channel.recv_stderr_ready():
+                    errors.append(channel.recv_stderr(self.CHUNK_SIZE))
+                if len(data) == 0:
+                    break
+                yield data
+
+        found = False
+        complete = False
+        try:
+            for walker in group_by_directory(parse_find(receive()), remote_path):
+                found = True
+                yield walker
+            complete = True
+        finally:
+            if not complete:
+                channel.close()
+
+        status = channel.recv_exit_status()
+        while channel.recv_stderr_ready():
+            errors.append(channel.recv_stderr(self.CHUNK_SIZE))
+        channel.close()
+
+        if status != 0:
+            error = b''.join(errors).decode('utf-8', 'replace').strip()
+            if not found:
+                self.__log.warning('Find failed (%s: %s), fallback to sFTP listing' % (status, error))
+                yield from self.walk(remote_path, workers)
+            else:
+                self.__log.warning('Find returned %s: %s' % (status, error))
+
+    def normalize(self, path: str):
+        """
+        Get the absolute remote path of a path relative to the current directory.
+
+        :param str path: the remote path
+        """
+        self.__connect_before()
+        return self.__client.normalize(path or '.')
+
+    def execute(self, command: str):
+        """
+        Run a command on the server over a new exec channel, and return the
+        channel to read its output.
+
+        :param str command: the command to run
+        """
+        self.__connect_before()
+        if self.__transport is None:
+            channel = BrokerChannel(connect_broker(self.__broker, 'exec %s' % command))
+            if self.__timeout:
+                channel.settimeout(float(self.__timeout))
+            return channel
+
+        channel = self.open_session()
+        if self.__timeout:
+            channel.settimeout(self.__timeout)
+        channel.exec_command(command)
+
+        return channel
+
+    def open_session(self):
+        """
+        Open a new session channel on the transport. A lost transport is
+        connected again. The client then owns its transport, and never uses
+        the broker.
+        """
+        with self.__lock:
+            self.__broker = False
+            self.__connect()
+
+        return self.__transport.open_session()
+
+    def listdir(self, path: str):
+        """
+        List a remote directory in one request, returning ``(folders, files)``
+        as lists of ``RemoteEntry``.
+
+        :param str path: the remote path to list
         """
         self.__connect_before()
-        path = remote_path
         files = []
         folders = []
-        for f in self.__client.listdir_attr(remote_path):
+        for f in self.__client.listdir_attr(path):
+            # The size of a symlink is not the one of its target, stat at download
+            entry = RemoteEntry(f.filename, None if S_ISLNK(f.st_mode) else f.st_size, f.st_mtime, f.st_mode)
             if S_ISDIR(f.st_mode):
-                folders.append(f.filename)
+                folders.append(entry)
             else:
-                files.append(f.filename)
-        yield path, folders, files
+                files.append(entry)
 
-        for folder in folders:
-            new_path = os.path.join(remote_path, folder)
-            for x in self.walk(new_path):
-                yield x
+        return folders, files
 
     def close(self):
         """
-        Close transport client.
+        Close transport client. A shared transport is only closed by its owner.
         """
-        if self.__transport is not None:
+        if self.__shared_transport or self.__transport is None:
+            if self.__client is not None:
+                self.__log.debug('Close paramiko.SFTPClient channel')
+                return self.__client.close()
+        elif self.__transport is not None:
             self.__log.debug('Close paramiko.Transport client')
             return self.__transport.close()
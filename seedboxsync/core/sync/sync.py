@@ -7,8 +7,9 @@
 #
 
 from importlib import import_module
-from cement import App
+from cement import App, fs
 from ..exc import SeedboxSyncError
+from .bandwidth import BandwidthLimiter
 
 
 class SyncProtocoleError(SeedboxSyncError):
@@ -42,13 +43,23 @@ def extend_sync(app: App):
             'Unsupported protocole module! No class "%s" in module "seedboxsync.core.sync.%s_client"'
             % (client_class, protocol))
 
+    broker = app.config.get('seedbox', 'broker')
+    if broker:
+        broker = fs.abspath(broker)
+
+    limiter = None
+    if app.config.get('seedbox', 'bandwidth'):
+        limiter = BandwidthLimiter(app.config.get('seedbox', 'bandwidth'))
+
     try:
         sync = transfer_client(log=app.log,
                                host=app.config.get('seedbox', 'host'),
                                port=int(app.config.get('seedbox', 'port')),
                                login=app.config.get('seedbox', 'login'),
                                password=app.config.get('seedbox', 'password'),
-                               timeout=app.config.get('seedbox', 'timeout'))
+                               timeout=app.config.get('seedbox', 'timeout'),
+                               broker=broker,
+                               limiter=limiter)
     except Exception as exc:
         raise ConnectionError('Connection fail: %s' % str(exc))
 
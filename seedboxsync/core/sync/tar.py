@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2015-2024 Guillaume Kulakowski <guillaume@kulakowski.fr>
+#
+# For the full copyright and license information, please view the LICENSE
+# file that was distributed with this source code.
+#
+
+"""
+Small files fetched together, in a single tar stream.
+"""
+import shlex
+import tarfile
+
+# Archive files of a directory on the standard output, with the content of
+# symlinks and hardlinks, as sFTP follows them (GNU tar)
+TAR_COMMAND = 'tar chf - --hard-dereference -C %s -- %s'
+
+
+def tar_command(directory: str, names: list):
+    """
+    Get the tar command archiving files of a remote directory.
+
+    :param str directory: the absolute remote directory
+    :param list names: the names of the files in the directory
+    """
+    return TAR_COMMAND % (shlex.quote(directory), ' '.join(shlex.quote(name) for name in names))
+
+
+def extract_stream(stream, destinations: dict, chunk_size: int = 32768, callback=None, digests: dict = None):
+    """
+    Extract a tar stream while it is read, without seeking. Only the regular
+    files listed in ``destinations`` are written, others are skipped.
+    Yield ``(name, size)`` once a file is written.
+
+    :param file stream: the tar stream
+    :param dict destinations: the local path by file name
+    :param int chunk_size: the size of the chunks copied
+    :param callable callback: called with the number of bytes of each chunk copied
+    :param dict digests: the digests updated with the content of the files, by file name
+    """
+    with tarfile.open(fileobj=stream, mode='r|') as archive:
+        for member in archive:
+            if not member.isfile() or member.name not in destinations:
+                continue
+
+            reader = archive.extractfile(member)
+            digest = None if digests is None else digests.get(member.name)
+            size = 0
+            with open(destinations[member.name], 'wb') as local:
+                while True:
+                    data = reader.read(chunk_size)
+                    if len(data) == 0:
+                        break
+                    local.write(data)
+                    size += len(data)
+                    if digest is not None:
+                        digest.update(data)
+                    if callback is not None:
+                        callback(len(data))
+
+            yield member.name, size
@@ -6,9 +6,202 @@
 # file that was distributed with this source code.
 #
 
-from bcoding import bdecode
+import hashlib
+import mmap
+import re
 from cement import App
 
+# Keys extracted from a torrent, True for a whole value, a dict for the wanted
+# keys of a dict
+TORRENT_KEYS = {
+    'announce': True,
+    'info': {
+        'name': True,
+        'length': True,
+        'files': True,
+        'piece length': True,
+        'pieces': True
+    }
+}
+
+# Keys kept as bytes, others strings are decoded as UTF-8
+RAW_KEYS = ('pieces',)
+
+# An integer, as bcoding accepts it
+INTEGER = re.compile(rb'-?[0-9]+')
+
+
+class BencodeError(ValueError):
+    pass
+
+
+class BencodeScanner(object):
+    """
+    Bencode scanner, decoding only the wanted keys of a buffer. Other values
+    are skipped without copy, and the spans of the scanned dicts are kept.
+    """
+
+    def __init__(self, data):
+        """
+        Init the scanner.
+
+        :param data: the bencoded data, bytes or mmap
+        """
+        self.__data = data
+        self.__view = memoryview(data)
+        self.spans = {}
+
+    def sha1(self, start: int, end: int):
+        """
+        Get the SHA-1 (hex) of a span of the buffer.
+
+        :param int start: the first byte
+        :param int end: the byte after the last one
+        """
+        return hashlib.sha1(self.__view[start:end]).hexdigest()
+
+    def close(self):
+        """
+        Release the buffer.
+        """
+        self.__view.release()
+
+    def scan(self, wanted: dict):
+        """
+        Decode the wanted keys of the root dict.
+
+        :param dict wanted: the wanted keys, as ``TORRENT_KEYS``
+        """
+        if len(self.__data) == 0 or self.__data[0:1] != b'd':
+            raise BencodeError('Not a dict')
+
+        return self.__scan_dict(0, wanted, ())[0]
+
+    def __scan_dict(self, position: int, wanted: dict, path: tuple):
+        """
+        Decode the wanted keys of a dict, and keep its span by path.
+
+        :param int position: the position of the dict
+        :param dict wanted: the wanted keys
+        :param tuple path: the keys of the dict from the root
+        """
+        start = position
+        result = {}
+        position += 1
+        while self.__peek(position) != b'e':
+            key_start, key_end = self.__string(position)
+            key = bytes(self.__view[key_start:key_end]).decode('utf-8', 'replace')
+            position = key_end
+
+            spec = wanted.get(key)
+            if isinstance(spec, dict) and self.__peek(position) == b'd':
+                result[key], position = self.__scan_dict(position, spec, path + (key,))
+            elif spec is True and key in RAW_KEYS:
+                value_start, position = self.__string(position)
+                result[key] = bytes(self.__view[value_start:position])
+            elif spec is True:
+                result[key], position = self.__decode(position)
+            else:
+                position = self.__skip(position)
+
+        self.spans[path] = (start, position + 1)
+
+        return result, position + 1
+
+    def __decode(self, position: int):
+        """
+        Decode a whole value, and return it with the position after it.
+
+        :param int position: the position of the value
+        """
+        token = self.__peek(position)
+        if token == b'i':
+            return self.__integer(position)
+        if token == b'l':
+            values = []
+            position += 1
+            while self.__peek(position) != b'e':
+                value, position = self.__decode(position)
+                values.append(value)
+            return values, position + 1
+        if token == b'd':
+            values = {}
+            position += 1
+            while self.__peek(position) != b'e':
+                key_start, position = self.__string(position)
+                key = bytes(self.__view[key_start:position]).decode('utf-8', 'replace')
+                values[key], position = self.__decode(position)
+            return values, position + 1
+
+        start, position = self.__string(position)
+        return bytes(self.__view[start:position]).decode('utf-8', 'replace'), position
+
+    def __skip(self, position: int):
+        """
+        Skip a value, without decoding it, and return the position after it.
+
+        :param int position: the position of the value
+        """
+        depth = 0
+        while True:
+            token = self.__peek(position)
+            if token in (b'l', b'd'):
+                depth += 1
+                position += 1
+            elif token == b'e' and depth > 0:
+                depth -= 1
+                position += 1
+            elif token == b'i':
+                position = self.__integer(position)[1]
+            else:
+                position = self.__string(position)[1]
+
+            if depth == 0:
+                return position
+
+    def __peek(self, position: int):
+        """
+        Get the token at a position.
+
+        :param int position: the position
+        """
+        if position >= len(self.__data):
+            raise BencodeError('Unexpected end of data')
+
+        return self.__data[position:position + 1]
+
+    def __integer(self, position: int):
+        """
+        Decode an integer, and return it with the position after it.
+
+        :param int position: the position of the integer
+        """
+        end = self.__data.find(b'e', position + 1)
+        if end < 0:
+            raise BencodeError('Unterminated integer at %s' % position)
+
+        raw = bytes(self.__view[position + 1:end])
+        if INTEGER.fullmatch(raw) is None:
+            raise BencodeError('Bad integer at %s' % position)
+
+        return int(raw), end + 1
+
+    def __string(self, position: int):
+        """
+        Get the span of a string value.
+
+        :param int position: the position of the string
+        """
+        colon = self.__data.find(b':', position, position + 21)
+        if colon < 0 or not bytes(self.__view[position:colon]).isdigit():
+            raise BencodeError('Bad token at %s' % position)
+
+        end = colon + 1 + int(bytes(self.__view[position:colon]))
+        if end > len(self.__data):
+            raise BencodeError('Unexpected end of data')
+
+        return colon + 1, end
+
 
 class Bcoding(object):
     """
@@ -22,21 +215,35 @@ class Bcoding(object):
 
     def get_torrent_infos(self, torrent_path: str):
         """
-        Get information about a torrent file.
+        Get information about a torrent file: the announce, the name, files
+        and pieces of its info dict, and its infohash (``info_hash``), hashed
+        from the raw info dict. The file is mapped, and only these keys are
+        decoded.
 
         :param str torrent_path: the path to the torrent file
         """
-        with open(torrent_path, 'rb') as torrent:
-            torrent_info = None
+        try:
+            with open(torrent_path, 'rb') as torrent:
+                mapped = mmap.mmap(torrent.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError) as exc:
+            self.app.log.error('Not valid torrent: "%s" (%s)' % (torrent_path, str(exc)))
+            return None
+
+        scanner = BencodeScanner(mapped)
+        try:
+            torrent_info = scanner.scan(TORRENT_KEYS)
+            if ('info',) not in scanner.spans:
+                raise BencodeError('No info dict')
 
-            try:
-                torrent_info = bdecode(torrent.read())
-            except Exception as exc:
-                self.app.log.error('Not valid torrent: "%s"' + str(exc))
-            finally:
-                torrent.close()
+            torrent_info['info_hash'] = scanner.sha1(*scanner.spans[('info',)])
+        except (BencodeError, RecursionError) as exc:
+            self.app.log.error('Not valid torrent: "%s" (%s)' % (torrent_path, str(exc)))
+            torrent_info = None
+        finally:
+            scanner.close()
+            mapped.close()
 
-            return torrent_info
+        return torrent_info
 
 
 def bcoding_post_setup_hook(app: App):
@@ -7,6 +7,7 @@
 #
 
 import os
+import threading
 from cement import App, fs
 from ..core.exc import SeedboxSyncError
 
@@ -23,6 +24,28 @@ class Lock(object):
         :param App app: the Cement App object
         """
         self.app = app
+        self.__locks = {}
+
+    def hold(self, lock_files: list):
+        """
+        Hold lock files for the life of a long-running process (or exit if
+        already running), then lock its tasks in process.
+
+        :param list lock_files: the lock files paths
+        """
+        for lock_file in lock_files:
+            self.lock_or_exit(lock_file)
+
+        self.__locks = {fs.abspath(lock_file): threading.Lock() for lock_file in lock_files}
+
+    def release(self):
+        """
+        Release the lock files held, remove pid files.
+        """
+        lock_files = list(self.__locks)
+        self.__locks = {}
+        for lock_file in lock_files:
+            self.unlock(lock_file)
 
     def lock(self, lock_file: str):
         """
@@ -31,6 +54,11 @@ class Lock(object):
         :param str lock_file: the lock file path
         """
         lock_file = fs.abspath(lock_file)
+        if lock_file in self.__locks:
+            self.app.log.debug('Lock task in process by %s' % lock_file)
+            self.__locks[lock_file].acquire()
+            return
+
         self.app.log.debug('Lock task by %s' % lock_file)
         try:
             fs.ensure_dir_exists(os.path.dirname(lock_file))
@@ -47,6 +75,11 @@ class Lock(object):
         :param str lock_file: the lock file path
         """
         lock_file = fs.abspath(lock_file)
+        if lock_file in self.__locks:
+            self.app.log.debug('Unlock task in process by %s' % lock_file)
+            self.__locks[lock_file].release()
+            return
+
         self.app.log.debug('Unlock task by %s' % lock_file)
         try:
             os.remove(lock_file)
@@ -60,6 +93,9 @@ class Lock(object):
         :param str lock_file: the lock file path
         """
         lock_file = fs.abspath(lock_file)
+        if lock_file in self.__locks:
+            return self.__locks[lock_file].locked()
+
         if os.path.isfile(lock_file):
             pid = int(open(lock_file, 'r').readlines()[0])
             if self._check_pid(pid):
@@ -72,11 +108,14 @@ class Lock(object):
 
     def lock_or_exit(self, lock_file: str):
         """
-        Lock task or exit if already running.
+        Lock task or exit if already running. Tasks locked in process wait
+        for the running one.
 
         :param str lock_file: the lock file path
         """
-        if self.is_locked(lock_file):
+        if fs.abspath(lock_file) in self.__locks:
+            self.lock(lock_file)
+        elif self.is_locked(lock_file):
             self.app.exit_code = 0
             self.app.close()
         else:
@@ -15,8 +15,10 @@ from .core.sync.sync import extend_sync, close_sync
 from .core.init_defaults import CONFIG
 from .controllers.base import Base
 from .controllers.clean import Clean
+from .controllers.daemon import Daemon
 from .controllers.search import Search
 from .controllers.sync import Sync
+from .controllers.verify import Verify
 
 
 class SeedboxSync(App):
@@ -59,8 +61,10 @@ class SeedboxSync(App):
         handlers = [
             Base,
             Clean,
+            Daemon,
             Search,
-            Sync
+            Sync,
+            Verify
         ]
 
         # register hook
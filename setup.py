@@ -57,8 +57,11 @@ setup(
         'pyyaml',
         'colorlog',
         'paramiko>=2.12',
-        'bcoding>=1.5',
         'tabulate',
         'peewee'
     ],
+
+    extras_require={
+        'xxhash': ['xxhash']
+    },
 )
@@ -0,0 +1,69 @@
+import os
+import pytest
+from paramiko import SSHException
+from seedboxsync.main import SeedboxSyncTest
+
+
+class Stop(Exception):
+    """
+    Stop the daemon from a synchronization.
+    """
+
+
+class FakeClient(object):
+    """
+    Client on an empty seedbox, failing the first run and stopping the daemon
+    on the third one.
+    """
+
+    def __init__(self):
+        self.runs = 0
+        self.walked = 0
+
+    def clone(self, new_transport=False):
+        return self
+
+    def chdir(self, path=None):
+        if path is not None:
+            return
+
+        self.runs += 1
+        if self.runs == 1:
+            raise SSHException('Connection lost')
+        if self.runs == 3:
+            raise Stop()
+
+    def walk(self, remote_path, workers=1, lister=None):
+        self.walked += 1
+        return iter([])
+
+    def close(self):
+        pass
+
+
+def test_daemon_run_after_error(tmp):
+    """
+    Test a seedbox synchronization failing on a SSH error is run again, and
+    the pid files are removed when the daemon stops.
+    """
+    with open(os.path.join(tmp.dir, 'seedboxsync.yml'), 'w') as config:
+        config.write('local:\n  download_path: %s\n  db_file: %s\n'
+                     'pid:\n  blackhole_path: %s\n  download_path: %s\n'
+                     'daemon:\n  blackhole_interval: false\n  seedbox_interval: 0\n  jitter: 0\n'
+                     % (os.path.join(tmp.dir, 'dl'), os.path.join(tmp.dir, 'seedboxsync.db'),
+                        os.path.join(tmp.dir, 'blackhole.pid'), os.path.join(tmp.dir, 'download.pid')))
+
+    client = FakeClient()
+
+    def fake_sync(app):
+        app.sync = client
+
+    with SeedboxSyncTest(argv=['daemon'], config_dirs=[tmp.dir]) as app:
+        app.hook.register('pre_run', fake_sync)
+        with pytest.raises(Stop):
+            app.run()
+
+    assert client.runs == 3
+    assert client.walked == 1
+    assert not os.path.exists(os.path.join(tmp.dir, 'blackhole.pid'))
+    assert not os.path.exists(os.path.join(tmp.dir, 'download.pid'))
@@ -0,0 +1,446 @@
+import os
+import posixpath
+import shutil
+import sqlite3
+import threading
+import time
+from stat import S_IFREG
+from types import SimpleNamespace
+from unittest import mock
+import pytest
+from paramiko import SSHException
+from seedboxsync.core.inotify import IN_CLOSE_WRITE
+from seedboxsync.core.sync.abstract_client import RemoteEntry
+from seedboxsync.main import SeedboxSyncTest
+
+TORRENT = os.path.join(os.getcwd(), 'tests', 'resources', 'Fedora-Server-dvd-x86_64-32.torrent')
+
+
+class FakeClient(object):
+    """
+    Client recording the uploads, failing the first ones if asked.
+    """
+
+    def __init__(self, failures=0):
+        self.uploaded = []
+        self.failures = failures
+        self.lock = threading.Lock()
+
+    def clone(self, new_transport=False):
+        return self
+
+    def chdir(self, path=None):
+        pass
+
+    def upload(self, local_path, tmp_path, remote_path, mode=None):
+        with self.lock:
+            if self.failures > 0:
+                self.failures -= 1
+                raise SSHException('Upload refused')
+            self.uploaded.append(os.path.basename(local_path))
+
+    def close(self):
+        pass
+
+
+def get_config_dirs(tmp, workers=4):
+    """
+    Write a configuration with a database, a watch folder and locks in the
+    tmp directory.
+    """
+    os.makedirs(os.path.join(tmp.dir, 'watch'))
+    with open(os.path.join(tmp.dir, 'seedboxsync.yml'), 'w') as config:
+        config.write('seedbox:\n  max_parallel_uploads: %s\n'
+                     'local:\n  watch_path: %s\n  db_file: %s\n'
+                     'pid:\n  blackhole_path: %s\n'
+                     % (workers, os.path.join(tmp.dir, 'watch'), os.path.join(tmp.dir, 'seedboxsync.db'), os.path.join(tmp.dir, 'blackhole.pid')))
+
+    return [tmp.dir]
+
+
+class Stop(Exception):
+    """
+    Stop a watch or a follow.
+    """
+
+
+def wait_for(condition):
+    """
+    Wait for a condition set by the workers.
+    """
+    deadline = time.monotonic() + 5
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+
+def sync_blackhole(tmp, client, torrents, args=()):
+    """
+    Copy torrents in the watch folder, and run a blackhole synchronization
+    with a fake client.
+    """
+    for name in torrents:
+        shutil.copy(TORRENT, os.path.join(tmp.dir, 'watch', name))
+
+    def fake_sync(app):
+        app.sync = client
+
+    with SeedboxSyncTest(argv=['sync', 'blackhole'] + list(args), config_dirs=tmp.config_dirs) as app:
+        app.hook.register('pre_run', fake_sync)
+        app.run()
+
+    return sorted(os.listdir(os.path.join(tmp.dir, 'watch')))
+
+
+def get_torrents(tmp):
+    """
+    Get the stored torrents.
+    """
+    with sqlite3.connect(os.path.join(tmp.dir, 'seedboxsync.db')) as db:
+        return db.execute('SELECT name, info_hash FROM torrent ORDER BY id').fetchall()
+
+
+def test_blackhole_duplicate_in_batch(tmp):
+    """
+    Test two copies of a torrent in the same batch are uploaded once.
+    """
+    tmp.config_dirs = get_config_dirs(tmp)
+    client = FakeClient()
+
+    assert sync_blackhole(tmp, client, ['a.torrent', 'b.torrent']) == []
+    assert len(client.uploaded) == 1
+    torrents = get_torrents(tmp)
+    assert len(torrents) == 1
+    assert len(torrents[0][1]) == 40
+
+
+def test_blackhole_already_sent(tmp):
+    """
+    Test a torrent already sent, even renamed, is removed without upload.
+    """
+    tmp.config_dirs = get_config_dirs(tmp)
+    client = FakeClient()
+    sync_blackhole(tmp, client, ['a.torrent'])
+
+    assert sync_blackhole(tmp, client, ['renamed.torrent']) == []
+    assert client.uploaded == ['a.torrent']
+    assert [name for name, info_hash in get_torrents(tmp)] == ['a.torrent']
+
+
+def test_blackhole_upload_fail(tmp):
+    """
+    Test a failed upload releases the infohash, the next copy is uploaded.
+    """
+    tmp.config_dirs = get_config_dirs(tmp, workers=1)
+    client = FakeClient(failures=1)
+
+    remaining = sync_blackhole(tmp, client, ['a.torrent', 'b.torrent'])
+    assert len(client.uploaded) == 1
+    assert len(remaining) == 1
+    assert remaining[0] not in client.uploaded
+
+    # The torrent left in the watch folder is not sent again
+    assert sync_blackhole(tmp, client, []) == []
+    assert len(client.uploaded) == 1
+
+
+class FakeInotify(object):
+    """
+    Inotify reporting a torrent written in the watch folder, then stopping
+    the watch once ``done`` is true.
+    """
+
+    def __init__(self, watch_path, done):
+        self.events = [[(1, IN_CLOSE_WRITE, 0, 'new.torrent')], []]
+        self.watch_path = watch_path
+        self.done = done
+
+    def __call__(self):
+        return self
+
+    def add_watch(self, path, mask):
+        shutil.copy(TORRENT, os.path.join(self.watch_path, 'new.torrent'))
+
+    def read(self, timeout=None):
+        if len(self.events) > 0:
+            return self.events.pop(0)
+        wait_for(self.done)
+        raise Stop()
+
+    def close(self):
+        pass
+
+
+@pytest.mark.parametrize('args', [['--watch'], ['--watch', '--dry-run']])
+def test_blackhole_watch(tmp, args):
+    """
+    Test a torrent written during a watch is uploaded, and the lock is removed
+    when the watch is stopped.
+    """
+    tmp.config_dirs = get_config_dirs(tmp)
+    with open(os.path.join(tmp.dir, 'seedboxsync.yml')) as config:
+        content = config.read().replace('local:\n', 'local:\n  watch_debounce: 0\n')
+    with open(os.path.join(tmp.dir, 'seedboxsync.yml'), 'w') as config:
+        config.write(content)
+    client = FakeClient()
+    watch_path = os.path.join(tmp.dir, 'watch')
+
+    with mock.patch('seedboxsync.controllers.sync.Inotify', FakeInotify(watch_path, lambda: '--dry-run' in args or len(client.uploaded) > 0)):
+        with pytest.raises(Stop):
+            sync_blackhole(tmp, client, [], args)
+
+    if '--dry-run' in args:
+        assert client.uploaded == []
+    else:
+        assert client.uploaded == ['new.torrent']
+    assert not os.path.exists(os.path.join(tmp.dir, 'blackhole.pid'))
+
+
+class FakeSeedbox(object):
+    """
+    Client on a seedbox tree of files (path: (data, mtime)), recording the
+    downloads.
+    """
+
+    def __init__(self, files, links=()):
+        self.files = files
+        self.links = set(links)
+        self.downloaded = []
+        self.lock = threading.Lock()
+
+    def clone(self, new_transport=False):
+        return self
+
+    def chdir(self, path=None):
+        pass
+
+    def walk(self, remote_path, workers=1, lister=None):
+        directories = {}
+        for path, (data, mtime) in sorted(self.files.items()):
+            size = None if path in self.links else len(data)
+            directories.setdefault(os.path.dirname(path), []).append(RemoteEntry(os.path.basename(path), size, mtime, S_IFREG))
+        for directory, files in directories.items():
+            yield directory, [], files
+
+    def stat(self, path):
+        if path not in self.files:
+            raise FileNotFoundError(path)
+        data, mtime = self.files[path]
+        return SimpleNamespace(st_size=len(data), st_mtime=mtime, st_mode=S_IFREG)
+
+    def readv(self, path, chunks):
+        data = self.files[path][0]
+        return [data[offset:offset + length] for offset, length in chunks]
+
+    def get(self, remote_path, local_path, callback=None, digest=None):
+        with self.lock:
+            self.downloaded.append(remote_path)
+        with open(local_path, 'wb') as local:
+            local.write(self.files[remote_path][0])
+
+    def normalize(self, path):
+        return posixpath.join('/seedbox', path)
+
+    def execute(self, command):
+        return self.channel
+
+    def close(self):
+        pass
+
+
+class FakeChannel(object):
+    """
+    Channel of a follow command, always readable, returning the given outputs
+    then stopping the follow once ``done`` is true.
+    """
+
+    def __init__(self, outputs, done):
+        self.outputs = outputs
+        self.done = done
+        self.pipe = os.pipe()
+        os.write(self.pipe[1], b'x')
+
+    def fileno(self):
+        return self.pipe[0]
+
+    def recv(self, size):
+        if len(self.outputs) > 0:
+            return self.outputs.pop(0)
+        wait_for(self.done)
+        raise Stop()
+
+    def close(self):
+        for fd in self.pipe:
+            os.close(fd)
+
+
+def sync_seedbox(tmp, client, moved_files='rename', args=(), batch_size=1000):
+    """
+    Run a seedbox synchronization with a fake client, and return its exit code.
+    """
+    with open(os.path.join(tmp.dir, 'seedboxsync.yml'), 'w') as config:
+        config.write('seedbox:\n  moved_files: %s\n  tar_threshold: false\n  segmented_threshold: false\n  max_parallel_downloads: 2\n'
+                     'local:\n  download_path: %s\n  db_file: %s\n'
+                     'local.db:\n  batch_size: %s\n'
+                     'pid:\n  download_path: %s\n'
+                     % (moved_files, os.path.join(tmp.dir, 'dl'), os.path.join(tmp.dir, 'seedboxsync.db'), batch_size,
+                        os.path.join(tmp.dir, 'download.pid')))
+
+    def fake_sync(app):
+        app.sync = client
+
+    with SeedboxSyncTest(argv=['sync', 'seedbox'] + list(args), config_dirs=[tmp.dir]) as app:
+        app.hook.register('pre_run', fake_sync)
+        app.run()
+
+    return app.exit_code
+
+
+def read_local(tmp, path):
+    """
+    Read a downloaded file.
+    """
+    with open(os.path.join(tmp.dir, 'dl', path), 'rb') as local:
+        return local.read()
+
+
+def get_downloads(tmp):
+    """
+    Get the paths of the finished downloads.
+    """
+    with sqlite3.connect(os.path.join(tmp.dir, 'seedboxsync.db')) as db:
+        return sorted(path for path, in db.execute('SELECT path FROM download WHERE finished != 0'))
+
+
+def test_seedbox_only_store(tmp):
+    """
+    Test files are stored without download, by batches of multi-row inserts,
+    with the size of symlinks from a stat.
+    """
+    files = {'dir%s/file%03d.mkv' % (i % 3, i): (b'x' * i, 1000 + i) for i in range(250)}
+    client = FakeSeedbox(files, links=['dir0/file000.mkv', 'dir1/file100.mkv'])
+
+    assert sync_seedbox(tmp, client, args=['--only-store'], batch_size=120) == 0
+    assert client.downloaded == []
+    with sqlite3.connect(os.path.join(tmp.dir, 'seedboxsync.db')) as db:
+        rows = db.execute('SELECT path, seedbox_size, seedbox_mtime, local_size FROM download WHERE finished != 0 ORDER BY path').fetchall()
+    assert rows == sorted((path, len(data), mtime, len(data)) for path, (data, mtime) in files.items())
+
+    # Nothing is stored again
+    assert sync_seedbox(tmp, client, args=['--only-store'], batch_size=120) == 0
+    assert len(get_downloads(tmp)) == 250
+
+
+def test_seedbox_moved_rename(tmp):
+    """
+    Test a folder renamed on the seedbox is renamed locally, without download.
+    """
+    client = FakeSeedbox({'a/x.r00': (b'0' * 1000, 100), 'a/x.r01': (b'1' * 1000, 100)})
+    sync_seedbox(tmp, client)
+    assert sorted(client.downloaded) == ['a/x.r00', 'a/x.r01']
+
+    client.files = {'b/x.r00': client.files['a/x.r00'], 'b/x.r01': client.files['a/x.r01']}
+    client.downloaded = []
+    sync_seedbox(tmp, client)
+    assert client.downloaded == []
+    assert read_local(tmp, 'b/x.r00') == b'0' * 1000
+    assert read_local(tmp, 'b/x.r01') == b'1' * 1000
+    assert not os.path.exists(os.path.join(tmp.dir, 'dl', 'a', 'x.r00'))
+    assert get_downloads(tmp) == ['b/x.r00', 'b/x.r01']
+
+
+def test_seedbox_moved_hardlink(tmp):
+    """
+    Test a file moved on the seedbox is hardlinked locally, without download.
+    """
+    client = FakeSeedbox({'a/file.mkv': (b'a' * 1000, 100)})
+    sync_seedbox(tmp, client, 'hardlink')
+
+    client.files = {'renamed.mkv': client.files['a/file.mkv']}
+    client.downloaded = []
+    sync_seedbox(tmp, client, 'hardlink')
+    assert client.downloaded == []
+    assert os.path.samefile(os.path.join(tmp.dir, 'dl', 'renamed.mkv'), os.path.join(tmp.dir, 'dl', 'a', 'file.mkv'))
+    assert get_downloads(tmp) == ['a/file.mkv', 'renamed.mkv']
+
+
+def test_seedbox_moved_other_content(tmp):
+    """
+    Test a new file of the same size and mtime as a download gone from the
+    seedbox, but of another content, is downloaded and the local file kept.
+    """
+    client = FakeSeedbox({'a/file.mkv': (b'a' * 1000, 100)})
+    sync_seedbox(tmp, client)
+
+    client.files = {'b/other.mkv': (b'b' * 1000, 100)}
+    client.downloaded = []
+    sync_seedbox(tmp, client)
+    assert client.downloaded == ['b/other.mkv']
+    assert read_local(tmp, 'a/file.mkv') == b'a' * 1000
+    assert read_local(tmp, 'b/other.mkv') == b'b' * 1000
+    assert get_downloads(tmp) == ['a/file.mkv', 'b/other.mkv']
+
+
+def test_seedbox_moved_collision(tmp):
+    """
+    Test a new file of the same size and mtime as files still on the seedbox
+    is downloaded, and a copy of one of them is hardlinked.
+    """
+    client = FakeSeedbox({'a/x.r00': (b'0' * 1000, 100), 'a/x.r01': (b'1' * 1000, 100)})
+    sync_seedbox(tmp, client)
+
+    client.files['a/x.r02'] = (b'2' * 1000, 100)
+    client.files['copy/x.r01'] = client.files['a/x.r01']
+    client.downloaded = []
+    sync_seedbox(tmp, client)
+    assert client.downloaded == ['a/x.r02']
+    assert read_local(tmp, 'a/x.r02') == b'2' * 1000
+    assert os.path.samefile(os.path.join(tmp.dir, 'dl', 'copy', 'x.r01'), os.path.join(tmp.dir, 'dl', 'a', 'x.r01'))
+    assert read_local(tmp, 'a/x.r00') == b'0' * 1000
+
+
+def test_seedbox_moved_renamed_collision(tmp):
+    """
+    Test renamed files of the same size and mtime are only reused by their
+    content.
+    """
+    client = FakeSeedbox({'a/x.r00': (b'0' * 1000, 100), 'a/x.r01': (b'1' * 1000, 100)})
+    sync_seedbox(tmp, client)
+
+    client.files = {'b/y.r00': client.files['a/x.r00'], 'b/y.r01': client.files['a/x.r01']}
+    client.downloaded = []
+    sync_seedbox(tmp, client)
+    assert client.downloaded == []
+    assert read_local(tmp, 'b/y.r00') == b'0' * 1000
+    assert read_local(tmp, 'b/y.r01') == b'1' * 1000
+
+
+@pytest.mark.parametrize('args', [['--follow', '--dry-run'], ['--follow', '--only-store']])
+def test_seedbox_follow_without_download(tmp, args):
+    """
+    Test a follow without downloads returns after the walk, and removes the
+    lock once.
+    """
+    client = FakeSeedbox({'a/file.mkv': (b'a' * 1000, 100)})
+
+    assert sync_seedbox(tmp, client, args=args) == 0
+    assert client.downloaded == []
+    assert not os.path.exists(os.path.join(tmp.dir, 'download.pid'))
+    if '--only-store' in args:
+        assert get_downloads(tmp) == ['a/file.mkv']
+
+
+def test_seedbox_follow(tmp):
+    """
+    Test files are downloaded after the walk from the follow events, and the
+    lock is removed when the follow is stopped.
+    """
+    client = FakeSeedbox({'a/file.mkv': (b'a' * 1000, 100)})
+    client.channel = FakeChannel([b'/seedbox/b/new', b'.mkv\n/seedbox/b/gone.mkv\n'], lambda: 'b/new.mkv' in client.downloaded)
+    client.files['b/new.mkv'] = (b'b' * 1000, 200)
+
+    with pytest.raises(Stop):
+        sync_seedbox(tmp, client, args=['--follow'])
+
+    assert sorted(client.downloaded) == ['a/file.mkv', 'b/new.mkv']
+    assert get_downloads(tmp) == ['a/file.mkv', 'b/new.mkv']
+    assert not os.path.exists(os.path.join(tmp.dir, 'download.pid'))
@@ -0,0 +1,58 @@
+import time
+import pytest
+from unittest import mock
+from seedboxsync.core.sync.bandwidth import BandwidthLimiter, LEASE, TokenBucket
+
+
+def at(hour: int, minute: int = 0):
+    """
+    Get a local time.
+    """
+    return time.struct_time((2024, 1, 1, hour, minute, 0, 0, 1, -1))
+
+
+def test_windows():
+    """
+    Test the caps by time windows.
+    """
+    limiter = BandwidthLimiter([{'start': '08:00', 'end': '23:00', 'download': 5242880, 'upload': False},
+                                {'start': 1380, 'end': '01:30', 'total': 1048576}])
+    assert limiter.caps(at(7, 59)) == {}
+    assert limiter.caps(at(8)) == {'download': 5242880}
+    assert limiter.caps(at(23)) == {'total': 1048576}
+    assert limiter.caps(at(1, 29)) == {'total': 1048576}
+    assert limiter.caps(at(1, 30)) == {}
+
+    assert BandwidthLimiter([{'upload': 1024}]).caps(at(12)) == {'upload': 1024}
+
+    with pytest.raises(SystemExit):
+        BandwidthLimiter([{'start': '8h', 'download': 1024}])
+
+
+def test_token_bucket():
+    """
+    Test the wait for missing tokens.
+    """
+    bucket = TokenBucket()
+    with mock.patch('seedboxsync.core.sync.bandwidth.time.monotonic', return_value=0):
+        assert bucket.take(1048576, 1048576) == 0
+        assert bucket.take(524288, 1048576) == 0.5
+    with mock.patch('seedboxsync.core.sync.bandwidth.time.monotonic', return_value=1):
+        assert bucket.take(524288, 1048576) == 0
+
+
+def test_throttle():
+    """
+    Test streams take bytes by leases.
+    """
+    limiter = BandwidthLimiter([{'download': 10485760}])
+    assert limiter.take('download', 32768)[0] == 32768 + LEASE
+    assert limiter.take('download', 32768)[0] == 32768 + LEASE
+    assert limiter.take('upload', 32768) == (32768 + LEASE, 0)
+    assert BandwidthLimiter([{'total': 20000}]).take('upload', 32768)[0] == 32768 + 2000
+
+    with mock.patch.object(limiter, 'take', return_value=(32768 + LEASE, 0)) as take:
+        throttle = limiter.throttle('download')
+        for i in range(LEASE // 32768 + 2):
+            throttle(32768)
+        assert take.call_count == 2
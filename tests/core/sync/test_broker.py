@@ -0,0 +1,167 @@
+import os
+import socket
+import stat
+import struct
+import threading
+import time
+from types import SimpleNamespace
+import pytest
+from paramiko import SSHException
+from seedboxsync.core.sync.broker import FRAME, Broker, BrokerChannel, connect_broker, is_running
+
+
+def test_broker_channel():
+    """
+    Test outputs and exit status read from the broker frames.
+    """
+    broker, client = socket.socketpair()
+    for kind, data in ((b'o', b'abc'), (b'e', b'warning'), (b'o', b'def'), (b'x', struct.pack('!i', 2))):
+        broker.sendall(FRAME.pack(kind, len(data)) + data)
+    broker.close()
+
+    channel = BrokerChannel(client)
+    assert channel.recv(2) == b'ab'
+    assert channel.makefile('rb').read() == b'cdef'
+    assert channel.recv(10) == b''
+    assert channel.recv_stderr_ready()
+    assert channel.recv_stderr(100) == b'warning'
+    assert channel.recv_exit_status() == 2
+    channel.close()
+
+
+class FakeChannel(object):
+    """
+    SSH channel relayed from a socket, the test holds the remote end.
+    """
+
+    def __init__(self, stderr=b'', status=None):
+        self.sock, self.remote = socket.socketpair()
+        self.stderr = stderr
+        self.status = status
+        self.request = None
+        self.closed = threading.Event()
+
+    def invoke_subsystem(self, name):
+        self.request = name
+
+    def exec_command(self, command):
+        self.request = 'exec %s' % command
+
+    def fileno(self):
+        return self.sock.fileno()
+
+    def recv(self, size):
+        return self.sock.recv(size)
+
+    def sendall(self, data):
+        self.sock.sendall(data)
+
+    def recv_ready(self):
+        return False
+
+    def recv_stderr_ready(self):
+        return len(self.stderr) > 0
+
+    def recv_stderr(self, size):
+        data, self.stderr = self.stderr[:size], self.stderr[size:]
+        return data
+
+    def exit_status_ready(self):
+        return False
+
+    def recv_exit_status(self):
+        return self.status
+
+    def close(self):
+        self.sock.close()
+        self.closed.set()
+
+
+class FakeClient(object):
+    """
+    Client holding the transport, opening the given channels.
+    """
+
+    def __init__(self, channels):
+        self.channels = channels
+
+    def open_session(self):
+        if len(self.channels) == 0:
+            raise SSHException('SSH session not active')
+        return self.channels.pop(0)
+
+
+def start_broker(tmp, channels):
+    """
+    Start a broker on a fake client, return its socket path.
+    """
+    path = os.path.join(tmp.dir, 'broker', 'broker.sock')
+    log = SimpleNamespace(debug=lambda msg: None, info=lambda msg: None)
+    broker = Broker(log, FakeClient(channels), path)
+    threading.Thread(target=broker.serve_forever, daemon=True).start()
+    for i in range(500):
+        if is_running(path):
+            break
+        time.sleep(0.01)
+
+    return path
+
+
+def test_broker_socket_mode(tmp):
+    """
+    Test the broker socket is only accessible by the user.
+    """
+    path = start_broker(tmp, [])
+    assert stat.S_IMODE(os.stat(path).st_mode) == 0o600
+    assert stat.S_IMODE(os.stat(os.path.dirname(path)).st_mode) == 0o700
+
+
+def test_broker_relay_sftp(tmp):
+    """
+    Test an sFTP channel is relayed both ways, and closed with the client.
+    """
+    channel = FakeChannel()
+    path = start_broker(tmp, [channel])
+
+    sock = connect_broker(path, 'sftp')
+    assert channel.request == 'sftp'
+    sock.sendall(b'request')
+    assert channel.remote.recv(100) == b'request'
+    channel.remote.sendall(b'response')
+    assert sock.recv(100) == b'response'
+
+    sock.close()
+    assert channel.closed.wait(5)
+
+
+def test_broker_relay_exec(tmp):
+    """
+    Test the outputs and the exit status of a command are relayed.
+    """
+    channel = FakeChannel(stderr=b'warning', status=3)
+    path = start_broker(tmp, [channel])
+
+    remote = BrokerChannel(connect_broker(path, 'exec ls -l'))
+    assert channel.request == 'exec ls -l'
+    channel.remote.sendall(b'output')
+    channel.remote.close()
+
+    assert remote.read() == b'output'
+    assert remote.recv_stderr(100) == b'warning'
+    assert remote.recv_exit_status() == 3
+    remote.close()
+    assert channel.closed.wait(5)
+
+
+def test_connect_broker_error(tmp):
+    """
+    Test the errors of the broker are raised to the client, and a broker not
+    running gives no channel.
+    """
+    path = start_broker(tmp, [FakeChannel()])
+
+    with pytest.raises(SSHException, match='Unknown request "foo"'):
+        connect_broker(path, 'foo')
+    with pytest.raises(SSHException, match='SSH session not active'):
+        connect_broker(path, 'sftp')
+    assert connect_broker(os.path.join(tmp.dir, 'none.sock'), 'sftp') is None
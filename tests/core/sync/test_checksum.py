@@ -0,0 +1,36 @@
+import hashlib
+import pytest
+from seedboxsync.core.sync.checksum import checksum_command, hash_file, new_digest, parse_checksum
+
+
+def test_new_digest():
+    """
+    Test digests by algorithm.
+    """
+    digest = new_digest('sha256')
+    digest.update(b'seedbox')
+    assert digest.hexdigest() == hashlib.sha256(b'seedbox').hexdigest()
+
+    with pytest.raises(SystemExit):
+        new_digest('sha0')
+
+
+def test_hash_file(tmp_path):
+    """
+    Test hashing a local file, whole or its beginning.
+    """
+    data = b'x' * 3000000
+    (tmp_path / 'file').write_bytes(data)
+
+    assert hash_file(str(tmp_path / 'file'), new_digest('sha1')).hexdigest() == hashlib.sha1(data).hexdigest()
+    assert hash_file(str(tmp_path / 'file'), new_digest('sha1'), end=10).hexdigest() == hashlib.sha1(data[:10]).hexdigest()
+
+
+def test_checksum_command():
+    """
+    Test the remote command and its output parsing.
+    """
+    assert checksum_command('sha256sum', "/home/me/it's.mkv") == "sha256sum -- '/home/me/it'\"'\"'s.mkv'"
+    assert parse_checksum(b'ABCDEF0123  /home/me/file.mkv\n') == 'abcdef0123'
+    assert parse_checksum(b'\\abcdef  /home/me/new\\nline\n') == 'abcdef'
+    assert parse_checksum(b'') is None
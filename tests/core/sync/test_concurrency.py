@@ -0,0 +1,57 @@
+from unittest import mock
+from seedboxsync.core.sync.concurrency import AdaptiveConcurrency
+
+
+def measure(concurrency: AdaptiveConcurrency, rates: list):
+    """
+    Record a measure of one second, with the bytes of each stream.
+    """
+    concurrency._AdaptiveConcurrency__bytes = {stream: nbytes for stream, nbytes in enumerate(rates[1:])}
+    concurrency._AdaptiveConcurrency__start = 0
+    with mock.patch('seedboxsync.core.sync.concurrency.time.monotonic', return_value=1):
+        concurrency.record(rates[0])
+
+
+def test_adaptive_concurrency():
+    """
+    Test additive increase, multiplicative decrease and hold.
+    """
+    concurrency = AdaptiveConcurrency(mock.Mock(), minimum=1, maximum=8, interval=1)
+    assert concurrency.limit == 1
+
+    # Throughput grows: add streams
+    measure(concurrency, [100])
+    assert concurrency.limit == 2
+    measure(concurrency, [100, 100])
+    assert concurrency.limit == 3
+
+    # Not all streams used: nothing to learn
+    measure(concurrency, [100, 100])
+    assert concurrency.limit == 3
+
+    measure(concurrency, [100, 100, 100])
+    assert concurrency.limit == 4
+    measure(concurrency, [100, 100, 100, 100])
+    assert concurrency.limit == 5
+
+    # Useless stream: removed, then held
+    measure(concurrency, [80, 80, 80, 80, 80])
+    assert concurrency.limit == 4
+    measure(concurrency, [100, 100, 100, 100])
+    assert concurrency.limit == 4
+
+    # Throughput falls: halved
+    measure(concurrency, [50, 50, 50, 50])
+    assert concurrency.limit == 2
+
+
+def test_reserve():
+    """
+    Test taking free streams without waiting.
+    """
+    concurrency = AdaptiveConcurrency(mock.Mock(), minimum=3, maximum=8)
+    concurrency.acquire()
+    assert concurrency.reserve(4) == 2
+    assert concurrency.reserve(1) == 0
+    concurrency.release(3)
+    assert concurrency.reserve(1) == 1
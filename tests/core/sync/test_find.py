@@ -0,0 +1,42 @@
+from stat import S_IFDIR, S_IFREG
+from seedboxsync.core.sync.abstract_client import RemoteEntry
+from seedboxsync.core.sync.find import find_command, group_by_directory, parse_find
+
+
+OUTPUT = b'd 4096 1600000000.5 a\0f 10 1600000001.25 a/file.mkv\0d 4096 1600000002.0 a/b\0' \
+         b'f 20 1600000003.0 a/b/sub.srt\0f 30 1600000004.0 a/other.nfo\0f 0 1600000005.0 root with space.txt\0'
+
+
+def test_find_command():
+    """
+    Test the find command quoting.
+    """
+    assert find_command('/home/me/files') == "find /home/me/files -mindepth 1 -printf '%y %s %T@ %P\\0'"
+    assert find_command("/home/me/it's") == "find '/home/me/it'\"'\"'s' -mindepth 1 -printf '%y %s %T@ %P\\0'"
+
+
+def test_parse_find_by_chunks():
+    """
+    Test parsing whatever the chunks boundaries.
+    """
+    expected = list(parse_find([OUTPUT]))
+    assert list(parse_find(OUTPUT[i:i + 7] for i in range(0, len(OUTPUT), 7))) == expected
+    assert expected[1] == ('a/file.mkv', RemoteEntry('file.mkv', 10, 1600000001, S_IFREG))
+    assert expected[0] == ('a', RemoteEntry('a', 4096, 1600000000, S_IFDIR))
+    assert list(parse_find([b'l 5 1600000006.0 a/link.mkv\0'])) == [('a/link.mkv', RemoteEntry('link.mkv', None, 1600000006, S_IFREG))]
+
+
+def test_group_by_directory():
+    """
+    Test records grouped like walk.
+    """
+    walked = [(path, [f.name for f in folders], [f.name for f in files])
+              for path, folders, files in group_by_directory(parse_find([OUTPUT]))]
+    assert walked == [('', ['a'], []),
+                      ('a', ['b'], ['file.mkv']),
+                      ('a/b', [], ['sub.srt']),
+                      ('a', [], ['other.nfo']),
+                      ('', [], ['root with space.txt'])]
+
+    walked = [path for path, folders, files in group_by_directory(parse_find([OUTPUT]), 'files')]
+    assert walked == ['files', 'files/a', 'files/a/b', 'files/a', 'files']
@@ -0,0 +1,148 @@
+import os
+from types import SimpleNamespace
+from seedboxsync.main import SeedboxSyncTest
+from seedboxsync.core.dao.download import Download
+from seedboxsync.core.dao.manifest import RemoteDirectory
+from seedboxsync.core.sync.abstract_client import RemoteEntry
+from seedboxsync.core.sync.manifest import Manifest
+
+
+class FakeClient(object):
+    """
+    Client on a tree of a single directory, with its mtime and files.
+    """
+
+    def __init__(self):
+        self.mtime = 1000
+        self.files = {}
+        self.listed = 0
+
+    def stat(self, path):
+        return SimpleNamespace(st_mtime=self.mtime)
+
+    def listdir(self, path):
+        self.listed += 1
+        return [], [RemoteEntry(name, size, self.mtime, None) for name, size in self.files.items()]
+
+    def walk(self, remote_path, workers=1, lister=None):
+        folders, files = lister(self, remote_path, None)
+        yield remote_path, folders, files
+
+
+class FakeTreeClient(object):
+    """
+    Client on a tree of directories (path: (mtime, folders, files)).
+    """
+
+    def __init__(self, tree):
+        self.tree = tree
+        self.listed = []
+
+    def stat(self, path):
+        return SimpleNamespace(st_mtime=self.tree[path][0])
+
+    def listdir(self, path):
+        self.listed.append(path)
+        mtime, folders, files = self.tree[path]
+        return [RemoteEntry(name, None, mtime, None) for name in folders], [RemoteEntry(name, 100, mtime, None) for name in files]
+
+    def walk(self, remote_path, workers=1, lister=None):
+        pending = [(remote_path, None)]
+        while len(pending) > 0:
+            path, mtime = pending.pop(0)
+            folders, files = lister(self, path, mtime)
+            yield path, folders, files
+            pending.extend((os.path.join(path, folder.name), None) for folder in folders)
+
+
+def get_config_dirs(tmp, exclude=''):
+    """
+    Write a configuration using a database in the tmp directory.
+    """
+    with open(os.path.join(tmp.dir, 'seedboxsync.yml'), 'w') as config:
+        config.write("seedbox:\n  exclude_syncing: '%s'\n" % exclude)
+        config.write('local:\n  db_file: %s\n' % os.path.join(tmp.dir, 'seedboxsync.db'))
+
+    return [tmp.dir]
+
+
+def walk_sizes(app, client):
+    """
+    Walk the tree with a new manifest, and save it.
+    """
+    manifest = Manifest(app, '/files')
+    sizes = {entry.name: entry.size for path, folders, files in manifest.walk(client, '') for entry in files}
+    manifest.save()
+    return sizes
+
+
+def test_unchanged_directory(tmp):
+    """
+    Test an unchanged directory of downloaded files is read from the manifest.
+    """
+    with SeedboxSyncTest(config_dirs=get_config_dirs(tmp)) as app:
+        app.run()
+        client = FakeClient()
+        client.files = {'a.mkv': 100}
+        assert walk_sizes(app, client) == {'a.mkv': 100}
+
+        Download.create(path='a.mkv', seedbox_size=100, local_size=100, finished=1)
+        assert walk_sizes(app, client) == {'a.mkv': 100}
+        assert client.listed == 1
+
+
+def test_growing_file(tmp):
+    """
+    Test a directory with files not downloaded yet is listed again, writing a
+    file doesn't change the mtime of its directory.
+    """
+    with SeedboxSyncTest(config_dirs=get_config_dirs(tmp)) as app:
+        app.run()
+        client = FakeClient()
+        client.files = {'a.mkv': 100}
+        assert walk_sizes(app, client) == {'a.mkv': 100}
+
+        client.files = {'a.mkv': 5000}
+        assert walk_sizes(app, client) == {'a.mkv': 5000}
+        assert client.listed == 2
+
+
+def test_part_and_excluded_files(tmp):
+    """
+    Test part files and excluded files don't list a directory again.
+    """
+    with SeedboxSyncTest(config_dirs=get_config_dirs(tmp, exclude='\\.nfo$')) as app:
+        app.run()
+        client = FakeClient()
+        client.files = {'a.mkv': 100, 'b.mkv.part': 50, 'a.nfo': 10}
+        walk_sizes(app, client)
+
+        Download.create(path='a.mkv', seedbox_size=100, local_size=100, finished=1)
+        assert walk_sizes(app, client) == {'a.mkv': 100, 'b.mkv.part': 50, 'a.nfo': 10}
+        assert client.listed == 1
+
+
+def test_walks_of_a_run(tmp):
+    """
+    Test the directories saved by a walk are known by the next walks of the
+    same manifest, ie: the reconciles of a follow.
+    """
+    with SeedboxSyncTest(config_dirs=get_config_dirs(tmp)) as app:
+        app.run()
+        client = FakeTreeClient({'': (1000, ['sub'], ['a.mkv']), 'sub': (1000, [], ['b.mkv'])})
+        Download.create(path='a.mkv', seedbox_size=100, local_size=100, finished=1)
+        Download.create(path='sub/b.mkv', seedbox_size=100, local_size=100, finished=1)
+        manifest = Manifest(app, '/files')
+        list(manifest.walk(client, ''))
+        manifest.save()
+
+        # Unchanged directories are not listed again
+        list(manifest.walk(client, ''))
+        manifest.save()
+        assert client.listed == ['', 'sub']
+
+        # A removed sub-directory is forgotten
+        client.tree = {'': (2000, [], ['a.mkv'])}
+        assert [path for path, folders, files in manifest.walk(client, '')] == ['']
+        manifest.save()
+        assert [directory.path for directory in RemoteDirectory.select()] == ['']
@@ -0,0 +1,51 @@
+import hashlib
+from seedboxsync.core.sync.pieces import file_starts, get_layout, hash_pieces, piece_segments
+
+
+def make_pieces(data: bytes, piece_length: int):
+    """
+    Get the piece hashes of data.
+    """
+    return b''.join(hashlib.sha1(data[i:i + piece_length]).digest() for i in range(0, len(data), piece_length))
+
+
+def test_get_layout():
+    """
+    Test the files of single and multi-file torrents.
+    """
+    assert get_layout({'name': 'a.iso', 'length': 10, 'piece length': 4, 'pieces': b'x' * 60})[2] == [('a.iso', 10)]
+    info = {'name': 'dir', 'piece length': 4, 'pieces': b'x' * 60,
+            'files': [{'length': 3, 'path': ['a.nfo']}, {'length': 7, 'path': ['sub', 'b.mkv']}]}
+    assert get_layout(info) == (4, b'x' * 60, [('dir/a.nfo', 3), ('dir/sub/b.mkv', 7)])
+
+
+def test_piece_segments():
+    """
+    Test pieces across files, with an empty file.
+    """
+    starts = file_starts([3, 0, 7])
+    assert piece_segments(starts, 4, 0) == [(0, 0, 3), (2, 0, 1)]
+    assert piece_segments(starts, 4, 1) == [(2, 1, 4)]
+    assert piece_segments(starts, 4, 2) == [(2, 5, 2)]
+
+
+def test_hash_pieces(tmp_path):
+    """
+    Test valid, corrupted and missing pieces.
+    """
+    data = [b'a' * 5000, b'', b'b' * 12000, b'c' * 3000]
+    paths = []
+    for i, content in enumerate(data):
+        (tmp_path / str(i)).write_bytes(content)
+        paths.append(str(tmp_path / str(i)))
+    lengths = [len(content) for content in data]
+    pieces = make_pieces(b''.join(data), 4096)
+
+    assert set(hash_pieces(paths, lengths, 4096, pieces, workers=2).values()) == {True}
+
+    with open(paths[2], 'r+b') as local:
+        local.seek(5000)
+        local.write(b'x')
+    paths[3] = None
+    assert hash_pieces(paths, lengths, 4096, pieces, workers=2) == {0: True, 1: True, 2: False, 3: True, 4: None}
+    assert hash_pieces(paths, lengths, 4096, pieces, indexes=[2]) == {2: False}
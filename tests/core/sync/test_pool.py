@@ -0,0 +1,141 @@
+import os
+import threading
+from types import SimpleNamespace
+from seedboxsync.core.sync.concurrency import AdaptiveConcurrency
+from seedboxsync.core.sync.pool import TransferPool
+from seedboxsync.core.sync.segmented import get_segmented
+
+
+class FakeClient(object):
+    """
+    Client of a worker, doing nothing.
+    """
+
+    def clone(self, new_transport=False):
+        return self
+
+    def chdir(self, path=None):
+        pass
+
+    def close(self):
+        pass
+
+
+class FakeRangeClient(FakeClient):
+    """
+    Client of a worker, copying byte ranges of a remote file.
+    """
+
+    def __init__(self, data):
+        self.data = data
+        self.ranges = []
+        self.lock = threading.Lock()
+
+    def get_range(self, remote_path, local_path, offset, length, callback=None):
+        with self.lock:
+            self.ranges.append((offset, length))
+        fd = os.open(local_path, os.O_WRONLY)
+        try:
+            os.pwrite(fd, self.data[offset:offset + length], offset)
+        finally:
+            os.close(fd)
+
+        return length
+
+
+def get_app():
+    """
+    Get the parts of the application used by the pool.
+    """
+    log = SimpleNamespace(debug=lambda msg: None, warning=lambda msg: None, error=lambda msg: None)
+    return SimpleNamespace(log=log, sync=FakeClient(), _db=SimpleNamespace(close=lambda: None))
+
+
+def test_join():
+    """
+    Test all queued jobs run before the workers stop.
+    """
+    done = []
+    pool = TransferPool(get_app(), workers=2)
+    for i in range(10):
+        pool.submit(lambda client, i: done.append(i), i)
+    pool.join()
+
+    assert sorted(done) == list(range(10))
+
+
+def test_cancel():
+    """
+    Test pending jobs are dropped on cancel, and the running one is waited.
+    """
+    started = threading.Event()
+    release = threading.Event()
+    done = []
+
+    def blocking(client):
+        started.set()
+        release.wait(5)
+        done.append('running')
+
+    pool = TransferPool(get_app(), workers=1)
+    pool.submit(blocking)
+    started.wait(5)
+    for i in range(5):
+        pool.submit(lambda client, i: done.append(i), i)
+
+    assert pool.cancel() == 5
+    release.set()
+    pool.join()
+
+    assert done == ['running']
+
+
+def test_cancel_waiting_stream():
+    """
+    Test a job taken by a worker waiting for a stream is dropped on cancel.
+    """
+    started = threading.Event()
+    release = threading.Event()
+    done = []
+
+    def blocking(client):
+        started.set()
+        release.wait(5)
+        done.append('running')
+
+    concurrency = AdaptiveConcurrency(get_app().log, minimum=1, maximum=1)
+    pool = TransferPool(get_app(), workers=2, concurrency=concurrency)
+    pool.submit(blocking)
+    started.wait(5)
+    pool.submit(lambda client: done.append('waiting'))
+
+    pool.cancel()
+    release.set()
+    pool.join()
+
+    assert done == ['running']
+
+
+def test_segmented_free_streams(tmp):
+    """
+    Test a segmented download of a pool job takes the streams left free by
+    the idle workers.
+    """
+    data = os.urandom(100000)
+    path = os.path.join(tmp.dir, 'file.part')
+    app = get_app()
+    client = FakeRangeClient(data)
+    concurrency = AdaptiveConcurrency(app.log, minimum=4, maximum=4)
+    copied = []
+
+    pool = TransferPool(app, workers=4, concurrency=concurrency)
+    pool.submit(lambda worker: copied.append(get_segmented(app.log, client, 'file', path, len(data), 4, concurrency=concurrency)))
+    pool.join()
+
+    assert copied == [len(data)]
+    assert sorted(client.ranges) == [(0, 25000), (25000, 25000), (50000, 25000), (75000, 25000)]
+    with open(path, 'rb') as local:
+        assert local.read() == data
+
+    # All streams are given back
+    assert concurrency.reserve(4) == 4
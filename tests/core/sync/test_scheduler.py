@@ -0,0 +1,24 @@
+import pytest
+from seedboxsync.core.sync.scheduler import Scheduler
+
+
+def test_scheduler_order():
+    """
+    Test priorities by pattern, policy and size.
+    """
+    files = [('movies/remux.mkv', 60000, 1), ('series/e02.mkv', 300, 3), ('series/e01.mkv', 200, 4), ('other/a.nfo', 10, 2)]
+
+    scheduler = Scheduler('smallest', ['^series/'], huge_threshold=50000)
+    assert [f[0] for f in sorted(files, key=lambda f: scheduler.priority(*f))] == ['series/e01.mkv', 'series/e02.mkv', 'other/a.nfo', 'movies/remux.mkv']
+    assert scheduler.is_huge(60000) and not scheduler.is_huge(None)
+
+    scheduler = Scheduler('oldest')
+    assert [f[0] for f in sorted(files, key=lambda f: scheduler.priority(*f))] == ['movies/remux.mkv', 'other/a.nfo', 'series/e02.mkv', 'series/e01.mkv']
+
+
+def test_scheduler_bad_policy():
+    """
+    Test an unknown policy is refused.
+    """
+    with pytest.raises(SystemExit):
+        Scheduler('biggest')
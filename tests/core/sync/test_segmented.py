@@ -0,0 +1,86 @@
+import os
+import threading
+from types import SimpleNamespace
+import pytest
+from seedboxsync.core.sync.segmented import get_segmented, preallocate, split_ranges
+
+
+class FakeClient(object):
+    """
+    Client copying byte ranges of a remote file, each one on its own clone.
+    """
+
+    def __init__(self, data, short=None):
+        self.data = data
+        self.short = short
+        self.clones = 0
+        self.lock = threading.Lock()
+
+    def clone(self, new_transport=False):
+        with self.lock:
+            self.clones += 1
+        return self
+
+    def get_range(self, remote_path, local_path, offset, length, callback=None):
+        if offset == self.short:
+            length //= 2
+        fd = os.open(local_path, os.O_WRONLY)
+        try:
+            os.pwrite(fd, self.data[offset:offset + length], offset)
+        finally:
+            os.close(fd)
+        if callback is not None:
+            callback(length)
+
+        return length
+
+    def close(self):
+        pass
+
+
+def test_split_ranges():
+    """
+    Test byte ranges of a segmented download.
+    """
+    assert split_ranges(100, 4) == [(0, 25), (25, 25), (50, 25), (75, 25)]
+    assert split_ranges(10, 3) == [(0, 3), (3, 3), (6, 4)]
+    assert split_ranges(2, 4) == [(0, 1), (1, 1)]
+    assert split_ranges(0, 4) == [(0, 0)]
+
+
+def test_preallocate(tmp):
+    """
+    Test preallocation of the local file.
+    """
+    path = os.path.join(tmp.dir, 'file.part')
+    preallocate(path, 1234)
+    assert os.stat(path).st_size == 1234
+
+
+def test_get_segmented(tmp):
+    """
+    Test a file is downloaded by concurrent ranges, each one on a clone.
+    """
+    data = os.urandom(100001)
+    path = os.path.join(tmp.dir, 'file.part')
+    client = FakeClient(data)
+    copied = []
+
+    log = SimpleNamespace(debug=lambda msg: None)
+    assert get_segmented(log, client, 'file', path, len(data), 4, callback=copied.append) == len(data)
+    assert client.clones == 4
+    assert sum(copied) == len(data)
+    with open(path, 'rb') as local:
+        assert local.read() == data
+
+
+def test_get_segmented_short_read(tmp):
+    """
+    Test a range copied short fails the download.
+    """
+    data = os.urandom(1000)
+    path = os.path.join(tmp.dir, 'file.part')
+
+    log = SimpleNamespace(debug=lambda msg: None)
+    with pytest.raises(IOError, match='Short read'):
+        get_segmented(log, FakeClient(data, short=500), 'file', path, len(data), 2)
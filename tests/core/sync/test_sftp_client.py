@@ -0,0 +1,391 @@
+import hashlib
+import os
+import threading
+import paramiko
+from types import SimpleNamespace
+from seedboxsync.core.sync.abstract_client import RemoteEntry
+from seedboxsync.core.sync.sftp_client import SftpClient
+
+
+class FakeSFTPFile(object):
+    """
+    Opened remote file, read from bytes.
+    """
+
+    def __init__(self, data):
+        self.data = data
+        self.position = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def stat(self):
+        return SimpleNamespace(st_size=len(self.data))
+
+    def seek(self, position):
+        self.position = position
+
+    def prefetch(self, end=None):
+        pass
+
+    def read(self, size):
+        data = self.data[self.position:self.position + size]
+        self.position += len(data)
+        return data
+
+    def readv(self, chunks):
+        for offset, length in chunks:
+            yield self.data[offset:offset + length]
+
+
+class FakeSFTPWriteFile(object):
+    """
+    Remote file opened for writing, stored in the files on close.
+    """
+
+    def __init__(self, files, path):
+        self.files = files
+        self.path = path
+        self.data = b''
+        self.pipelined = False
+        self.writes = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.files[self.path] = self.data
+
+    def set_pipelined(self, pipelined=True):
+        self.pipelined = pipelined
+
+    def write(self, data):
+        self.data += data
+        self.writes += 1
+
+    def chmod(self, mode):
+        self.mode = mode
+
+
+class FakeSFTPClient(object):
+    """
+    sFTP client serving remote files from a dict.
+    """
+
+    def __init__(self, files, transport=None):
+        self.files = files
+        self.transport = transport
+        self.channel = SimpleNamespace(closed=False)
+        self.written = []
+
+    def open(self, path, mode='r'):
+        if 'w' in mode:
+            self.written.append(FakeSFTPWriteFile(self.files, path))
+            return self.written[-1]
+        return FakeSFTPFile(self.files[path])
+
+    def posix_rename(self, old_path, new_path):
+        self.files[new_path] = self.files.pop(old_path)
+
+    def stat(self, path):
+        return SimpleNamespace(st_size=len(self.files[path]))
+
+    def get_channel(self):
+        return self.channel
+
+    def getcwd(self):
+        return None
+
+
+class FakeTransport(object):
+    """
+    Connected transport, until lost.
+    """
+
+    def __init__(self, address=None):
+        self.active = True
+
+    def connect(self, username=None, password=None):
+        pass
+
+    def is_active(self):
+        return self.active
+
+
+def get_client(files):
+    """
+    Get a client on fake remote files.
+    """
+    log = SimpleNamespace(debug=lambda msg: None, warning=lambda msg: None)
+    client = SftpClient(log, 'localhost', 'login', 'password', transport=FakeTransport())
+    client._SftpClient__client = FakeSFTPClient(files)
+    return client
+
+
+def write_part(tmp, data):
+    """
+    Write a local part file.
+    """
+    path = os.path.join(tmp.dir, 'file.part')
+    with open(path, 'wb') as part:
+        part.write(data)
+    return path
+
+
+def test_resume(tmp):
+    """
+    Test resume appends the remote file from the local size.
+    """
+    remote = os.urandom(100000)
+    path = write_part(tmp, remote[:40000])
+
+    copied = get_client({'file': remote}).resume('file', path, overlap=4096)
+    assert copied == 60000
+    with open(path, 'rb') as part:
+        assert part.read() == remote
+
+
+def test_resume_overlap_mismatch(tmp):
+    """
+    Test resume restarts from 0 when the tail of the part file differs.
+    """
+    remote = os.urandom(100000)
+    path = write_part(tmp, remote[:39000] + b'\0' * 1000)
+
+    copied = get_client({'file': remote}).resume('file', path, overlap=4096)
+    assert copied == 100000
+    with open(path, 'rb') as part:
+        assert part.read() == remote
+
+
+def test_resume_bigger_local(tmp):
+    """
+    Test resume restarts from 0 when the part file is bigger than the remote file.
+    """
+    remote = os.urandom(1000)
+    path = write_part(tmp, os.urandom(2000))
+
+    assert get_client({'file': remote}).resume('file', path) == 1000
+    with open(path, 'rb') as part:
+        assert part.read() == remote
+
+
+def test_resume_digest(tmp):
+    """
+    Test the digest of a resumed file covers the existing part too.
+    """
+    remote = os.urandom(100000)
+    path = write_part(tmp, remote[:40000])
+
+    digest = hashlib.sha256()
+    get_client({'file': remote}).resume('file', path, digest=digest)
+    assert digest.hexdigest() == hashlib.sha256(remote).hexdigest()
+
+
+def test_upload(tmp):
+    """
+    Test upload writes the file pipelined, sets its mode on the open handle,
+    then moves it to its final path.
+    """
+    data = os.urandom(100000)
+    path = os.path.join(tmp.dir, 'file.torrent')
+    with open(path, 'wb') as local:
+        local.write(data)
+
+    client = get_client({})
+    uploaded = []
+    client.throttle = lambda direction: uploaded.append
+
+    client.upload(path, 'tmp/file.torrent', 'watch/file.torrent', 0o644)
+    sftp = client._SftpClient__client
+    assert sftp.files == {'watch/file.torrent': data}
+    assert sftp.written[0].pipelined
+    assert sftp.written[0].writes == 4
+    assert sftp.written[0].mode == 0o644
+    assert sum(uploaded) == len(data)
+
+
+def test_upload_default_mode(tmp):
+    """
+    Test upload keeps the server default mode without chmod.
+    """
+    path = os.path.join(tmp.dir, 'file.torrent')
+    with open(path, 'wb') as local:
+        local.write(b'')
+
+    client = get_client({})
+    client.upload(path, 'tmp/file.torrent', 'watch/file.torrent')
+    sftp = client._SftpClient__client
+    assert sftp.files == {'watch/file.torrent': b''}
+    assert not hasattr(sftp.written[0], 'mode')
+
+
+def test_get_range(tmp):
+    """
+    Test a byte range is written at its position in the preallocated file.
+    """
+    remote = os.urandom(100000)
+    path = write_part(tmp, b'\0' * 100000)
+
+    assert get_client({'file': remote}).get_range('file', path, 40000, 50000) == 50000
+    with open(path, 'rb') as part:
+        assert part.read() == b'\0' * 40000 + remote[40000:90000] + b'\0' * 10000
+
+
+def test_get_range_end_of_file(tmp):
+    """
+    Test the copied length of a range stops at the end of the remote file.
+    """
+    remote = os.urandom(1000)
+    path = write_part(tmp, b'\0' * 2000)
+
+    assert get_client({'file': remote}).get_range('file', path, 500, 1500) == 500
+
+
+def test_readv():
+    """
+    Test read of several chunks of a remote file.
+    """
+    remote = os.urandom(1000)
+    assert get_client({'file': remote}).readv('file', [(0, 10), (500, 10)]) == [remote[:10], remote[500:510]]
+
+
+class FakeLister(object):
+    """
+    Lister of a tree of directories (path: (folders, files)), recording the
+    listed paths with their mtime from the parent listing.
+    """
+
+    TREE = {
+        '': (['a', 'b'], ['root.mkv']),
+        'a': (['c'], ['a.mkv']),
+        'b': ([], ['b.mkv']),
+        'a/c': ([], ['c.mkv']),
+    }
+
+    def __init__(self):
+        self.listed = []
+        self.clients = set()
+        self.lock = threading.Lock()
+
+    def __call__(self, client, path, mtime):
+        with self.lock:
+            self.listed.append((path, mtime))
+            self.clients.add(client)
+        folders, files = self.TREE[path]
+        return [RemoteEntry(name, None, len(name), None) for name in folders], [RemoteEntry(name, 100, 0, None) for name in files]
+
+
+def test_walk():
+    """
+    Test the tree is walked breadth-first, with the mtime of each directory
+    from its parent listing.
+    """
+    lister = FakeLister()
+    client = get_client({})
+
+    walked = [(path, [f.name for f in folders], [f.name for f in files]) for path, folders, files in client.walk('', lister=lister)]
+    assert walked == [('', ['a', 'b'], ['root.mkv']), ('a', ['c'], ['a.mkv']), ('b', [], ['b.mkv']), ('a/c', [], ['c.mkv'])]
+    assert lister.listed == [('', None), ('a', 1), ('b', 1), ('a/c', 1)]
+    assert lister.clients == {client}
+
+
+def test_walk_workers():
+    """
+    Test the tree is walked by concurrent listings, on cloned clients.
+    """
+    lister = FakeLister()
+    client = get_client({})
+
+    walked = {path: sorted(f.name for f in files) for path, folders, files in client.walk('', workers=3, lister=lister)}
+    assert walked == {path: sorted(files) for path, (folders, files) in FakeLister.TREE.items()}
+    assert sorted(lister.listed) == [('', None), ('a', 1), ('a/c', 1), ('b', 1)]
+    assert client not in lister.clients
+
+
+def test_transport_lost(monkeypatch):
+    """
+    Test a lost transport is connected again before the next request.
+    """
+    transports = []
+    clients = []
+
+    def new_transport(address):
+        transports.append(FakeTransport(address))
+        return transports[-1]
+
+    def from_transport(transport):
+        clients.append(FakeSFTPClient({'file': b'data'}, transport))
+        return clients[-1]
+
+    monkeypatch.setattr(paramiko, 'Transport', new_transport)
+    monkeypatch.setattr(paramiko.SFTPClient, 'from_transport', from_transport)
+    log = SimpleNamespace(debug=lambda msg: None, warning=lambda msg: None)
+    client = SftpClient(log, 'localhost', 'login', 'password')
+
+    assert client.stat('file').st_size == 4
+    transports[0].active = False
+    assert client.stat('file').st_size == 4
+    assert len(transports) == 2
+    assert clients[-1].transport is transports[1]
+
+    # A clone shares the new transport
+    assert client.clone()._SftpClient__transport is transports[1]
+
+
+def test_clone_transport_lost(monkeypatch):
+    """
+    Test a clone takes the new transport of its owner after a drop.
+    """
+    transports = []
+    clients = []
+
+    def new_transport(address):
+        transports.append(FakeTransport(address))
+        return transports[-1]
+
+    def from_transport(transport):
+        if not transport.is_active():
+            raise paramiko.SSHException('SSH session not active')
+        clients.append(FakeSFTPClient({'file': b'data'}, transport))
+        return clients[-1]
+
+    monkeypatch.setattr(paramiko, 'Transport', new_transport)
+    monkeypatch.setattr(paramiko.SFTPClient, 'from_transport', from_transport)
+    log = SimpleNamespace(debug=lambda msg: None, warning=lambda msg: None)
+    client = SftpClient(log, 'localhost', 'login', 'password')
+    clone = client.clone()
+    assert clone.stat('file').st_size == 4
+
+    transports[0].active = False
+    assert clone.stat('file').st_size == 4
+    assert len(transports) == 2
+    assert clients[-1].transport is transports[1]
+    assert clone.clone().stat('file').st_size == 4
+    assert client.stat('file').st_size == 4
+    assert len(transports) == 2
+
+
+def test_channel_lost(monkeypatch):
+    """
+    Test a lost sFTP channel is opened again on the same transport.
+    """
+    clients = []
+
+    def from_transport(transport):
+        clients.append(FakeSFTPClient({'file': b'data'}, transport))
+        return clients[-1]
+
+    monkeypatch.setattr(paramiko.SFTPClient, 'from_transport', from_transport)
+    transport = FakeTransport()
+    client = get_client({})
+    client._SftpClient__client = None
+    client._SftpClient__transport = transport
+
+    assert client.stat('file').st_size == 4
+    clients[0].channel.closed = True
+    assert client.stat('file').st_size == 4
+    assert len(clients) == 2
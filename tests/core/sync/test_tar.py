@@ -0,0 +1,38 @@
+import io
+import tarfile
+from seedboxsync.core.sync.tar import extract_stream, tar_command
+
+
+def make_tar(files: dict):
+    """
+    Make an in-memory tar stream.
+    """
+    stream = io.BytesIO()
+    with tarfile.open(fileobj=stream, mode='w|') as archive:
+        for name, data in files.items():
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            archive.addfile(info, io.BytesIO(data))
+    stream.seek(0)
+
+    return stream
+
+
+def test_tar_command():
+    """
+    Test the tar command quoting.
+    """
+    assert tar_command('/home/me/files', ['a.nfo', '-b.srt']) == "tar chf - --hard-dereference -C /home/me/files -- a.nfo -b.srt"
+    assert tar_command("/home/me/it's", ['c d.txt']) == "tar chf - --hard-dereference -C '/home/me/it'\"'\"'s' -- 'c d.txt'"
+
+
+def test_extract_stream(tmp_path):
+    """
+    Test extracting only the expected files while streaming.
+    """
+    stream = make_tar({'a.nfo': b'a' * 100000, 'unexpected': b'x', 'empty': b''})
+    destinations = {'a.nfo': str(tmp_path / 'a.nfo.part'), 'empty': str(tmp_path / 'empty.part')}
+
+    assert list(extract_stream(stream, destinations, chunk_size=4096)) == [('a.nfo', 100000), ('empty', 0)]
+    assert (tmp_path / 'a.nfo.part').read_bytes() == b'a' * 100000
+    assert not (tmp_path / 'unexpected').exists()
@@ -0,0 +1,71 @@
+import os
+import sqlite3
+import pytest
+from seedboxsync.main import SeedboxSyncTest
+from seedboxsync.core.dao.download import Download
+from seedboxsync.core.db import BatchedTransaction, get_pragmas
+
+
+def get_config_dirs(tmp, db=''):
+    """
+    Write a configuration using a database in the tmp directory.
+    """
+    with open(os.path.join(tmp.dir, 'seedboxsync.yml'), 'w') as config:
+        config.write('local:\n  db_file: %s\n' % os.path.join(tmp.dir, 'seedboxsync.db'))
+        config.write('local.db:\n%s' % db)
+
+    return [tmp.dir]
+
+
+def count_downloads(tmp):
+    """
+    Count the downloads committed, from another connection.
+    """
+    with sqlite3.connect(os.path.join(tmp.dir, 'seedboxsync.db')) as db:
+        return db.execute('SELECT COUNT(*) FROM download').fetchone()[0]
+
+
+def test_get_pragmas(tmp):
+    """
+    Test pragmas are read from the configuration, disabled ones are left to
+    SQLite, and applied on the connection.
+    """
+    with SeedboxSyncTest(config_dirs=get_config_dirs(tmp, '  cache_size: -4000\n  mmap_size: false\n')) as app:
+        app.run()
+        assert get_pragmas(app) == {'journal_mode': 'wal', 'synchronous': 'normal', 'cache_size': -4000}
+        assert app._db.execute_sql('PRAGMA journal_mode').fetchone()[0] == 'wal'
+        assert app._db.execute_sql('PRAGMA cache_size').fetchone()[0] == -4000
+
+
+def test_batched_transaction(tmp):
+    """
+    Test writes are committed by batches, and the last ones at the end.
+    """
+    with SeedboxSyncTest(config_dirs=get_config_dirs(tmp)) as app:
+        app.run()
+        committed = []
+        with BatchedTransaction(app._db, 3) as batch:
+            for i in range(5):
+                Download.create(path='file%s' % i, seedbox_size=i)
+                batch.tick()
+                committed.append(count_downloads(tmp))
+
+        assert committed == [0, 0, 3, 3, 3]
+        assert count_downloads(tmp) == 5
+
+
+def test_batched_transaction_error(tmp):
+    """
+    Test the writes of the batch in progress are rolled back on error.
+    """
+    with SeedboxSyncTest(config_dirs=get_config_dirs(tmp)) as app:
+        app.run()
+        with pytest.raises(ValueError):
+            with BatchedTransaction(app._db, 3) as batch:
+                Download.insert_many([{'path': 'file%s' % i, 'seedbox_size': i} for i in range(3)]).execute()
+                batch.tick(3)
+                Download.create(path='file3', seedbox_size=3)
+                batch.tick()
+                raise ValueError()
+
+        assert count_downloads(tmp) == 3
@@ -0,0 +1,25 @@
+import os
+import sys
+import pytest
+from seedboxsync.core.inotify import IN_CLOSE_WRITE, IN_MOVED_TO, Inotify
+
+
+@pytest.mark.skipif(not sys.platform.startswith('linux'), reason='inotify is Linux only')
+def test_inotify(tmp_path):
+    """
+    Test written and moved files are reported.
+    """
+    inotify = Inotify()
+    try:
+        wd = inotify.add_watch(str(tmp_path), IN_CLOSE_WRITE | IN_MOVED_TO)
+        assert inotify.read(0) == []
+
+        (tmp_path / 'a.torrent').write_bytes(b'd4:infodee')
+        os.rename(str(tmp_path / 'a.torrent'), str(tmp_path / 'b.torrent'))
+
+        events = []
+        while len(events) < 2:
+            events += inotify.read(1)
+        assert [(event[0], event[1], event[3]) for event in events] == [(wd, IN_CLOSE_WRITE, 'a.torrent'), (wd, IN_MOVED_TO, 'b.torrent')]
+    finally:
+        inotify.close()
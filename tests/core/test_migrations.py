@@ -0,0 +1,67 @@
+import os
+import sqlite3
+from seedboxsync.main import SeedboxSyncTest
+from seedboxsync.core.migrations import DB_VERSION
+
+# Schema of a version 1 database
+SCHEMA_V1 = """
+CREATE TABLE "download" ("id" INTEGER NOT NULL PRIMARY KEY, "path" TEXT NOT NULL, "seedbox_size" INTEGER NOT NULL,
+    "local_size" INTEGER NOT NULL, "started" DATETIME NOT NULL, "finished" DATETIME NOT NULL);
+CREATE TABLE "torrent" ("id" INTEGER NOT NULL PRIMARY KEY, "name" TEXT NOT NULL, "announce" TEXT NOT NULL, "sent" DATETIME NOT NULL);
+CREATE TABLE "seedboxsync" ("id" INTEGER NOT NULL PRIMARY KEY, "key" VARCHAR(255) NOT NULL, "value" TEXT NOT NULL);
+CREATE UNIQUE INDEX "seedboxsync_key" ON "seedboxsync" ("key");
+INSERT INTO "seedboxsync" ("key", "value") VALUES ('db_version', '1');
+INSERT INTO "download" ("path", "seedbox_size", "local_size", "started", "finished")
+    VALUES ('a/file.mkv', 10, 10, '2020-01-01 00:00:00', '2020-01-01 00:01:00');
+"""
+
+
+def get_config_dirs(tmp):
+    """
+    Write a configuration using a database in the tmp directory.
+    """
+    with open(os.path.join(tmp.dir, 'seedboxsync.yml'), 'w') as config:
+        config.write('local:\n  db_file: %s\n' % os.path.join(tmp.dir, 'seedboxsync.db'))
+
+    return [tmp.dir]
+
+
+def get_indexes(db_file):
+    """
+    Get indexes names of a database.
+    """
+    with sqlite3.connect(db_file) as db:
+        return {row[0] for row in db.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+
+
+def test_migrate_from_version_1(tmp):
+    """
+    Test upgrade of a version 1 database.
+    """
+    db_file = os.path.join(tmp.dir, 'seedboxsync.db')
+    with sqlite3.connect(db_file) as db:
+        db.executescript(SCHEMA_V1)
+
+    with SeedboxSyncTest(config_dirs=get_config_dirs(tmp)) as app:
+        app.run()
+
+    assert {'download_path', 'download_finished', 'download_started', 'download_seedbox_size_seedbox_mtime',
+            'torrent_sent', 'torrent_info_hash'} <= get_indexes(db_file)
+    with sqlite3.connect(db_file) as db:
+        assert db.execute("SELECT value FROM seedboxsync WHERE key = 'db_version'").fetchone()[0] == str(DB_VERSION)
+        assert db.execute("SELECT path, checksum, seedbox_mtime FROM download").fetchall() == [('a/file.mkv', None, None)]
+        assert db.execute("SELECT piece_length, pieces, files, info_hash FROM torrent").fetchall() == []
+
+
+def test_create_last_version(tmp):
+    """
+    Test creation of a new database.
+    """
+    db_file = os.path.join(tmp.dir, 'seedboxsync.db')
+    with SeedboxSyncTest(config_dirs=get_config_dirs(tmp)) as app:
+        app.run()
+
+    assert {'download_path', 'download_finished', 'download_started', 'download_seedbox_size_seedbox_mtime',
+            'torrent_sent', 'torrent_info_hash'} <= get_indexes(db_file)
+    with sqlite3.connect(db_file) as db:
+        assert db.execute("SELECT value FROM seedboxsync WHERE key = 'db_version'").fetchone()[0] == str(DB_VERSION)
@@ -0,0 +1,32 @@
+import hashlib
+from unittest import mock
+from bcoding import bdecode, bencode
+from seedboxsync.ext.ext_bcoding import Bcoding
+
+TORRENT = 'tests/resources/Fedora-Server-dvd-x86_64-32.torrent'
+
+
+def test_get_torrent_infos():
+    """
+    Test the wanted keys and the infohash match a full decode.
+    """
+    with open(TORRENT, 'rb') as torrent:
+        decoded = bdecode(torrent.read())
+
+    torrent_info = Bcoding(mock.Mock()).get_torrent_infos(TORRENT)
+    assert torrent_info['announce'] == decoded['announce']
+    assert torrent_info['info'] == decoded['info']
+    assert torrent_info['info_hash'] == hashlib.sha1(bencode(decoded['info'])).hexdigest()
+
+
+def test_get_torrent_infos_malformed(tmp_path):
+    """
+    Test malformed torrents are detected.
+    """
+    with open(TORRENT, 'rb') as torrent:
+        data = torrent.read()
+
+    bcoding = Bcoding(mock.Mock())
+    for i, content in enumerate([data[:-100], b'', b'li1ee', b'd8:announce3:urle', b'd4:infod4:name', b'd4:infoi1x2ee', b'd4:infodi1e1:aee']):
+        (tmp_path / str(i)).write_bytes(content)
+        assert bcoding.get_torrent_infos(str(tmp_path / str(i))) is None, content
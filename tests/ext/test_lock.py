@@ -0,0 +1,71 @@
+import os
+import threading
+from unittest import mock
+from seedboxsync.ext.ext_lock import Lock
+
+
+def test_lock_unlock(tmp):
+    """
+    Test a task is locked by a pid file, removed on unlock.
+    """
+    lock_file = os.path.join(tmp.dir, 'lock', 'task.pid')
+    lock = Lock(mock.Mock())
+
+    lock.lock_or_exit(lock_file)
+    with open(lock_file) as pid:
+        assert pid.read() == str(os.getpid())
+    assert lock.is_locked(lock_file)
+
+    lock.unlock(lock_file)
+    assert not os.path.exists(lock_file)
+    assert not lock.is_locked(lock_file)
+
+
+def test_hold_release(tmp):
+    """
+    Test held pid files are kept while the tasks are locked in process, and
+    removed on release.
+    """
+    lock_files = [os.path.join(tmp.dir, 'blackhole.pid'), os.path.join(tmp.dir, 'download.pid')]
+    lock = Lock(mock.Mock())
+
+    lock.hold(lock_files)
+    assert all(os.path.isfile(lock_file) for lock_file in lock_files)
+    assert not lock.is_locked(lock_files[0])
+
+    # A task is locked in process, the pid file is kept on unlock
+    lock.lock_or_exit(lock_files[0])
+    assert lock.is_locked(lock_files[0])
+    assert not lock.is_locked(lock_files[1])
+    lock.unlock(lock_files[0])
+    assert not lock.is_locked(lock_files[0])
+    assert os.path.isfile(lock_files[0])
+
+    lock.release()
+    assert not any(os.path.exists(lock_file) for lock_file in lock_files)
+
+
+def test_hold_wait(tmp):
+    """
+    Test a task locked in process waits for the running one.
+    """
+    lock_file = os.path.join(tmp.dir, 'download.pid')
+    lock = Lock(mock.Mock())
+    lock.hold([lock_file])
+    lock.lock_or_exit(lock_file)
+
+    done = threading.Event()
+
+    def task():
+        lock.lock_or_exit(lock_file)
+        done.set()
+        lock.unlock(lock_file)
+
+    thread = threading.Thread(target=task)
+    thread.start()
+    assert not done.wait(0.1)
+
+    lock.unlock(lock_file)
+    thread.join(5)
+    assert done.is_set()
+    lock.release()